@@ -3,15 +3,31 @@ Flask-based web admin panel for bot management - Enhanced 2026 Edition.
 Includes support ticket management, agent management, and analytics with Chart.js.
 """
 
-from flask import Flask, render_template_string, request, redirect, url_for, session, jsonify, send_file
+from flask import Flask, Response, abort, render_template, request, redirect, url_for, session, jsonify
 import aiosqlite
 import asyncio
+import atexit
 import configparser
+import gzip
+import hashlib
+import json
+import logging
+import queue
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from functools import wraps
 from datetime import datetime, timedelta
 import os
-import zipfile
-import tempfile
+
+from jinja2 import DictLoader
+
+from database import Database, GENERATION_PREFIX
+from attachments import TELEGRAM_API_URL as DEFAULT_API_URL, stream_attachments_zip
+from exports import EXPORT_FORMATS, ExportError, parse_export, export_chunks, export_filename
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
@@ -23,6 +39,160 @@ config.read('config.ini')
 DB_PATH = config.get('database', 'path', fallback='bot_data.db')
 ADMIN_USERNAME = config.get('admin_panel', 'username', fallback='admin')
 ADMIN_PASSWORD = config.get('admin_panel', 'password', fallback='admin123')
+BOT_TOKEN = config.get('bot', 'token', fallback='')
+TELEGRAM_API_URL = config.get('bot', 'api_url', fallback=DEFAULT_API_URL)
+
+USERS_PAGE_SIZE = 100
+USER_SORTS = ('created_at', 'user_id', 'referral_count')
+USER_FILTERS = {
+    'premium': 'u.is_premium = 1',
+    'banned': 'u.is_banned = 1',
+    'referred': 'u.referred_by IS NOT NULL',
+}
+TICKETS_PAGE_SIZE = 50
+TICKET_MESSAGES_PAGE_SIZE = 100  # Messages per page of a ticket's conversation
+TICKET_ATTACHMENTS_PAGE_SIZE = 50
+TICKET_STATUSES = ('open', 'pending', 'resolved', 'closed')
+USER_BULK_ACTIONS = {
+    'premium': 'is_premium = 1, premium_expiry = ?',
+    'remove_premium': 'is_premium = 0, premium_expiry = NULL',
+    'ban': 'is_banned = 1',
+    'unban': 'is_banned = 0',
+}
+BULK_CHUNK_SIZE = 500  # IDs per UPDATE ... WHERE id IN (...) statement
+ASYNC_TIMEOUT = 30  # Seconds a route waits for its database work
+POOL_SIZE = 4  # Database connections kept open by the shared runtime
+STREAM_INTERVAL = 5  # Seconds between live dashboard stat updates
+SSE_KEEPALIVE = 15  # Seconds of silence before a keepalive comment is sent
+PAGE_CACHE_SIZE = 128  # Rendered pages kept for revalidation
+GZIP_MIN_SIZE = 1024  # Smaller cached pages are not worth compressing
+ASSET_TYPES = {'.css': 'text/css; charset=utf-8', '.js': 'application/javascript; charset=utf-8'}
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'  # Names change with content
+
+
+class ConnectionPool:
+    """Bounded pool of aiosqlite connections used from one event loop."""
+    
+    def __init__(self, db_path, size=POOL_SIZE):
+        """Initialize the pool; connections are opened on demand."""
+        self.db_path = db_path
+        self._idle = []
+        self._available = asyncio.Semaphore(size)
+    
+    async def _connect(self):
+        """Open a connection whose worker thread never blocks interpreter exit."""
+        connection = aiosqlite.connect(self.db_path)
+        # Idle connections of a loop that ended without close_pool() would
+        # otherwise keep the process alive
+        connection.daemon = True
+        return await connection
+    
+    @asynccontextmanager
+    async def connection(self):
+        """Borrow a connection, returning it to the pool afterwards."""
+        async with self._available:
+            db = self._idle.pop() if self._idle else await self._connect()
+            db.row_factory = None
+            try:
+                yield db
+            finally:
+                try:
+                    if db.in_transaction:
+                        await db.rollback()
+                    self._idle.append(db)
+                except Exception:
+                    await db.close()
+    
+    async def close(self):
+        """Close all idle connections."""
+        while self._idle:
+            await self._idle.pop().close()
+
+
+class AsyncRuntime:
+    """
+    One long-lived event loop in a background thread shared by all requests.
+    Flask worker threads submit coroutines to it instead of creating a loop
+    per request, and database connections are pooled on it.
+    """
+    
+    def __init__(self):
+        """Initialize the runtime; the loop starts on first use."""
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    @property
+    def loop(self):
+        """The shared event loop, started if needed."""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name='admin-panel-loop', daemon=True
+                )
+                self._thread.start()
+            return self._loop
+    
+    def run(self, coro, timeout=ASYNC_TIMEOUT):
+        """Run a coroutine on the shared loop and wait for its result."""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+    
+    @staticmethod
+    async def _shutdown():
+        """Cancel background tasks (such as live stats) and close pooled connections."""
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await close_pool()
+    
+    def stop(self):
+        """Close pooled connections, stop the loop and wait for its thread."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(ASYNC_TIMEOUT)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+runtime = AsyncRuntime()
+atexit.register(runtime.stop)
+
+
+def run_async(coro):
+    """Run a coroutine from a Flask route on the shared event loop."""
+    return runtime.run(coro)
+
+
+_pools = weakref.WeakKeyDictionary()  # Event loop -> ConnectionPool
+
+
+def db_connection():
+    """Borrow a pooled connection on the running loop: `async with db_connection() as db`."""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None or pool.db_path != DB_PATH:
+        if pool:
+            loop.create_task(pool.close())
+        pool = _pools[loop] = ConnectionPool(DB_PATH)
+    return pool.connection()
+
+
+async def close_pool():
+    """Close the connection pool of the running loop."""
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool:
+        await pool.close()
 
 
 def login_required(f):
@@ -35,110 +205,404 @@ def login_required(f):
     return decorated_function
 
 
-async def get_users():
-    """Get all users from database."""
-    async with aiosqlite.connect(DB_PATH) as db:
+def cached_page(*tables):
+    """
+    Decorator serving GET requests from the page cache while the generations
+    of `tables` are unchanged; If-None-Match revalidations get a 304.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET':
+                return f(*args, **kwargs)
+            
+            etag = page_etag(request.full_path, run_async(get_data_version(tables)))
+            if etag in request.if_none_match:
+                page = None
+            else:
+                page = page_cache.get(etag)
+                if page is None:
+                    response = app.make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    page = page_cache.put(etag, response.content_type, response.get_data())
+            
+            status, body, headers = page_response(etag, page, request.headers.get('Accept-Encoding', ''))
+            return Response(body, status=status, headers=headers)
+        return decorated_function
+    return decorator
+
+
+def user_list_query(args):
+    """
+    Read the users page search, filters and sort from request arguments.
+    Returns (query, options): the non-empty arguments to carry into page links
+    and the matching get_users keyword arguments.
+    """
+    query = {
+        'q': args.get('q', '').strip(),
+        'sort': args.get('sort', '') if args.get('sort') in USER_SORTS else '',
+        'order': 'asc' if args.get('order') == 'asc' else '',
+    }
+    query.update({name: '1' for name in USER_FILTERS if args.get(name)})
+    query = {key: value for key, value in query.items() if value}
+    
+    options = {
+        'search': query.get('q', ''),
+        'filters': [name for name in USER_FILTERS if name in query],
+        'sort': query.get('sort'),
+        'descending': query.get('order') != 'asc',
+    }
+    return query, options
+
+
+def user_search_query(search):
+    """Turn search text into an FTS5 query matching word prefixes; None if empty."""
+    terms = [term.lstrip('@').replace('"', '""') for term in search.split()]
+    terms = [f'"{term}"*' for term in terms if term]
+    return ' '.join(terms) or None
+
+
+async def get_users(cursor=None, limit=USERS_PAGE_SIZE, search='', filters=(),
+                    sort=None, descending=True):
+    """
+    Get a page of users matching a search and filters, in sort order.
+    A numeric search finds a user_id; other text matches name and username
+    word prefixes. Searches sort by user_id unless another sort is given.
+    Returns (users, next_cursor); the cursor is "<sort value>,user_id" of the last row.
+    """
+    search = (search or '').strip()
+    if sort not in USER_SORTS:
+        sort = 'user_id' if search else 'created_at'
+    
+    tables = 'users u'
+    id_column = 'u.user_id'
+    conditions, params = [], []
+    if search.isdigit():
+        conditions.append('u.user_id = ?')
+        params.append(int(search))
+    elif search:
+        match = user_search_query(search)
+        if match is None:
+            return [], None
+        if sort == 'user_id':
+            # Walk the full-text index in rowid order so LIMIT stops early
+            tables = 'users_fts f JOIN users u ON u.user_id = f.rowid'
+            id_column = 'f.rowid'
+            conditions.append('users_fts MATCH ?')
+        else:
+            conditions.append('u.user_id IN (SELECT rowid FROM users_fts WHERE users_fts MATCH ?)')
+        params.append(match)
+    
+    conditions.extend(USER_FILTERS[name] for name in filters if name in USER_FILTERS)
+    
+    try:
+        value, user_id = cursor.rsplit(',', 1)
+        user_id = int(user_id)
+        if sort != 'created_at':
+            value = int(value)
+    except (AttributeError, ValueError):
+        cursor = None
+    
+    comparison = '<' if descending else '>'
+    direction = 'DESC' if descending else 'ASC'
+    if sort == 'user_id':
+        if cursor:
+            conditions.append(f'{id_column} {comparison} ?')
+            params.append(user_id)
+        order_by = f'{id_column} {direction}'
+    else:
+        if cursor:
+            conditions.append(f'(u.{sort}, u.user_id) {comparison} (?, ?)')
+            params.extend((value, user_id))
+        order_by = f'u.{sort} {direction}, u.user_id {direction}'
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    query = f'SELECT u.* FROM {tables} {where} ORDER BY {order_by} LIMIT ?'
+    
+    async with db_connection() as db:
         db.row_factory = aiosqlite.Row
-        async with db.execute('SELECT * FROM users ORDER BY created_at DESC LIMIT 100') as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+        try:
+            async with db.execute(query, (*params, limit)) as db_cursor:
+                users = [dict(row) for row in await db_cursor.fetchall()]
+        except aiosqlite.OperationalError as e:
+            # Search text the full-text query parser rejects matches nothing
+            logger.debug(f"User search {search!r} failed: {e}")
+            return [], None
+    
+    next_cursor = None
+    if len(users) == limit:
+        next_cursor = f"{users[-1][sort]},{users[-1]['user_id']}"
+    return users, next_cursor
 
 
 async def get_stats():
-    """Get bot statistics."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Total users
-        async with db.execute('SELECT COUNT(*) FROM users') as cursor:
-            total_users = (await cursor.fetchone())[0]
-        
-        # Premium users
-        async with db.execute('SELECT COUNT(*) FROM users WHERE is_premium = 1') as cursor:
-            premium_users = (await cursor.fetchone())[0]
-        
-        # Banned users
-        async with db.execute('SELECT COUNT(*) FROM users WHERE is_banned = 1') as cursor:
-            banned_users = (await cursor.fetchone())[0]
-        
-        # Total requests today
-        today = datetime.now().date()
-        async with db.execute('SELECT SUM(count) FROM usage WHERE date = ?', (today,)) as cursor:
-            row = await cursor.fetchone()
-            today_requests = row[0] if row[0] else 0
-        
-        # Pending payments
-        async with db.execute('SELECT COUNT(*) FROM payment_proofs WHERE status = "pending"') as cursor:
-            pending_payments = (await cursor.fetchone())[0]
-        
-        # Open tickets
-        async with db.execute('SELECT COUNT(*) FROM support_tickets WHERE status != "resolved"') as cursor:
-            open_tickets = (await cursor.fetchone())[0]
-        
-        # Total agents
-        async with db.execute('SELECT COUNT(*) FROM agents') as cursor:
-            total_agents = (await cursor.fetchone())[0]
-        
-        # Online agents
-        async with db.execute('SELECT COUNT(*) FROM agents WHERE is_online = 1') as cursor:
-            online_agents = (await cursor.fetchone())[0]
+    """Get bot statistics from the counters maintained by the database triggers."""
+    today = datetime.now().date()
+    async with db_connection() as db:
+        async with db.execute(
+            'SELECT name, value FROM stats_counters WHERE name NOT LIKE ? OR name = ?',
+            ('requests:%', f'requests:{today}')
+        ) as cursor:
+            counters = dict(await cursor.fetchall())
         
         return {
-            'total_users': total_users,
-            'premium_users': premium_users,
-            'banned_users': banned_users,
-            'today_requests': today_requests,
-            'pending_payments': pending_payments,
-            'open_tickets': open_tickets,
-            'total_agents': total_agents,
-            'online_agents': online_agents,
+            'total_users': counters.get('users_total', 0),
+            'premium_users': counters.get('users_premium', 0),
+            'banned_users': counters.get('users_banned', 0),
+            'today_requests': counters.get(f'requests:{today}', 0),
+            'pending_payments': counters.get('payments_pending', 0),
+            'open_tickets': counters.get('tickets_open', 0),
+            'total_agents': counters.get('agents_total', 0),
+            'online_agents': counters.get('agents_online', 0),
         }
 
 
-async def get_chart_data():
-    """Get data for analytics charts."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        # User growth over last 7 days
-        user_growth = []
-        for i in range(7, 0, -1):
-            date = (datetime.now() - timedelta(days=i)).date()
-            async with db.execute(
-                'SELECT COUNT(*) FROM users WHERE DATE(created_at) = ?', (date,)
-            ) as cursor:
-                count = (await cursor.fetchone())[0]
-                user_growth.append({'date': str(date), 'count': count})
+async def get_live_stats():
+    """Dashboard statistics plus today's sign-ups."""
+    stats = await get_stats()
+    async with db_connection() as db:
+        async with db.execute(
+            "SELECT COUNT(*) FROM users WHERE created_at >= date('now')"
+        ) as cursor:
+            stats['new_users_today'] = (await cursor.fetchone())[0]
+    return stats
+
+
+class StatsStream:
+    """
+    Computes live dashboard stats once per interval and fans the changes out to
+    every subscriber, so N open dashboards cost one computation, not N.
+    Subscribers are callables receiving (event, data) tuples; subscribe and
+    unsubscribe on the event loop the stream runs on.
+    """
+    
+    def __init__(self, compute=get_live_stats, interval=STREAM_INTERVAL):
+        """Initialize the stream; it only runs while someone is subscribed."""
+        self.compute = compute
+        self.interval = interval
+        self._subscribers = set()
+        self._snapshot = None
+        self._task = None
+    
+    def subscribe(self, send):
+        """Add a subscriber; it gets the latest snapshot, then deltas."""
+        self._subscribers.add(send)
+        if self._snapshot is not None:
+            send(('snapshot', self._snapshot))
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+    
+    def unsubscribe(self, send):
+        """Remove a subscriber; the stream stops after the last one leaves."""
+        self._subscribers.discard(send)
+    
+    def close(self):
+        """Stop computing stats."""
+        if self._task:
+            self._task.cancel()
+    
+    def _publish(self, event, data):
+        """Send an event to every subscriber."""
+        for send in list(self._subscribers):
+            send((event, data))
+    
+    async def _run(self):
+        """Recompute stats every interval and publish what changed."""
+        previous_time = None
+        while self._subscribers:
+            try:
+                stats = await self.compute()
+            except Exception as e:
+                logger.error(f"Error computing live stats: {e}")
+            else:
+                now = asyncio.get_running_loop().time()
+                if self._snapshot is None:
+                    stats['requests_per_minute'] = 0
+                    self._publish('snapshot', stats)
+                else:
+                    # Requests per minute from the growth of today's request counter
+                    growth = max(stats['today_requests'] - self._snapshot['today_requests'], 0)
+                    stats['requests_per_minute'] = round(growth * 60 / max(now - previous_time, 1e-6))
+                    changes = {
+                        name: value for name, value in stats.items()
+                        if self._snapshot.get(name) != value
+                    }
+                    if changes:
+                        self._publish('delta', changes)
+                self._snapshot = stats
+                previous_time = now
+            await asyncio.sleep(self.interval)
+        self._snapshot = None
+
+
+def format_sse(event, data):
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+live_stats = StatsStream()  # Runs on the shared runtime loop
+
+
+# Chart windows (days) and bucket granularities offered on the dashboard
+CHART_WINDOWS = (7, 30, 90, 365)
+CHART_GRANULARITIES = {
+    # name: (SQL bucket expression template, bucket step)
+    'hour': ("strftime('%Y-%m-%d %H:00', {col})", timedelta(hours=1)),
+    'day': ("date({col})", timedelta(days=1)),
+    'week': ("date({col}, 'weekday 0', '-6 days')", timedelta(weeks=1)),
+}
+MAX_HOURLY_WINDOW = 30  # Hourly buckets beyond this make unreadable charts
+
+
+def _chart_buckets(start, end, granularity):
+    """List bucket labels from start to end, matching the SQL bucket expressions."""
+    if granularity == 'hour':
+        current, fmt = start, '%Y-%m-%d %H:00'
+    elif granularity == 'week':
+        current, fmt = start - timedelta(days=start.weekday()), '%Y-%m-%d'
+    else:
+        current, fmt = start, '%Y-%m-%d'
+    
+    step = CHART_GRANULARITIES[granularity][1]
+    buckets = []
+    while current < end:
+        buckets.append(current.strftime(fmt))
+        current += step
+    return buckets
+
+
+async def get_chart_data(days=7, granularity='day'):
+    """
+    Get data for analytics charts over the last `days` days (including today).
+    Each series is computed with one range-filtered GROUP BY query. The usage
+    table only has daily resolution, so hourly request data is bucketed by day.
+    """
+    if days not in CHART_WINDOWS:
+        days = CHART_WINDOWS[0]
+    if granularity not in CHART_GRANULARITIES or (
+            granularity == 'hour' and days > MAX_HOURLY_WINDOW):
+        granularity = 'day'
+    request_granularity = 'day' if granularity == 'hour' else granularity
+    
+    end = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+    start = end - timedelta(days=days)
+    
+    async with db_connection() as db:
+        # User growth: range predicate on created_at can use idx_users_created
+        bucket = CHART_GRANULARITIES[granularity][0].format(col='created_at')
+        async with db.execute(f'''
+            SELECT {bucket} AS bucket, COUNT(*) FROM users
+            WHERE created_at >= ? AND created_at < ?
+            GROUP BY bucket
+        ''', (start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S'))) as cursor:
+            new_users = dict(await cursor.fetchall())
         
-        # Requests over last 7 days
-        request_stats = []
-        for i in range(7, 0, -1):
-            date = (datetime.now() - timedelta(days=i)).date()
-            async with db.execute(
-                'SELECT SUM(count) FROM usage WHERE date = ?', (date,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                count = row[0] if row[0] else 0
-                request_stats.append({'date': str(date), 'count': count})
+        # Requests: rolled-up days come from usage_daily_totals, newer days
+        # from the usage detail (range predicates use idx_usage_date)
+        bucket = CHART_GRANULARITIES[request_granularity][0].format(col='date')
+        async with db.execute(f'''
+            SELECT {bucket} AS bucket, SUM(total) FROM (
+                SELECT date, total_requests AS total FROM usage_daily_totals
+                WHERE date >= :start AND date < :end
+                UNION ALL
+                SELECT date, count AS total FROM usage
+                WHERE date >= :start AND date < :end
+                AND date > (SELECT COALESCE(MAX(date), '') FROM usage_daily_totals)
+            )
+            GROUP BY bucket
+        ''', {'start': str(start.date()), 'end': str(end.date())}) as cursor:
+            requests = dict(await cursor.fetchall())
+    
+    return {
+        'days': days,
+        'granularity': granularity,
+        'user_growth': [
+            {'date': label, 'count': new_users.get(label, 0)}
+            for label in _chart_buckets(start, end, granularity)
+        ],
+        'request_stats': [
+            {'date': label, 'count': requests.get(label, 0) or 0}
+            for label in _chart_buckets(start, end, request_granularity)
+        ],
+    }
+
+
+async def get_tickets(before_id=None, limit=TICKETS_PAGE_SIZE):
+    """
+    Get a page of support tickets, newest first.
+    Returns (tickets, next_cursor); the cursor is the id of the last row.
+    """
+    async with db_connection() as db:
+        db.row_factory = aiosqlite.Row
+        if before_id:
+            query = 'SELECT * FROM support_tickets WHERE id < ? ORDER BY id DESC LIMIT ?'
+            params = (before_id, limit)
+        else:
+            query = 'SELECT * FROM support_tickets ORDER BY id DESC LIMIT ?'
+            params = (limit,)
         
-        return {
-            'user_growth': user_growth,
-            'request_stats': request_stats,
-        }
+        async with db.execute(query, params) as cursor:
+            tickets = [dict(row) for row in await cursor.fetchall()]
+        
+        next_cursor = tickets[-1]['id'] if len(tickets) == limit else None
+        return tickets, next_cursor
 
 
-async def get_tickets():
-    """Get all support tickets."""
-    async with aiosqlite.connect(DB_PATH) as db:
+def ticket_detail_query(args):
+    """
+    Read the ticket page's message and attachment cursors from request arguments.
+    Returns (query, options) like user_list_query.
+    """
+    query = {key: args.get(key, '') for key in ('after', 'files_after')}
+    query = {key: value for key, value in query.items() if value.isdigit() and int(value)}
+    
+    options = {
+        'messages_after': int(query.get('after', 0)),
+        'attachments_after': int(query.get('files_after', 0)),
+    }
+    return query, options
+
+
+async def get_ticket_detail(ticket_id, messages_after=None, attachments_after=None,
+                            limit=TICKET_MESSAGES_PAGE_SIZE,
+                            attachments_limit=TICKET_ATTACHMENTS_PAGE_SIZE):
+    """
+    Get a ticket with one page of its messages and one of its attachments,
+    oldest first, each paged by id. Returns None for an unknown ticket, else a
+    dict with ticket, messages, attachments and the next cursor of each list.
+    """
+    async with db_connection() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute('''
-            SELECT * FROM support_tickets 
-            ORDER BY created_at DESC 
-            LIMIT 50
-        ''') as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+            SELECT t.*, a.user_id AS agent_user_id FROM support_tickets t
+            LEFT JOIN agents a ON a.id = t.assigned_agent_id
+            WHERE t.ticket_id = ?
+        ''', (ticket_id,)) as cursor:
+            ticket = await cursor.fetchone()
+        if ticket is None:
+            return None
+        
+        detail = {'ticket': dict(ticket)}
+        pages = (
+            ('messages', 'support_messages', messages_after, limit),
+            ('attachments', 'support_attachments', attachments_after, attachments_limit),
+        )
+        for name, table, after_id, page_size in pages:
+            async with db.execute(
+                f'SELECT * FROM {table} WHERE ticket_id = ? AND id > ? ORDER BY id LIMIT ?',
+                (ticket_id, after_id or 0, page_size)
+            ) as cursor:
+                rows = [dict(row) for row in await cursor.fetchall()]
+            detail[name] = rows
+            detail[f'next_{name}_cursor'] = rows[-1]['id'] if len(rows) == page_size else None
+        return detail
 
 
 async def get_agents():
     """Get all agents."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connection() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute('SELECT * FROM agents ORDER BY created_at DESC') as cursor:
             rows = await cursor.fetchall()
@@ -147,29 +611,27 @@ async def get_agents():
 
 async def toggle_premium(user_id):
     """Toggle premium status for a user."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute('SELECT is_premium FROM users WHERE user_id = ?', (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                new_status = 0 if row[0] else 1
-                await db.execute('UPDATE users SET is_premium = ? WHERE user_id = ?', (new_status, user_id))
-                await db.commit()
+    async with db_connection() as db:
+        await db.execute(
+            'UPDATE users SET is_premium = CASE WHEN is_premium THEN 0 ELSE 1 END WHERE user_id = ?',
+            (user_id,)
+        )
+        await db.commit()
 
 
 async def toggle_ban(user_id):
     """Toggle ban status for a user."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute('SELECT is_banned FROM users WHERE user_id = ?', (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                new_status = 0 if row[0] else 1
-                await db.execute('UPDATE users SET is_banned = ? WHERE user_id = ?', (new_status, user_id))
-                await db.commit()
+    async with db_connection() as db:
+        await db.execute(
+            'UPDATE users SET is_banned = CASE WHEN is_banned THEN 0 ELSE 1 END WHERE user_id = ?',
+            (user_id,)
+        )
+        await db.commit()
 
 
 async def update_ticket_status(ticket_id, status):
     """Update ticket status."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connection() as db:
         await db.execute(
             'UPDATE support_tickets SET status = ? WHERE ticket_id = ?',
             (status, ticket_id)
@@ -177,9 +639,56 @@ async def update_ticket_status(ticket_id, status):
         await db.commit()
 
 
+async def _bulk_update(db, table, key, assignments, ids, params=()):
+    """Run one UPDATE per chunk of ids in the current transaction; returns rows updated."""
+    updated = 0
+    for start in range(0, len(ids), BULK_CHUNK_SIZE):
+        chunk = ids[start:start + BULK_CHUNK_SIZE]
+        placeholders = ', '.join('?' for _ in chunk)
+        cursor = await db.execute(
+            f'UPDATE {table} SET {assignments} WHERE {key} IN ({placeholders})',
+            [*params, *chunk]
+        )
+        updated += cursor.rowcount
+    return updated
+
+
+async def bulk_update_users(user_ids, action, days=None):
+    """Grant or remove premium (with expiry), ban or unban many users in one transaction."""
+    params = (datetime.now() + timedelta(days=days),) if action == 'premium' else ()
+    async with db_connection() as db:
+        updated = await _bulk_update(db, 'users', 'user_id', USER_BULK_ACTIONS[action], user_ids, params)
+        await db.commit()
+    return updated
+
+
+async def bulk_update_tickets(ticket_ids, status):
+    """Set the status of many tickets in one transaction; returns tickets updated."""
+    assignments = 'status = ?, resolved_at = CURRENT_TIMESTAMP' if status == 'resolved' else 'status = ?'
+    async with db_connection() as db:
+        updated = await _bulk_update(db, 'support_tickets', 'ticket_id', assignments, ticket_ids, (status,))
+        await db.commit()
+    return updated
+
+
+async def reassign_tickets(ticket_ids, agent_id):
+    """Assign many tickets to an agent (None unassigns them) in one transaction; returns tickets updated."""
+    async with db_connection() as db:
+        if agent_id is not None:
+            async with db.execute('SELECT 1 FROM agents WHERE id = ?', (agent_id,)) as cursor:
+                if await cursor.fetchone() is None:
+                    raise ValueError(f"Unknown agent: {agent_id}")
+        # Agent loads follow through the database triggers
+        updated = await _bulk_update(
+            db, 'support_tickets', 'ticket_id', 'assigned_agent_id = ?', ticket_ids, (agent_id,)
+        )
+        await db.commit()
+    return updated
+
+
 async def get_ticket_attachments(ticket_id):
     """Get attachments for a ticket."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connection() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute(
             'SELECT * FROM support_attachments WHERE ticket_id = ?',
@@ -191,23 +700,296 @@ async def get_ticket_attachments(ticket_id):
 
 async def get_settings():
     """Get all bot settings."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_connection() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute('SELECT * FROM bot_settings') as cursor:
             rows = await cursor.fetchall()
             return {row['key']: row['value'] for row in rows}
 
 
-async def update_setting(key, value):
-    """Update a bot setting."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            'INSERT OR REPLACE INTO bot_settings (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
-            (key, value)
-        )
+async def update_settings(settings):
+    """Update several bot settings in one transaction."""
+    async with db_connection() as db:
+        await Database.write_settings(db, settings)
         await db.commit()
 
 
+def settings_from_form(form):
+    """Read bot settings from a submitted settings form."""
+    return {
+        'maintenance_mode': '1' if form.get('maintenance_mode') else '0',
+        'force_join_enabled': '1' if form.get('force_join_enabled') else '0',
+        'force_join_channel': form.get('force_join_channel', ''),
+        'free_limit': form.get('free_limit', '10'),
+        'premium_limit': form.get('premium_limit', '1000'),
+        'referral_bonus': form.get('referral_bonus', '5'),
+        'flood_time': form.get('flood_time', '60'),
+    }
+
+
+async def get_data_version(tables):
+    """Version of the data behind a page: today's date plus the tables' generations."""
+    names = [GENERATION_PREFIX + table for table in tables]
+    placeholders = ', '.join('?' for _ in names)
+    async with db_connection() as db:
+        async with db.execute(
+            f'SELECT name, value FROM stats_counters WHERE name IN ({placeholders})', names
+        ) as cursor:
+            generations = dict(await cursor.fetchall())
+    
+    return ':'.join([str(datetime.now().date())] + [str(generations.get(name, 0)) for name in names])
+
+
+def page_etag(path, version):
+    """ETag for a page at a data version; changes with the database and templates too."""
+    key = f'{DB_PATH}|{TEMPLATES_DIGEST}|{path}|{version}'
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+class PageCache:
+    """LRU cache of rendered pages keyed by ETag, with a gzip copy of larger bodies."""
+    
+    def __init__(self, size=PAGE_CACHE_SIZE):
+        """Initialize an empty cache."""
+        self._pages = OrderedDict()
+        self._size = size
+        self._lock = threading.Lock()
+    
+    def get(self, etag):
+        """Return (content_type, body, gzipped body or None) for an ETag, if cached."""
+        with self._lock:
+            page = self._pages.get(etag)
+            if page:
+                self._pages.move_to_end(etag)
+            return page
+    
+    def put(self, etag, content_type, body):
+        """Cache a rendered page and return its cache entry."""
+        gzipped = gzip.compress(body, 6) if len(body) >= GZIP_MIN_SIZE else None
+        page = (content_type, body, gzipped)
+        with self._lock:
+            self._pages[etag] = page
+            while len(self._pages) > self._size:
+                self._pages.popitem(last=False)
+        return page
+
+
+page_cache = PageCache()
+
+
+def page_response(etag, page, accept_encoding='', cache_control='private, no-cache'):
+    """Status, body and headers for a cached page or asset; no page means 304 Not Modified."""
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+    if page is None:
+        return 304, b'', headers
+    
+    content_type, body, gzipped = page
+    headers['Content-Type'] = content_type
+    if gzipped and 'gzip' in accept_encoding:
+        headers['Content-Encoding'] = 'gzip'
+        body = gzipped
+    return 200, body, headers
+
+
+def form_values(form, name):
+    """All values of a repeated field in a Flask or aiohttp form."""
+    return form.getlist(name) if hasattr(form, 'getlist') else form.getall(name, [])
+
+
+def parse_ids(values, cast=str):
+    """Read IDs from checkboxes and pasted lists (comma or whitespace separated), deduplicated."""
+    ids = dict.fromkeys(
+        cast(value) for field in values for value in field.replace(',', ' ').split()
+    )
+    if not ids:
+        raise ValueError("No IDs selected")
+    return list(ids)
+
+
+def bulk_users_from_form(form):
+    """Read a bulk user action from a submitted form; raises ValueError when invalid."""
+    action = form.get('action')
+    if action not in USER_BULK_ACTIONS:
+        raise ValueError(f"Unknown action: {action}")
+    days = int(form.get('days') or 0)
+    if action == 'premium' and days < 1:
+        raise ValueError("Premium needs a number of days")
+    return parse_ids(form_values(form, 'ids'), int), action, days
+
+
+def bulk_tickets_from_form(form):
+    """Read a bulk ticket status change from a submitted form; raises ValueError when invalid."""
+    status = form.get('status')
+    if status not in TICKET_STATUSES:
+        raise ValueError(f"Unknown status: {status}")
+    return parse_ids(form_values(form, 'ids')), status
+
+
+def reassign_from_form(form):
+    """Read a ticket reassignment from a submitted form; raises ValueError when invalid."""
+    agent = form.get('agent')
+    return parse_ids(form_values(form, 'ids')), int(agent) if agent else None
+
+
+def attachments_zip(ticket_id, attachments):
+    """Stream a ZIP of a ticket's attachment files downloaded from Telegram."""
+    return stream_attachments_zip(BOT_TOKEN, ticket_id, attachments, TELEGRAM_API_URL)
+
+
+def iter_async(agen):
+    """Iterate an async generator from a Flask route on the shared event loop."""
+    async def next_chunk():
+        try:
+            return await agen.__anext__()
+        except StopAsyncIteration:
+            return None
+    
+    try:
+        while True:
+            # Downloads carry their own timeouts, so wait as long as they need
+            chunk = runtime.run(next_chunk(), timeout=None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        runtime.run(agen.aclose())
+
+
+# Shared stylesheet and dashboard script, served as fingerprinted static assets
+ADMIN_CSS = '''
+* { margin: 0; padding: 0; box-sizing: border-box; }
+body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #f5f7fa; }
+.header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 20px 40px; color: white; display: flex; justify-content: space-between; align-items: center; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
+.header h1 { font-size: 24px; }
+.logout { padding: 10px 25px; background: rgba(255,255,255,0.2); color: white; text-decoration: none; border-radius: 8px; transition: background 0.3s; }
+.logout:hover { background: rgba(255,255,255,0.3); }
+.nav { background: white; padding: 15px 40px; box-shadow: 0 2px 5px rgba(0,0,0,0.05); margin-bottom: 30px; }
+.nav a { display: inline-block; padding: 10px 20px; margin-right: 10px; color: #333; text-decoration: none; border-radius: 8px; transition: background 0.3s; }
+.nav a:hover, .nav a.active { background: #667eea; color: white; }
+.container { padding: 0 40px 40px 40px; max-width: 1400px; margin: 0 auto; }
+.stats { display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 20px; margin-bottom: 30px; }
+.stat-box { background: white; padding: 25px; border-radius: 12px; box-shadow: 0 2px 8px rgba(0,0,0,0.08); transition: transform 0.2s; }
+.stat-box:hover { transform: translateY(-5px); }
+.stat-box h3 { font-size: 14px; color: #666; margin-bottom: 10px; }
+.stat-box .number { font-size: 36px; font-weight: bold; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); -webkit-background-clip: text; -webkit-text-fill-color: transparent; }
+.charts { display: grid; grid-template-columns: repeat(auto-fit, minmax(400px, 1fr)); gap: 20px; margin-bottom: 30px; }
+.chart-box { background: white; padding: 25px; border-radius: 12px; box-shadow: 0 2px 8px rgba(0,0,0,0.08); }
+.chart-box h3 { margin-bottom: 20px; color: #333; }
+.chart-controls { margin-bottom: 20px; }
+.chart-controls select { padding: 8px; border: 2px solid #e0e0e0; border-radius: 6px; margin-right: 10px; }
+.content-box { background: white; padding: 25px; border-radius: 12px; box-shadow: 0 2px 8px rgba(0,0,0,0.08); }
+table { width: 100%; border-collapse: collapse; }
+th, td { padding: 15px; text-align: left; border-bottom: 1px solid #e0e0e0; }
+th { background: #f8f9fa; font-weight: 600; color: #333; }
+tr:hover { background: #f8f9fa; }
+.btn { padding: 8px 16px; margin: 2px; border: none; border-radius: 6px; cursor: pointer; text-decoration: none; font-size: 12px; transition: opacity 0.3s; }
+.btn:hover { opacity: 0.8; }
+.btn-premium { background: #ffc107; color: #333; }
+.btn-ban { background: #e74c3c; color: white; }
+.btn-active { background: #27ae60; color: white; }
+.btn-success { background: #27ae60; color: white; }
+.btn-danger { background: #e74c3c; color: white; }
+.btn-info { background: #3498db; color: white; }
+.badge { padding: 5px 12px; border-radius: 20px; font-size: 11px; font-weight: bold; }
+.badge-premium { background: #ffc107; color: #333; }
+.badge-banned { background: #e74c3c; color: white; }
+.badge-online { background: #27ae60; color: white; }
+.badge-offline { background: #95a5a6; color: white; }
+.badge-open { background: #3498db; color: white; }
+.badge-closed { background: #27ae60; color: white; }
+.badge-resolved { background: #27ae60; color: white; }
+.pager { margin-top: 20px; text-align: right; }
+.thread { margin-top: 20px; }
+.thread th, .thread td { padding: 6px 10px; font-size: 13px; vertical-align: top; }
+.thread td.message { white-space: pre-wrap; word-break: break-word; }
+.thread td.meta { white-space: nowrap; color: #666; }
+.notice { margin-bottom: 20px; padding: 12px 15px; border-radius: 8px; background: #eafaf1; color: #1e8449; }
+.search { display: flex; flex-wrap: wrap; gap: 10px; align-items: center; margin-bottom: 20px; }
+.search input[type=text], .search select { padding: 8px; border: 2px solid #e0e0e0; border-radius: 6px; }
+.search input[type=text] { flex: 1; min-width: 220px; }
+.search label { font-size: 14px; color: #333; }
+.page-settings .content-box { margin-bottom: 20px; }
+.setting-row { display: flex; justify-content: space-between; align-items: center; padding: 15px 0; border-bottom: 1px solid #e0e0e0; }
+.setting-row:last-child { border-bottom: none; }
+.setting-label { font-weight: 600; color: #333; }
+.setting-value { color: #666; }
+.page-settings input[type="text"], .page-settings input[type="number"] { padding: 10px; border: 2px solid #e0e0e0; border-radius: 6px; width: 200px; }
+.page-settings button { padding: 10px 20px; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; border: none; border-radius: 6px; cursor: pointer; }
+.page-settings button:hover { opacity: 0.9; }
+.toggle { position: relative; display: inline-block; width: 60px; height: 30px; }
+.toggle input { opacity: 0; width: 0; height: 0; }
+.slider { position: absolute; cursor: pointer; top: 0; left: 0; right: 0; bottom: 0; background-color: #ccc; transition: .4s; border-radius: 30px; }
+.slider:before { position: absolute; content: ""; height: 22px; width: 22px; left: 4px; bottom: 4px; background-color: white; transition: .4s; border-radius: 50%; }
+input:checked + .slider { background-color: #667eea; }
+input:checked + .slider:before { transform: translateX(30px); }
+'''
+
+DASHBOARD_JS = '''
+// Live stats: the server pushes a snapshot, then only the values that changed
+const statsStream = new EventSource(document.body.dataset.statsUrl);
+const applyStats = (event) => {
+    for (const [name, value] of Object.entries(JSON.parse(event.data))) {
+        document.querySelectorAll(`[data-stat="${name}"]`).forEach((el) => { el.textContent = value; });
+    }
+};
+statsStream.addEventListener('snapshot', applyStats);
+statsStream.addEventListener('delta', applyStats);
+
+// Chart data is embedded in the page as JSON
+const chartData = JSON.parse(document.getElementById('chart-data').textContent);
+const label = (point) => point.date;
+const count = (point) => point.count;
+
+// User Growth Chart
+const userGrowthCtx = document.getElementById('userGrowthChart').getContext('2d');
+new Chart(userGrowthCtx, {
+    type: 'line',
+    data: {
+        labels: chartData.user_growth.map(label),
+        datasets: [{
+            label: 'New Users',
+            data: chartData.user_growth.map(count),
+            borderColor: '#667eea',
+            backgroundColor: 'rgba(102, 126, 234, 0.1)',
+            tension: 0.4,
+            fill: true
+        }]
+    },
+    options: {
+        responsive: true,
+        plugins: {
+            legend: { display: false }
+        },
+        scales: {
+            y: { beginAtZero: true }
+        }
+    }
+});
+
+// Requests Chart
+const requestsCtx = document.getElementById('requestsChart').getContext('2d');
+new Chart(requestsCtx, {
+    type: 'bar',
+    data: {
+        labels: chartData.request_stats.map(label),
+        datasets: [{
+            label: 'Requests',
+            data: chartData.request_stats.map(count),
+            backgroundColor: '#764ba2'
+        }]
+    },
+    options: {
+        responsive: true,
+        plugins: {
+            legend: { display: false }
+        },
+        scales: {
+            y: { beginAtZero: true }
+        }
+    }
+});
+'''
+
 # HTML Templates
 LOGIN_TEMPLATE = '''
 <!DOCTYPE html>
@@ -248,49 +1030,9 @@ DASHBOARD_TEMPLATE = '''
 <head>
     <title>Admin Dashboard</title>
     <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #f5f7fa; }
-        .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 20px 40px; color: white; display: flex; justify-content: space-between; align-items: center; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
-        .header h1 { font-size: 24px; }
-        .logout { padding: 10px 25px; background: rgba(255,255,255,0.2); color: white; text-decoration: none; border-radius: 8px; transition: background 0.3s; }
-        .logout:hover { background: rgba(255,255,255,0.3); }
-        .nav { background: white; padding: 15px 40px; box-shadow: 0 2px 5px rgba(0,0,0,0.05); margin-bottom: 30px; }
-        .nav a { display: inline-block; padding: 10px 20px; margin-right: 10px; color: #333; text-decoration: none; border-radius: 8px; transition: background 0.3s; }
-        .nav a:hover, .nav a.active { background: #667eea; color: white; }
-        .container { padding: 0 40px 40px 40px; max-width: 1400px; margin: 0 auto; }
-        .stats { display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 20px; margin-bottom: 30px; }
-        .stat-box { background: white; padding: 25px; border-radius: 12px; box-shadow: 0 2px 8px rgba(0,0,0,0.08); transition: transform 0.2s; }
-        .stat-box:hover { transform: translateY(-5px); }
-        .stat-box h3 { font-size: 14px; color: #666; margin-bottom: 10px; }
-        .stat-box .number { font-size: 36px; font-weight: bold; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); -webkit-background-clip: text; -webkit-text-fill-color: transparent; }
-        .charts { display: grid; grid-template-columns: repeat(auto-fit, minmax(400px, 1fr)); gap: 20px; margin-bottom: 30px; }
-        .chart-box { background: white; padding: 25px; border-radius: 12px; box-shadow: 0 2px 8px rgba(0,0,0,0.08); }
-        .chart-box h3 { margin-bottom: 20px; color: #333; }
-        .content-box { background: white; padding: 25px; border-radius: 12px; box-shadow: 0 2px 8px rgba(0,0,0,0.08); }
-        table { width: 100%; border-collapse: collapse; }
-        th, td { padding: 15px; text-align: left; border-bottom: 1px solid #e0e0e0; }
-        th { background: #f8f9fa; font-weight: 600; color: #333; }
-        tr:hover { background: #f8f9fa; }
-        .btn { padding: 8px 16px; margin: 2px; border: none; border-radius: 6px; cursor: pointer; text-decoration: none; font-size: 12px; transition: opacity 0.3s; }
-        .btn:hover { opacity: 0.8; }
-        .btn-premium { background: #ffc107; color: #333; }
-        .btn-ban { background: #e74c3c; color: white; }
-        .btn-active { background: #27ae60; color: white; }
-        .btn-success { background: #27ae60; color: white; }
-        .btn-danger { background: #e74c3c; color: white; }
-        .btn-info { background: #3498db; color: white; }
-        .badge { padding: 5px 12px; border-radius: 20px; font-size: 11px; font-weight: bold; }
-        .badge-premium { background: #ffc107; color: #333; }
-        .badge-banned { background: #e74c3c; color: white; }
-        .badge-online { background: #27ae60; color: white; }
-        .badge-offline { background: #95a5a6; color: white; }
-        .badge-open { background: #3498db; color: white; }
-        .badge-closed { background: #27ae60; color: white; }
-        .badge-resolved { background: #95a5a6; color: white; }
-    </style>
+    <link rel="stylesheet" href="{{ url_for('static_asset', filename=asset_names['admin.css']) }}">
 </head>
-<body>
+<body data-stats-url="{{ url_for('stats_stream') }}">
     <div class="header">
         <h1>📊 Admin Dashboard - YouTube Thumbnail Bot</h1>
         <a href="{{ url_for('logout') }}" class="logout">Logout</a>
@@ -308,92 +1050,66 @@ DASHBOARD_TEMPLATE = '''
         <div class="stats">
             <div class="stat-box">
                 <h3>Total Users</h3>
-                <div class="number">{{ stats.total_users }}</div>
+                <div class="number" data-stat="total_users">{{ stats.total_users }}</div>
+            </div>
+            <div class="stat-box">
+                <h3>New Users Today</h3>
+                <div class="number" data-stat="new_users_today">{{ stats.new_users_today }}</div>
             </div>
             <div class="stat-box">
                 <h3>Premium Users</h3>
-                <div class="number">{{ stats.premium_users }}</div>
+                <div class="number" data-stat="premium_users">{{ stats.premium_users }}</div>
             </div>
             <div class="stat-box">
                 <h3>Today's Requests</h3>
-                <div class="number">{{ stats.today_requests }}</div>
+                <div class="number" data-stat="today_requests">{{ stats.today_requests }}</div>
+            </div>
+            <div class="stat-box">
+                <h3>Requests / Minute</h3>
+                <div class="number" data-stat="requests_per_minute">-</div>
             </div>
             <div class="stat-box">
                 <h3>Open Tickets</h3>
-                <div class="number">{{ stats.open_tickets }}</div>
+                <div class="number" data-stat="open_tickets">{{ stats.open_tickets }}</div>
             </div>
             <div class="stat-box">
                 <h3>Online Agents</h3>
-                <div class="number">{{ stats.online_agents }}/{{ stats.total_agents }}</div>
+                <div class="number"><span data-stat="online_agents">{{ stats.online_agents }}</span>/<span data-stat="total_agents">{{ stats.total_agents }}</span></div>
             </div>
             <div class="stat-box">
                 <h3>Pending Payments</h3>
-                <div class="number">{{ stats.pending_payments }}</div>
+                <div class="number" data-stat="pending_payments">{{ stats.pending_payments }}</div>
             </div>
         </div>
         
+        <form class="chart-controls" method="GET">
+            <select name="days">
+                {% for window in chart_windows %}
+                <option value="{{ window }}" {% if window == chart_data.days %}selected{% endif %}>Last {{ window }} days</option>
+                {% endfor %}
+            </select>
+            <select name="granularity">
+                {% for granularity in chart_granularities %}
+                <option value="{{ granularity }}" {% if granularity == chart_data.granularity %}selected{% endif %}>By {{ granularity }}</option>
+                {% endfor %}
+            </select>
+            <button type="submit" class="btn btn-info">Update Charts</button>
+        </form>
+        
         <div class="charts">
             <div class="chart-box">
-                <h3>User Growth (Last 7 Days)</h3>
+                <h3>User Growth (Last {{ chart_data.days }} Days)</h3>
                 <canvas id="userGrowthChart"></canvas>
             </div>
             <div class="chart-box">
-                <h3>Daily Requests (Last 7 Days)</h3>
+                <h3>Requests (Last {{ chart_data.days }} Days)</h3>
                 <canvas id="requestsChart"></canvas>
             </div>
         </div>
     </div>
     
-    <script>
-        // User Growth Chart
-        const userGrowthCtx = document.getElementById('userGrowthChart').getContext('2d');
-        new Chart(userGrowthCtx, {
-            type: 'line',
-            data: {
-                labels: {{ chart_data.user_growth | map(attribute='date') | list | tojson }},
-                datasets: [{
-                    label: 'New Users',
-                    data: {{ chart_data.user_growth | map(attribute='count') | list | tojson }},
-                    borderColor: '#667eea',
-                    backgroundColor: 'rgba(102, 126, 234, 0.1)',
-                    tension: 0.4,
-                    fill: true
-                }]
-            },
-            options: {
-                responsive: true,
-                plugins: {
-                    legend: { display: false }
-                },
-                scales: {
-                    y: { beginAtZero: true }
-                }
-            }
-        });
-        
-        // Requests Chart
-        const requestsCtx = document.getElementById('requestsChart').getContext('2d');
-        new Chart(requestsCtx, {
-            type: 'bar',
-            data: {
-                labels: {{ chart_data.request_stats | map(attribute='date') | list | tojson }},
-                datasets: [{
-                    label: 'Requests',
-                    data: {{ chart_data.request_stats | map(attribute='count') | list | tojson }},
-                    backgroundColor: '#764ba2'
-                }]
-            },
-            options: {
-                responsive: true,
-                plugins: {
-                    legend: { display: false }
-                },
-                scales: {
-                    y: { beginAtZero: true }
-                }
-            }
-        });
-    </script>
+    <script id="chart-data" type="application/json">{{ chart_data | tojson }}</script>
+    <script src="{{ url_for('static_asset', filename=asset_names['dashboard.js']) }}"></script>
 </body>
 </html>
 '''
@@ -403,31 +1119,7 @@ USERS_TEMPLATE = '''
 <html>
 <head>
     <title>Users Management</title>
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #f5f7fa; }
-        .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 20px 40px; color: white; display: flex; justify-content: space-between; align-items: center; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
-        .header h1 { font-size: 24px; }
-        .logout { padding: 10px 25px; background: rgba(255,255,255,0.2); color: white; text-decoration: none; border-radius: 8px; transition: background 0.3s; }
-        .logout:hover { background: rgba(255,255,255,0.3); }
-        .nav { background: white; padding: 15px 40px; box-shadow: 0 2px 5px rgba(0,0,0,0.05); margin-bottom: 30px; }
-        .nav a { display: inline-block; padding: 10px 20px; margin-right: 10px; color: #333; text-decoration: none; border-radius: 8px; transition: background 0.3s; }
-        .nav a:hover, .nav a.active { background: #667eea; color: white; }
-        .container { padding: 0 40px 40px 40px; max-width: 1400px; margin: 0 auto; }
-        .content-box { background: white; padding: 25px; border-radius: 12px; box-shadow: 0 2px 8px rgba(0,0,0,0.08); }
-        table { width: 100%; border-collapse: collapse; }
-        th, td { padding: 15px; text-align: left; border-bottom: 1px solid #e0e0e0; }
-        th { background: #f8f9fa; font-weight: 600; color: #333; }
-        tr:hover { background: #f8f9fa; }
-        .btn { padding: 8px 16px; margin: 2px; border: none; border-radius: 6px; cursor: pointer; text-decoration: none; font-size: 12px; transition: opacity 0.3s; }
-        .btn:hover { opacity: 0.8; }
-        .btn-premium { background: #ffc107; color: #333; }
-        .btn-ban { background: #e74c3c; color: white; }
-        .btn-active { background: #27ae60; color: white; }
-        .badge { padding: 5px 12px; border-radius: 20px; font-size: 11px; font-weight: bold; }
-        .badge-premium { background: #ffc107; color: #333; }
-        .badge-banned { background: #e74c3c; color: white; }
-    </style>
+    <link rel="stylesheet" href="{{ url_for('static_asset', filename=asset_names['admin.css']) }}">
 </head>
 <body>
     <div class="header">
@@ -445,10 +1137,45 @@ USERS_TEMPLATE = '''
     
     <div class="container">
         <div class="content-box">
-            <h2 style="margin-bottom: 20px;">User List (Latest 100)</h2>
+            <h2 style="margin-bottom: 20px;">User List
+                <a href="{{ url_for('export_data', name='users', format='csv') }}" class="btn btn-info">Export CSV</a>
+                <a href="{{ url_for('export_data', name='usage', format='csv', gzip=1) }}" class="btn btn-info">Export Usage (gzip)</a>
+            </h2>
+            <form class="search" method="GET">
+                <input type="text" name="q" value="{{ query.q or '' }}" placeholder="User ID, @username or name">
+                {% for name in user_filters %}
+                <label><input type="checkbox" name="{{ name }}" value="1" {% if name in query %}checked{% endif %}> {{ name | capitalize }}</label>
+                {% endfor %}
+                <select name="sort">
+                    <option value="">Default order</option>
+                    {% for sort in user_sorts %}
+                    <option value="{{ sort }}" {% if query.sort == sort %}selected{% endif %}>Sort by {{ sort.replace('_', ' ') }}</option>
+                    {% endfor %}
+                </select>
+                <select name="order">
+                    <option value="desc">Descending</option>
+                    <option value="asc" {% if query.order == 'asc' %}selected{% endif %}>Ascending</option>
+                </select>
+                <button type="submit" class="btn btn-info">Search</button>
+            </form>
+            {% if request.args.get('updated') %}
+            <p class="notice">Updated {{ request.args.get('updated') }} users.</p>
+            {% endif %}
+            <form id="bulk-users" class="search" method="POST" action="{{ url_for('bulk_users_route') }}">
+                <select name="action">
+                    <option value="premium">Grant premium</option>
+                    <option value="remove_premium">Remove premium</option>
+                    <option value="ban">Ban</option>
+                    <option value="unban">Unban</option>
+                </select>
+                <label>for <input type="number" name="days" value="30" min="1"> days</label>
+                <input type="text" name="ids" placeholder="Selected users, or paste user IDs">
+                <button type="submit" class="btn btn-info">Apply</button>
+            </form>
             <table>
                 <thead>
                     <tr>
+                        <th><input type="checkbox" title="Select all" onclick="document.querySelectorAll('input[form=bulk-users]').forEach((box) => { box.checked = this.checked; })"></th>
                         <th>User ID</th>
                         <th>Name</th>
                         <th>Username</th>
@@ -461,6 +1188,7 @@ USERS_TEMPLATE = '''
                 <tbody>
                     {% for user in users %}
                     <tr>
+                        <td><input type="checkbox" name="ids" value="{{ user.user_id }}" form="bulk-users"></td>
                         <td>{{ user.user_id }}</td>
                         <td>{{ user.first_name or 'N/A' }}</td>
                         <td>@{{ user.username or 'N/A' }}</td>
@@ -483,9 +1211,19 @@ USERS_TEMPLATE = '''
                             </a>
                         </td>
                     </tr>
+                    {% else %}
+                    <tr><td colspan="8">No users found.</td></tr>
                     {% endfor %}
                 </tbody>
             </table>
+            <div class="pager">
+                {% if request.args.get('cursor') %}
+                <a href="{{ url_for('users_page', **query) }}" class="btn btn-info">⏮ First Page</a>
+                {% endif %}
+                {% if next_cursor %}
+                <a href="{{ url_for('users_page', cursor=next_cursor, **query) }}" class="btn btn-info">Next Page →</a>
+                {% endif %}
+            </div>
         </div>
     </div>
 </body>
@@ -497,31 +1235,7 @@ TICKETS_TEMPLATE = '''
 <html>
 <head>
     <title>Support Tickets</title>
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #f5f7fa; }
-        .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 20px 40px; color: white; display: flex; justify-content: space-between; align-items: center; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
-        .header h1 { font-size: 24px; }
-        .logout { padding: 10px 25px; background: rgba(255,255,255,0.2); color: white; text-decoration: none; border-radius: 8px; transition: background 0.3s; }
-        .logout:hover { background: rgba(255,255,255,0.3); }
-        .nav { background: white; padding: 15px 40px; box-shadow: 0 2px 5px rgba(0,0,0,0.05); margin-bottom: 30px; }
-        .nav a { display: inline-block; padding: 10px 20px; margin-right: 10px; color: #333; text-decoration: none; border-radius: 8px; transition: background 0.3s; }
-        .nav a:hover, .nav a.active { background: #667eea; color: white; }
-        .container { padding: 0 40px 40px 40px; max-width: 1400px; margin: 0 auto; }
-        .content-box { background: white; padding: 25px; border-radius: 12px; box-shadow: 0 2px 8px rgba(0,0,0,0.08); }
-        table { width: 100%; border-collapse: collapse; }
-        th, td { padding: 15px; text-align: left; border-bottom: 1px solid #e0e0e0; }
-        th { background: #f8f9fa; font-weight: 600; color: #333; }
-        tr:hover { background: #f8f9fa; }
-        .btn { padding: 8px 16px; margin: 2px; border: none; border-radius: 6px; cursor: pointer; text-decoration: none; font-size: 12px; transition: opacity 0.3s; }
-        .btn:hover { opacity: 0.8; }
-        .btn-success { background: #27ae60; color: white; }
-        .btn-danger { background: #e74c3c; color: white; }
-        .btn-info { background: #3498db; color: white; }
-        .badge { padding: 5px 12px; border-radius: 20px; font-size: 11px; font-weight: bold; }
-        .badge-open { background: #3498db; color: white; }
-        .badge-resolved { background: #27ae60; color: white; }
-    </style>
+    <link rel="stylesheet" href="{{ url_for('static_asset', filename=asset_names['admin.css']) }}">
 </head>
 <body>
     <div class="header">
@@ -539,15 +1253,38 @@ TICKETS_TEMPLATE = '''
     
     <div class="container">
         <div class="content-box">
-            <h2 style="margin-bottom: 20px;">Support Tickets (Latest 50)</h2>
+            <h2 style="margin-bottom: 20px;">Support Tickets (Newest First)
+                <a href="{{ url_for('export_data', name='tickets', format='csv') }}" class="btn btn-info">Export CSV</a>
+            </h2>
+            {% if request.args.get('updated') %}
+            <p class="notice">Updated {{ request.args.get('updated') }} tickets.</p>
+            {% endif %}
+            <form id="bulk-tickets" class="search" method="POST" action="{{ url_for('bulk_tickets_route') }}">
+                <select name="status">
+                    {% for status in ticket_statuses %}
+                    <option value="{{ status }}">Mark {{ status }}</option>
+                    {% endfor %}
+                </select>
+                <input type="text" name="ids" placeholder="Selected tickets, or paste ticket IDs">
+                <button type="submit" class="btn btn-info">Apply</button>
+                <select name="agent">
+                    <option value="">Unassigned</option>
+                    {% for agent in agents %}
+                    <option value="{{ agent.id }}">Agent {{ agent.user_id }} ({{ agent.assigned_tickets }} open)</option>
+                    {% endfor %}
+                </select>
+                <button type="submit" class="btn btn-info" formaction="{{ url_for('reassign_tickets_route') }}">Reassign</button>
+            </form>
             <table>
                 <thead>
                     <tr>
+                        <th><input type="checkbox" title="Select all" onclick="document.querySelectorAll('input[form=bulk-tickets]').forEach((box) => { box.checked = this.checked; })"></th>
                         <th>Ticket ID</th>
                         <th>User ID</th>
                         <th>Subject</th>
                         <th>Status</th>
                         <th>Priority</th>
+                        <th>Agent</th>
                         <th>Created</th>
                         <th>Actions</th>
                     </tr>
@@ -555,7 +1292,8 @@ TICKETS_TEMPLATE = '''
                 <tbody>
                     {% for ticket in tickets %}
                     <tr>
-                        <td>{{ ticket.ticket_id }}</td>
+                        <td><input type="checkbox" name="ids" value="{{ ticket.ticket_id }}" form="bulk-tickets"></td>
+                        <td><a href="{{ url_for('ticket_detail', ticket_id=ticket.ticket_id) }}">{{ ticket.ticket_id }}</a></td>
                         <td>{{ ticket.user_id }}</td>
                         <td>{{ ticket.subject }}</td>
                         <td>
@@ -564,17 +1302,119 @@ TICKETS_TEMPLATE = '''
                             </span>
                         </td>
                         <td>{{ ticket.priority }}</td>
+                        <td>{{ agent_users.get(ticket.assigned_agent_id, '—') }}</td>
                         <td>{{ ticket.created_at[:16] }}</td>
                         <td>
                             <a href="{{ url_for('update_ticket_status_route', ticket_id=ticket.ticket_id, status='resolved') }}" 
                                class="btn btn-success">Resolve</a>
                             <a href="{{ url_for('download_attachments', ticket_id=ticket.ticket_id) }}" 
-                               class="btn btn-info" title="Download attachment metadata and file IDs">Info ZIP</a>
+                               class="btn btn-info" title="Download the ticket's attachments">Attachments ZIP</a>
                         </td>
                     </tr>
                     {% endfor %}
                 </tbody>
             </table>
+            <div class="pager">
+                {% if request.args.get('before') %}
+                <a href="{{ url_for('tickets_page') }}" class="btn btn-info">⏮ Newest</a>
+                {% endif %}
+                {% if next_cursor %}
+                <a href="{{ url_for('tickets_page', before=next_cursor) }}" class="btn btn-info">Next Page →</a>
+                {% endif %}
+            </div>
+        </div>
+    </div>
+</body>
+</html>
+'''
+
+TICKET_TEMPLATE = '''
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Ticket {{ ticket.ticket_id }}</title>
+    <link rel="stylesheet" href="{{ url_for('static_asset', filename=asset_names['admin.css']) }}">
+</head>
+<body>
+    <div class="header">
+        <h1>🎫 Ticket {{ ticket.ticket_id }}</h1>
+        <a href="{{ url_for('logout') }}" class="logout">Logout</a>
+    </div>
+    
+    <div class="nav">
+        <a href="{{ url_for('dashboard') }}">Dashboard</a>
+        <a href="{{ url_for('users_page') }}">Users</a>
+        <a href="{{ url_for('tickets_page') }}" class="active">Support Tickets</a>
+        <a href="{{ url_for('agents_page') }}">Agents</a>
+        <a href="{{ url_for('settings_page') }}">Settings</a>
+    </div>
+    
+    <div class="container">
+        <div class="content-box">
+            <h2 style="margin-bottom: 20px;">{{ ticket.subject }}
+                <span class="badge badge-{{ 'resolved' if ticket.status == 'resolved' else 'open' }}">{{ ticket.status }}</span>
+            </h2>
+            <p>
+                User {{ ticket.user_id }} · Agent {{ ticket.agent_user_id or '—' }} ·
+                Priority {{ ticket.priority }} · Created {{ ticket.created_at[:16] }}
+                {% if ticket.first_reply_at %} · First reply {{ ticket.first_reply_at[:16] }}{% endif %}
+            </p>
+            <p class="pager">
+                <a href="{{ url_for('update_ticket_status_route', ticket_id=ticket.ticket_id, status='resolved') }}" 
+                   class="btn btn-success">Resolve</a>
+                <a href="{{ url_for('download_attachments', ticket_id=ticket.ticket_id) }}" 
+                   class="btn btn-info">Attachments ZIP</a>
+            </p>
+            
+            <table class="thread">
+                <thead>
+                    <tr><th>Time</th><th>From</th><th>Message</th></tr>
+                </thead>
+                <tbody>
+                    {% for message in messages %}
+                    <tr>
+                        <td class="meta">{{ message.created_at[:16] }}</td>
+                        <td class="meta">{{ 'User' if message.sender_id == ticket.user_id else 'Agent ' ~ message.sender_id }}</td>
+                        <td class="message">{{ message.message }}</td>
+                    </tr>
+                    {% else %}
+                    <tr><td colspan="3">No messages{{ ' after this point' if query.after }}.</td></tr>
+                    {% endfor %}
+                </tbody>
+            </table>
+            <div class="pager">
+                {% if query.after %}
+                <a href="{{ url_for('ticket_detail', ticket_id=ticket.ticket_id, **dict(query, after=0)) }}" class="btn btn-info">⏮ First Messages</a>
+                {% endif %}
+                {% if next_messages_cursor %}
+                <a href="{{ url_for('ticket_detail', ticket_id=ticket.ticket_id, **dict(query, after=next_messages_cursor)) }}" class="btn btn-info">More Messages →</a>
+                {% endif %}
+            </div>
+            
+            {% if attachments or query.files_after %}
+            <table class="thread">
+                <thead>
+                    <tr><th>Time</th><th>Type</th><th>File</th></tr>
+                </thead>
+                <tbody>
+                    {% for attachment in attachments %}
+                    <tr>
+                        <td class="meta">{{ attachment.created_at[:16] }}</td>
+                        <td class="meta">{{ attachment.file_type }}</td>
+                        <td class="message">{{ attachment.file_name or attachment.file_unique_id }}</td>
+                    </tr>
+                    {% endfor %}
+                </tbody>
+            </table>
+            <div class="pager">
+                {% if query.files_after %}
+                <a href="{{ url_for('ticket_detail', ticket_id=ticket.ticket_id, **dict(query, files_after=0)) }}" class="btn btn-info">⏮ First Attachments</a>
+                {% endif %}
+                {% if next_attachments_cursor %}
+                <a href="{{ url_for('ticket_detail', ticket_id=ticket.ticket_id, **dict(query, files_after=next_attachments_cursor)) }}" class="btn btn-info">More Attachments →</a>
+                {% endif %}
+            </div>
+            {% endif %}
         </div>
     </div>
 </body>
@@ -586,26 +1426,7 @@ AGENTS_TEMPLATE = '''
 <html>
 <head>
     <title>Agent Management</title>
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #f5f7fa; }
-        .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 20px 40px; color: white; display: flex; justify-content: space-between; align-items: center; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
-        .header h1 { font-size: 24px; }
-        .logout { padding: 10px 25px; background: rgba(255,255,255,0.2); color: white; text-decoration: none; border-radius: 8px; transition: background 0.3s; }
-        .logout:hover { background: rgba(255,255,255,0.3); }
-        .nav { background: white; padding: 15px 40px; box-shadow: 0 2px 5px rgba(0,0,0,0.05); margin-bottom: 30px; }
-        .nav a { display: inline-block; padding: 10px 20px; margin-right: 10px; color: #333; text-decoration: none; border-radius: 8px; transition: background 0.3s; }
-        .nav a:hover, .nav a.active { background: #667eea; color: white; }
-        .container { padding: 0 40px 40px 40px; max-width: 1400px; margin: 0 auto; }
-        .content-box { background: white; padding: 25px; border-radius: 12px; box-shadow: 0 2px 8px rgba(0,0,0,0.08); }
-        table { width: 100%; border-collapse: collapse; }
-        th, td { padding: 15px; text-align: left; border-bottom: 1px solid #e0e0e0; }
-        th { background: #f8f9fa; font-weight: 600; color: #333; }
-        tr:hover { background: #f8f9fa; }
-        .badge { padding: 5px 12px; border-radius: 20px; font-size: 11px; font-weight: bold; }
-        .badge-online { background: #27ae60; color: white; }
-        .badge-offline { background: #95a5a6; color: white; }
-    </style>
+    <link rel="stylesheet" href="{{ url_for('static_asset', filename=asset_names['admin.css']) }}">
 </head>
 <body>
     <div class="header">
@@ -630,7 +1451,7 @@ AGENTS_TEMPLATE = '''
                         <th>User ID</th>
                         <th>Role</th>
                         <th>Status</th>
-                        <th>Assigned</th>
+                        <th>Open Tickets</th>
                         <th>Total Handled</th>
                         <th>Closed</th>
                         <th>Avg Reply Time</th>
@@ -665,34 +1486,9 @@ SETTINGS_TEMPLATE = '''
 <html>
 <head>
     <title>Bot Settings</title>
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #f5f7fa; }
-        .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 20px 40px; color: white; display: flex; justify-content: space-between; align-items: center; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
-        .header h1 { font-size: 24px; }
-        .logout { padding: 10px 25px; background: rgba(255,255,255,0.2); color: white; text-decoration: none; border-radius: 8px; transition: background 0.3s; }
-        .logout:hover { background: rgba(255,255,255,0.3); }
-        .nav { background: white; padding: 15px 40px; box-shadow: 0 2px 5px rgba(0,0,0,0.05); margin-bottom: 30px; }
-        .nav a { display: inline-block; padding: 10px 20px; margin-right: 10px; color: #333; text-decoration: none; border-radius: 8px; transition: background 0.3s; }
-        .nav a:hover, .nav a.active { background: #667eea; color: white; }
-        .container { padding: 0 40px 40px 40px; max-width: 1400px; margin: 0 auto; }
-        .content-box { background: white; padding: 25px; border-radius: 12px; box-shadow: 0 2px 8px rgba(0,0,0,0.08); margin-bottom: 20px; }
-        .setting-row { display: flex; justify-content: space-between; align-items: center; padding: 15px 0; border-bottom: 1px solid #e0e0e0; }
-        .setting-row:last-child { border-bottom: none; }
-        .setting-label { font-weight: 600; color: #333; }
-        .setting-value { color: #666; }
-        input[type="text"], input[type="number"] { padding: 10px; border: 2px solid #e0e0e0; border-radius: 6px; width: 200px; }
-        button { padding: 10px 20px; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; border: none; border-radius: 6px; cursor: pointer; }
-        button:hover { opacity: 0.9; }
-        .toggle { position: relative; display: inline-block; width: 60px; height: 30px; }
-        .toggle input { opacity: 0; width: 0; height: 0; }
-        .slider { position: absolute; cursor: pointer; top: 0; left: 0; right: 0; bottom: 0; background-color: #ccc; transition: .4s; border-radius: 30px; }
-        .slider:before { position: absolute; content: ""; height: 22px; width: 22px; left: 4px; bottom: 4px; background-color: white; transition: .4s; border-radius: 50%; }
-        input:checked + .slider { background-color: #667eea; }
-        input:checked + .slider:before { transform: translateX(30px); }
-    </style>
+    <link rel="stylesheet" href="{{ url_for('static_asset', filename=asset_names['admin.css']) }}">
 </head>
-<body>
+<body class="page-settings">
     <div class="header">
         <h1>⚙️ Bot Settings</h1>
         <a href="{{ url_for('logout') }}" class="logout">Logout</a>
@@ -770,6 +1566,42 @@ SETTINGS_TEMPLATE = '''
 </html>
 '''
 
+TEMPLATES = {
+    'login.html': LOGIN_TEMPLATE,
+    'dashboard.html': DASHBOARD_TEMPLATE,
+    'users.html': USERS_TEMPLATE,
+    'tickets.html': TICKETS_TEMPLATE,
+    'ticket.html': TICKET_TEMPLATE,
+    'agents.html': AGENTS_TEMPLATE,
+    'settings.html': SETTINGS_TEMPLATE,
+}
+
+
+def build_assets(sources):
+    """
+    Fingerprint static assets by content.
+    Returns ({name: fingerprinted name}, {fingerprinted name: (fingerprint, cache entry)}).
+    """
+    names, files = {}, {}
+    for name, text in sources.items():
+        body = text.lstrip().encode()
+        fingerprint = hashlib.sha1(body).hexdigest()[:10]
+        stem, extension = os.path.splitext(name)
+        names[name] = f'{stem}.{fingerprint}{extension}'
+        content_type = ASSET_TYPES[extension]
+        files[names[name]] = (fingerprint, (content_type, body, gzip.compress(body, 9)))
+    return names, files
+
+
+ASSET_NAMES, ASSET_FILES = build_assets({'admin.css': ADMIN_CSS, 'dashboard.js': DASHBOARD_JS})
+TEMPLATES_DIGEST = hashlib.sha1(
+    ''.join([*TEMPLATES.values(), *ASSET_NAMES.values()]).encode()
+).hexdigest()[:8]
+
+# Templates are compiled once by Jinja and cached; assets are linked by fingerprinted name
+app.jinja_loader = DictLoader(TEMPLATES)
+app.add_template_global(ASSET_NAMES, 'asset_names')
+
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -782,9 +1614,9 @@ def login():
             session['logged_in'] = True
             return redirect(url_for('dashboard'))
         else:
-            return render_template_string(LOGIN_TEMPLATE, error='Invalid credentials')
+            return render_template('login.html', error='Invalid credentials')
     
-    return render_template_string(LOGIN_TEMPLATE)
+    return render_template('login.html')
 
 
 @app.route('/logout')
@@ -796,93 +1628,160 @@ def logout():
 
 @app.route('/')
 @login_required
+@cached_page('users', 'usage', 'support_tickets', 'agents', 'payment_proofs')
 def dashboard():
     """Main dashboard."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    stats = run_async(get_live_stats())
+    chart_data = run_async(get_chart_data(
+        request.args.get('days', 7, type=int), request.args.get('granularity', 'day')
+    ))
     
-    stats = loop.run_until_complete(get_stats())
-    chart_data = loop.run_until_complete(get_chart_data())
+    return render_template(
+        'dashboard.html', stats=stats, chart_data=chart_data,
+        chart_windows=CHART_WINDOWS, chart_granularities=list(CHART_GRANULARITIES)
+    )
+
+
+@app.route('/api/chart_data')
+@login_required
+@cached_page('users', 'usage')
+def chart_data_api():
+    """Chart data as JSON for a window and granularity."""
+    chart_data = run_async(get_chart_data(
+        request.args.get('days', 7, type=int), request.args.get('granularity', 'day')
+    ))
     
-    return render_template_string(DASHBOARD_TEMPLATE, stats=stats, chart_data=chart_data)
+    return jsonify(chart_data)
+
+
+@app.route('/stream/stats')
+@login_required
+def stats_stream():
+    """Live dashboard stats as server-sent events."""
+    events = queue.Queue()
+    runtime.loop.call_soon_threadsafe(live_stats.subscribe, events.put)
+    
+    def generate():
+        try:
+            while True:
+                try:
+                    yield format_sse(*events.get(timeout=SSE_KEEPALIVE))
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+        finally:
+            runtime.loop.call_soon_threadsafe(live_stats.unsubscribe, events.put)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+@app.route('/export/<name>')
+@login_required
+def export_data(name):
+    """Stream a table export as CSV or NDJSON, optionally gzip-compressed."""
+    fmt = request.args.get('format', 'csv')
+    after = request.args.get('after')
+    compress = bool(request.args.get('gzip'))
+    try:
+        parse_export(name, fmt, after)
+    except ExportError as e:
+        return str(e), 400
+    
+    return Response(
+        export_chunks(DB_PATH, name, fmt, after, compress),
+        mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt],
+        headers={
+            'Content-Disposition': f'attachment; filename="{export_filename(name, fmt, compress)}"'
+        }
+    )
+
+
+@app.route('/assets/<filename>')
+def static_asset(filename):
+    """Serve a fingerprinted stylesheet or script; cached by browsers for a year."""
+    if filename not in ASSET_FILES:
+        abort(404)
+    fingerprint, asset = ASSET_FILES[filename]
+    if fingerprint in request.if_none_match:
+        asset = None
+    
+    status, body, headers = page_response(
+        fingerprint, asset, request.headers.get('Accept-Encoding', ''), ASSET_CACHE_CONTROL
+    )
+    return Response(body, status=status, headers=headers)
 
 
 @app.route('/users')
 @login_required
+@cached_page('users')
 def users_page():
     """Users management page."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    query, options = user_list_query(request.args)
+    users, next_cursor = run_async(get_users(request.args.get('cursor'), **options))
     
-    users = loop.run_until_complete(get_users())
-    
-    return render_template_string(USERS_TEMPLATE, users=users)
+    return render_template(
+        'users.html', users=users, next_cursor=next_cursor, query=query,
+        user_filters=list(USER_FILTERS), user_sorts=USER_SORTS
+    )
 
 
 @app.route('/tickets')
 @login_required
+@cached_page('support_tickets', 'agents')
 def tickets_page():
     """Support tickets page."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    before_id = request.args.get('before', type=int)
+    tickets, next_cursor = run_async(get_tickets(before_id))
+    agents = run_async(get_agents())
     
-    tickets = loop.run_until_complete(get_tickets())
+    return render_template(
+        'tickets.html', tickets=tickets, next_cursor=next_cursor, ticket_statuses=TICKET_STATUSES,
+        agents=agents, agent_users={agent['id']: agent['user_id'] for agent in agents}
+    )
+
+
+@app.route('/tickets/<ticket_id>')
+@login_required
+@cached_page('support_tickets', 'support_messages', 'support_attachments', 'agents')
+def ticket_detail(ticket_id):
+    """One ticket with a page of its conversation."""
+    query, options = ticket_detail_query(request.args)
+    detail = run_async(get_ticket_detail(ticket_id, **options))
+    if detail is None:
+        abort(404)
     
-    return render_template_string(TICKETS_TEMPLATE, tickets=tickets)
+    return render_template('ticket.html', query=query, **detail)
 
 
 @app.route('/agents')
 @login_required
+@cached_page('agents')
 def agents_page():
     """Agents management page."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
-    agents = loop.run_until_complete(get_agents())
+    agents = run_async(get_agents())
     
-    return render_template_string(AGENTS_TEMPLATE, agents=agents)
+    return render_template('agents.html', agents=agents)
 
 
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
+@cached_page('bot_settings')
 def settings_page():
     """Settings page."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
     if request.method == 'POST':
-        # Update settings
-        maintenance_mode = '1' if request.form.get('maintenance_mode') else '0'
-        force_join_enabled = '1' if request.form.get('force_join_enabled') else '0'
-        force_join_channel = request.form.get('force_join_channel', '')
-        free_limit = request.form.get('free_limit', '10')
-        premium_limit = request.form.get('premium_limit', '1000')
-        referral_bonus = request.form.get('referral_bonus', '5')
-        flood_time = request.form.get('flood_time', '60')
-        
-        loop.run_until_complete(update_setting('maintenance_mode', maintenance_mode))
-        loop.run_until_complete(update_setting('force_join_enabled', force_join_enabled))
-        loop.run_until_complete(update_setting('force_join_channel', force_join_channel))
-        loop.run_until_complete(update_setting('free_limit', free_limit))
-        loop.run_until_complete(update_setting('premium_limit', premium_limit))
-        loop.run_until_complete(update_setting('referral_bonus', referral_bonus))
-        loop.run_until_complete(update_setting('flood_time', flood_time))
+        run_async(update_settings(settings_from_form(request.form)))
         
         return redirect(url_for('settings_page'))
     
-    settings = loop.run_until_complete(get_settings())
+    settings = run_async(get_settings())
     
-    return render_template_string(SETTINGS_TEMPLATE, settings=settings)
+    return render_template('settings.html', settings=settings)
 
 
 @app.route('/toggle_premium/<int:user_id>')
 @login_required
 def toggle_premium_route(user_id):
     """Toggle premium status."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
-    loop.run_until_complete(toggle_premium(user_id))
+    run_async(toggle_premium(user_id))
     
     return redirect(url_for('users_page'))
 
@@ -891,10 +1790,7 @@ def toggle_premium_route(user_id):
 @login_required
 def toggle_ban_route(user_id):
     """Toggle ban status."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
-    loop.run_until_complete(toggle_ban(user_id))
+    run_async(toggle_ban(user_id))
     
     return redirect(url_for('users_page'))
 
@@ -903,65 +1799,66 @@ def toggle_ban_route(user_id):
 @login_required
 def update_ticket_status_route(ticket_id, status):
     """Update ticket status."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
-    loop.run_until_complete(update_ticket_status(ticket_id, status))
+    run_async(update_ticket_status(ticket_id, status))
     
     return redirect(url_for('tickets_page'))
 
 
+@app.route('/users/bulk', methods=['POST'])
+@login_required
+def bulk_users_route():
+    """Apply one action to many users."""
+    try:
+        user_ids, action, days = bulk_users_from_form(request.form)
+    except ValueError as e:
+        return str(e), 400
+    
+    updated = run_async(bulk_update_users(user_ids, action, days))
+    
+    return redirect(url_for('users_page', updated=updated))
+
+
+@app.route('/tickets/bulk', methods=['POST'])
+@login_required
+def bulk_tickets_route():
+    """Change the status of many tickets."""
+    try:
+        ticket_ids, status = bulk_tickets_from_form(request.form)
+    except ValueError as e:
+        return str(e), 400
+    
+    updated = run_async(bulk_update_tickets(ticket_ids, status))
+    
+    return redirect(url_for('tickets_page', updated=updated))
+
+
+@app.route('/tickets/reassign', methods=['POST'])
+@login_required
+def reassign_tickets_route():
+    """Assign many tickets to another agent."""
+    try:
+        ticket_ids, agent_id = reassign_from_form(request.form)
+        updated = run_async(reassign_tickets(ticket_ids, agent_id))
+    except ValueError as e:
+        return str(e), 400
+    
+    return redirect(url_for('tickets_page', updated=updated))
+
+
 @app.route('/download_attachments/<ticket_id>')
 @login_required
 def download_attachments(ticket_id):
     """Download ticket attachments as ZIP."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
-    attachments = loop.run_until_complete(get_ticket_attachments(ticket_id))
+    attachments = run_async(get_ticket_attachments(ticket_id))
     
     if not attachments:
         return "No attachments found for this ticket.", 404
     
-    # Create temp ZIP file with attachment metadata
-    # Note: This creates a ZIP with file information, not actual files
-    # Actual files are stored in Telegram and can be accessed via bot
-    # For full file download, use Telegram Bot API with the file_id
-    temp_dir = tempfile.mkdtemp()
-    zip_path = os.path.join(temp_dir, f'{ticket_id}_attachments_info.zip')
-    
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
-        for i, attachment in enumerate(attachments, 1):
-            # Create a text file with attachment info
-            info_content = (
-                f"Attachment #{i}\n"
-                f"{'='*50}\n"
-                f"File Type: {attachment['file_type']}\n"
-                f"File Name: {attachment.get('file_name', 'N/A')}\n"
-                f"Telegram File ID: {attachment['file_id']}\n"
-                f"File Unique ID: {attachment['file_unique_id']}\n"
-                f"Created: {attachment['created_at']}\n\n"
-                f"Note: To download the actual file, use the Telegram Bot API:\n"
-                f"https://api.telegram.org/bot<TOKEN>/getFile?file_id={attachment['file_id']}\n"
-            )
-            filename = f"attachment_{i}_{attachment['file_type']}_info.txt"
-            zipf.writestr(filename, info_content)
-        
-        # Add README
-        readme_content = (
-            f"Ticket Attachments Information\n"
-            f"{'='*50}\n\n"
-            f"Ticket ID: {ticket_id}\n"
-            f"Total Attachments: {len(attachments)}\n\n"
-            f"This ZIP contains metadata about ticket attachments.\n"
-            f"Actual files are stored in Telegram and can be accessed via the bot.\n\n"
-            f"To download actual files:\n"
-            f"1. Use the file_id with Telegram Bot API\n"
-            f"2. Or forward files from the bot conversation\n"
-        )
-        zipf.writestr('README.txt', readme_content)
-    
-    return send_file(zip_path, as_attachment=True, download_name=f'{ticket_id}_attachments_info.zip')
+    return Response(
+        iter_async(attachments_zip(ticket_id, attachments)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{ticket_id}_attachments.zip"'}
+    )
 
 
 def main():
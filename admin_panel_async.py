@@ -0,0 +1,439 @@
+"""
+Async web admin panel served by aiohttp.
+Serves the same pages, queries and templates as the Flask panel, but handles
+every request on one event loop with a shared database connection pool.
+"""
+
+import asyncio
+import functools
+from types import SimpleNamespace
+
+import jinja2
+from aiohttp import web
+from itsdangerous import BadSignature, URLSafeSerializer
+
+import admin_panel
+from exports import EXPORT_FORMATS, ExportError, parse_export, export_chunks, export_filename
+from admin_panel import (
+    CHART_WINDOWS, CHART_GRANULARITIES, USER_FILTERS, USER_SORTS, SSE_KEEPALIVE,
+    ADMIN_USERNAME, ADMIN_PASSWORD, StatsStream, format_sse, get_live_stats,
+    get_chart_data, get_users, user_list_query, get_tickets, get_agents, get_settings,
+    update_settings, toggle_premium, toggle_ban, update_ticket_status,
+    get_ticket_attachments, settings_from_form, attachments_zip, close_pool,
+    get_data_version, page_etag, page_cache, page_response,
+    TEMPLATES, ASSET_NAMES, ASSET_FILES, ASSET_CACHE_CONTROL, TICKET_STATUSES,
+    bulk_users_from_form, bulk_tickets_from_form, bulk_update_users, bulk_update_tickets,
+    reassign_from_form, reassign_tickets, ticket_detail_query, get_ticket_detail
+)
+
+SESSION_COOKIE = 'admin_session'
+
+# Templates are compiled once at import instead of on every request
+jinja_env = jinja2.Environment(loader=jinja2.DictLoader(TEMPLATES), autoescape=True)
+jinja_env.globals['asset_names'] = ASSET_NAMES
+COMPILED_TEMPLATES = {name: jinja_env.get_template(name) for name in TEMPLATES}
+
+routes = web.RouteTableDef()
+
+
+def _serializer(app):
+    """Signs the session cookie."""
+    return URLSafeSerializer(app['secret_key'], salt='admin-session')
+
+
+def _url_for(router, endpoint, **params):
+    """Flask-style url_for: path parameters first, everything else as query string."""
+    resource = router[endpoint]
+    path_params = {
+        key: str(params.pop(key)) for key in list(params)
+        if '{' + key in resource.canonical
+    }
+    return str(resource.url_for(**path_params).with_query(params))
+
+
+def render(request, template, **context):
+    """Render a panel template as an HTML response."""
+    html = COMPILED_TEMPLATES[template].render(
+        url_for=functools.partial(_url_for, request.app.router),
+        request=SimpleNamespace(args=request.query),
+        **context
+    )
+    return web.Response(text=html, content_type='text/html')
+
+
+def redirect(request, endpoint, **params):
+    """Redirect to a named route."""
+    raise web.HTTPFound(_url_for(request.app.router, endpoint, **params))
+
+
+def _int_arg(request, name, default=None):
+    """Read an integer query argument, falling back to default when invalid."""
+    try:
+        return int(request.query[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def is_logged_in(request):
+    """Check the signed session cookie."""
+    try:
+        data = _serializer(request.app).loads(request.cookies.get(SESSION_COOKIE, ''))
+    except BadSignature:
+        return False
+    return bool(data.get('logged_in'))
+
+
+def login_required(handler):
+    """Decorator for login required routes."""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        if not is_logged_in(request):
+            redirect(request, 'login')
+        return await handler(request)
+    return wrapper
+
+
+def cached_page(*tables):
+    """Serve GET requests from the shared page cache while the tables are unchanged."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            if request.method != 'GET':
+                return await handler(request)
+            
+            etag = page_etag(request.path_qs, await get_data_version(tables))
+            if any(tag.value == etag for tag in request.if_none_match or ()):
+                page = None
+            else:
+                page = page_cache.get(etag)
+                if page is None:
+                    response = await handler(request)
+                    if response.status != 200:
+                        return response
+                    page = page_cache.put(etag, response.headers['Content-Type'], response.body)
+            
+            status, body, headers = page_response(etag, page, request.headers.get('Accept-Encoding', ''))
+            return web.Response(status=status, body=body, headers=headers)
+        return wrapper
+    return decorator
+
+
+@routes.route('*', '/login', name='login')
+async def login(request):
+    """Login page."""
+    if request.method == 'POST':
+        form = await request.post()
+        
+        if form.get('username') == ADMIN_USERNAME and form.get('password') == ADMIN_PASSWORD:
+            response = web.HTTPFound(_url_for(request.app.router, 'dashboard'))
+            response.set_cookie(
+                SESSION_COOKIE, _serializer(request.app).dumps({'logged_in': True}),
+                httponly=True, samesite='Lax'
+            )
+            raise response
+        return render(request, 'login.html', error='Invalid credentials')
+    
+    return render(request, 'login.html')
+
+
+@routes.get('/logout', name='logout')
+async def logout(request):
+    """Logout."""
+    response = web.HTTPFound(_url_for(request.app.router, 'login'))
+    response.del_cookie(SESSION_COOKIE)
+    raise response
+
+
+@routes.get('/', name='dashboard')
+@login_required
+@cached_page('users', 'usage', 'support_tickets', 'agents', 'payment_proofs')
+async def dashboard(request):
+    """Main dashboard."""
+    stats, chart_data = await asyncio.gather(
+        get_live_stats(),
+        get_chart_data(_int_arg(request, 'days', 7), request.query.get('granularity', 'day'))
+    )
+    
+    return render(
+        request, 'dashboard.html', stats=stats, chart_data=chart_data,
+        chart_windows=CHART_WINDOWS, chart_granularities=list(CHART_GRANULARITIES)
+    )
+
+
+@routes.get('/api/chart_data', name='chart_data_api')
+@login_required
+@cached_page('users', 'usage')
+async def chart_data_api(request):
+    """Chart data as JSON for a window and granularity."""
+    chart_data = await get_chart_data(
+        _int_arg(request, 'days', 7), request.query.get('granularity', 'day')
+    )
+    
+    return web.json_response(chart_data)
+
+
+@routes.get('/stream/stats', name='stats_stream')
+@login_required
+async def stats_stream(request):
+    """Live dashboard stats as server-sent events."""
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'
+    })
+    await response.prepare(request)
+    
+    events = asyncio.Queue()
+    live_stats = request.app['live_stats']
+    live_stats.subscribe(events.put_nowait)
+    try:
+        while True:
+            try:
+                message = format_sse(*await asyncio.wait_for(events.get(), SSE_KEEPALIVE))
+            except asyncio.TimeoutError:
+                message = ': keepalive\n\n'
+            await response.write(message.encode())
+    except ConnectionResetError:
+        pass  # The browser went away
+    finally:
+        live_stats.unsubscribe(events.put_nowait)
+    
+    return response
+
+
+@routes.get('/export/{name}', name='export_data')
+@login_required
+async def export_data(request):
+    """Stream a table export as CSV or NDJSON, optionally gzip-compressed."""
+    name = request.match_info['name']
+    fmt = request.query.get('format', 'csv')
+    after = request.query.get('after')
+    compress = bool(request.query.get('gzip'))
+    try:
+        parse_export(name, fmt, after)
+    except ExportError as e:
+        return web.Response(text=str(e), status=400)
+    
+    response = web.StreamResponse(headers={
+        'Content-Type': 'application/gzip' if compress else EXPORT_FORMATS[fmt],
+        'Content-Disposition': f'attachment; filename="{export_filename(name, fmt, compress)}"',
+    })
+    await response.prepare(request)
+    
+    # SQLite reads block, so each batch is produced in a worker thread
+    chunks = export_chunks(admin_panel.DB_PATH, name, fmt, after, compress)
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            await response.write(chunk)
+    finally:
+        chunks.close()
+    
+    await response.write_eof()
+    return response
+
+
+@routes.get('/assets/{filename}', name='static_asset')
+async def static_asset(request):
+    """Serve a fingerprinted stylesheet or script; cached by browsers for a year."""
+    filename = request.match_info['filename']
+    if filename not in ASSET_FILES:
+        raise web.HTTPNotFound()
+    fingerprint, asset = ASSET_FILES[filename]
+    if any(tag.value == fingerprint for tag in request.if_none_match or ()):
+        asset = None
+    
+    status, body, headers = page_response(
+        fingerprint, asset, request.headers.get('Accept-Encoding', ''), ASSET_CACHE_CONTROL
+    )
+    return web.Response(status=status, body=body, headers=headers)
+
+
+@routes.get('/users', name='users_page')
+@login_required
+@cached_page('users')
+async def users_page(request):
+    """Users management page."""
+    query, options = user_list_query(request.query)
+    users, next_cursor = await get_users(request.query.get('cursor'), **options)
+    
+    return render(
+        request, 'users.html', users=users, next_cursor=next_cursor, query=query,
+        user_filters=list(USER_FILTERS), user_sorts=USER_SORTS
+    )
+
+
+@routes.get('/tickets', name='tickets_page')
+@login_required
+@cached_page('support_tickets', 'agents')
+async def tickets_page(request):
+    """Support tickets page."""
+    tickets, next_cursor = await get_tickets(_int_arg(request, 'before'))
+    agents = await get_agents()
+    
+    return render(
+        request, 'tickets.html', tickets=tickets, next_cursor=next_cursor,
+        ticket_statuses=TICKET_STATUSES,
+        agents=agents, agent_users={agent['id']: agent['user_id'] for agent in agents}
+    )
+
+
+@routes.get('/agents', name='agents_page')
+@login_required
+@cached_page('agents')
+async def agents_page(request):
+    """Agents management page."""
+    agents = await get_agents()
+    
+    return render(request, 'agents.html', agents=agents)
+
+
+@routes.route('*', '/settings', name='settings_page')
+@login_required
+@cached_page('bot_settings')
+async def settings_page(request):
+    """Settings page."""
+    if request.method == 'POST':
+        await update_settings(settings_from_form(await request.post()))
+        
+        redirect(request, 'settings_page')
+    
+    settings = await get_settings()
+    
+    return render(request, 'settings.html', settings=settings)
+
+
+@routes.get(r'/toggle_premium/{user_id:\d+}', name='toggle_premium_route')
+@login_required
+async def toggle_premium_route(request):
+    """Toggle premium status."""
+    await toggle_premium(int(request.match_info['user_id']))
+    
+    redirect(request, 'users_page')
+
+
+@routes.get(r'/toggle_ban/{user_id:\d+}', name='toggle_ban_route')
+@login_required
+async def toggle_ban_route(request):
+    """Toggle ban status."""
+    await toggle_ban(int(request.match_info['user_id']))
+    
+    redirect(request, 'users_page')
+
+
+@routes.get('/update_ticket/{ticket_id}/{status}', name='update_ticket_status_route')
+@login_required
+async def update_ticket_status_route(request):
+    """Update ticket status."""
+    await update_ticket_status(request.match_info['ticket_id'], request.match_info['status'])
+    
+    redirect(request, 'tickets_page')
+
+
+@routes.post('/users/bulk', name='bulk_users_route')
+@login_required
+async def bulk_users_route(request):
+    """Apply one action to many users."""
+    try:
+        user_ids, action, days = bulk_users_from_form(await request.post())
+    except ValueError as e:
+        return web.Response(text=str(e), status=400)
+    
+    updated = await bulk_update_users(user_ids, action, days)
+    
+    redirect(request, 'users_page', updated=updated)
+
+
+@routes.post('/tickets/bulk', name='bulk_tickets_route')
+@login_required
+async def bulk_tickets_route(request):
+    """Change the status of many tickets."""
+    try:
+        ticket_ids, status = bulk_tickets_from_form(await request.post())
+    except ValueError as e:
+        return web.Response(text=str(e), status=400)
+    
+    updated = await bulk_update_tickets(ticket_ids, status)
+    
+    redirect(request, 'tickets_page', updated=updated)
+
+
+@routes.post('/tickets/reassign', name='reassign_tickets_route')
+@login_required
+async def reassign_tickets_route(request):
+    """Assign many tickets to another agent."""
+    try:
+        ticket_ids, agent_id = reassign_from_form(await request.post())
+        updated = await reassign_tickets(ticket_ids, agent_id)
+    except ValueError as e:
+        return web.Response(text=str(e), status=400)
+    
+    redirect(request, 'tickets_page', updated=updated)
+
+
+@routes.get('/tickets/{ticket_id}', name='ticket_detail')
+@login_required
+@cached_page('support_tickets', 'support_messages', 'support_attachments', 'agents')
+async def ticket_detail(request):
+    """One ticket with a page of its conversation."""
+    query, options = ticket_detail_query(request.query)
+    detail = await get_ticket_detail(request.match_info['ticket_id'], **options)
+    if detail is None:
+        raise web.HTTPNotFound()
+    
+    return render(request, 'ticket.html', query=query, **detail)
+
+
+@routes.get('/download_attachments/{ticket_id}', name='download_attachments')
+@login_required
+async def download_attachments(request):
+    """Download ticket attachments as ZIP."""
+    ticket_id = request.match_info['ticket_id']
+    attachments = await get_ticket_attachments(ticket_id)
+    
+    if not attachments:
+        return web.Response(text="No attachments found for this ticket.", status=404)
+    
+    response = web.StreamResponse(headers={
+        'Content-Type': 'application/zip',
+        'Content-Disposition': f'attachment; filename="{ticket_id}_attachments.zip"',
+    })
+    await response.prepare(request)
+    
+    chunks = attachments_zip(ticket_id, attachments)
+    try:
+        async for chunk in chunks:
+            await response.write(chunk)
+    finally:
+        await chunks.aclose()
+    
+    await response.write_eof()
+    return response
+
+
+async def _shutdown(app):
+    """Stop the live stats stream and close pooled database connections."""
+    app['live_stats'].close()
+    await close_pool()
+
+
+def create_app(secret_key=None):
+    """Build the aiohttp admin panel application."""
+    app = web.Application()
+    app['secret_key'] = secret_key or admin_panel.app.secret_key
+    app.add_routes(routes)
+    app['live_stats'] = StatsStream()
+    app.on_cleanup.append(_shutdown)
+    return app
+
+
+def main():
+    """Run the async admin panel."""
+    print("🌐 Starting async admin panel on http://localhost:5000")
+    print(f"📝 Default credentials: {ADMIN_USERNAME} / {ADMIN_PASSWORD}")
+    print("⚠️  Change these in config.ini!")
+    web.run_app(create_app(), host='0.0.0.0', port=5000)
+
+
+if __name__ == '__main__':
+    main()
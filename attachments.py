@@ -0,0 +1,127 @@
+"""
+Ticket attachment downloads for the admin panel.
+Fetches the real files from Telegram with the Bot API getFile method, a few at a
+time, and streams them into a ZIP archive without staging anything on disk.
+"""
+
+import asyncio
+import os
+import zipfile
+from typing import AsyncIterator, List, Optional
+
+import aiohttp
+
+TELEGRAM_API_URL = 'https://api.telegram.org'
+DOWNLOAD_CONCURRENCY = 4  # Files fetched from Telegram at once
+DOWNLOAD_TIMEOUT = 60  # Seconds allowed per file
+
+
+class AttachmentError(Exception):
+    """Raised when Telegram cannot provide an attachment."""
+
+
+class _ZipStream:
+    """Write-only, unseekable buffer; zipfile then writes entries with data descriptors."""
+    
+    def __init__(self):
+        """Initialize an empty buffer."""
+        self._buffer = bytearray()
+    
+    def write(self, data):
+        """Append archive bytes."""
+        self._buffer += data
+        return len(data)
+    
+    def flush(self):
+        """Nothing to flush; bytes are collected by drain()."""
+    
+    def drain(self) -> bytes:
+        """Return and clear the bytes written so far."""
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def attachment_filename(index: int, attachment: dict, file_path: str = '') -> str:
+    """ZIP entry name: numbered, with the original name or the Telegram file extension."""
+    name = os.path.basename(attachment.get('file_name') or '')
+    if not name:
+        name = attachment['file_type'] + os.path.splitext(file_path)[1]
+    return f"{index:02d}_{name}"
+
+
+async def fetch_attachment(session: aiohttp.ClientSession, api_url: str, token: str,
+                           file_id: str) -> tuple:
+    """Resolve a file_id with getFile and download it; returns (file_path, content)."""
+    async with session.get(f'{api_url}/bot{token}/getFile', params={'file_id': file_id}) as response:
+        try:
+            result = await response.json(content_type=None)
+        except ValueError:
+            result = None  # Not JSON, e.g. an HTML error page from a proxy
+    if not isinstance(result, dict):
+        raise AttachmentError(f'Unexpected getFile response: HTTP {response.status}')
+    if not result.get('ok'):
+        raise AttachmentError(result.get('description', f'HTTP {response.status}'))
+    
+    file_path = result['result']['file_path']
+    async with session.get(f'{api_url}/file/bot{token}/{file_path}') as response:
+        if response.status != 200:
+            raise AttachmentError(f'Download failed: HTTP {response.status}')
+        return file_path, await response.read()
+
+
+async def stream_attachments_zip(token: str, ticket_id: str, attachments: List[dict],
+                                 api_url: Optional[str] = None,
+                                 concurrency: int = DOWNLOAD_CONCURRENCY) -> AsyncIterator[bytes]:
+    """
+    Yield a ZIP archive of a ticket's attachments chunk by chunk.
+    Workers download at most `concurrency` files at once and hand them over
+    through a bounded queue, so memory holds only a few files at a time.
+    Files Telegram cannot provide are listed in README.txt instead.
+    """
+    api_url = (api_url or TELEGRAM_API_URL).rstrip('/')
+    pending = asyncio.Queue()
+    for item in enumerate(attachments, 1):
+        pending.put_nowait(item)
+    done = asyncio.Queue(maxsize=concurrency)
+    
+    async def worker(session):
+        while not pending.empty():
+            index, attachment = pending.get_nowait()
+            # Every attachment yields exactly one result, or the archive would wait forever
+            try:
+                result = await fetch_attachment(session, api_url, token, attachment['file_id'])
+            except Exception as e:
+                result = e
+            await done.put((index, attachment, result))
+    
+    stream = _ZipStream()
+    failed = []
+    timeout = aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        workers = [asyncio.create_task(worker(session)) for _ in range(min(concurrency, len(attachments)))]
+        try:
+            with zipfile.ZipFile(stream, 'w') as zipf:
+                for _ in attachments:
+                    index, attachment, result = await done.get()
+                    if isinstance(result, Exception):
+                        failed.append(f"{attachment_filename(index, attachment)}: {str(result) or type(result).__name__}")
+                        continue
+                    
+                    file_path, content = result
+                    # Media is already compressed, so files are stored as-is
+                    zipf.writestr(attachment_filename(index, attachment, file_path), content)
+                    yield stream.drain()
+                
+                readme = (
+                    f"Ticket ID: {ticket_id}\n"
+                    f"Attachments: {len(attachments) - len(failed)} of {len(attachments)}\n"
+                )
+                if failed:
+                    readme += "\nCould not be downloaded from Telegram:\n" + '\n'.join(failed) + '\n'
+                zipf.writestr('README.txt', readme)
+            yield stream.drain()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,553 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for the bot database and admin panel.
+Builds a synthetic database and reports timings for the hot queries.
+
+Usage:
+    python benchmark.py                 # run all benchmarks
+    python benchmark.py chart_data      # run one benchmark
+    python benchmark.py --users 1000000 --db bench.db chart_data
+    python benchmark.py --requests 5000 --threads 16 admin_panel
+    python benchmark.py --concurrency 100 admin_panel_http
+    python benchmark.py --users 10000 templates
+    python benchmark.py --faqs 5000 faq_search
+    python benchmark.py --tickets 200000 sla
+    python benchmark.py --tickets 2000000 ticket_create
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import statistics
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from database import Database
+from faq_index import FaqMatcher
+from sla import SlaScheduler, SLA_WINDOW
+
+
+def build_synthetic_db(path: str, users: int, usage_rows: int):
+    """Create a database with synthetic users and usage spread over two years."""
+    if os.path.exists(path):
+        print(f"♻️  Reusing synthetic database {path}")
+        # Bring older benchmark databases up to the current schema
+        asyncio.run(Database(path).initialize())
+        return
+    
+    print(f"🏗️  Building synthetic database: {users} users, ~{usage_rows} usage rows...")
+    started = time.perf_counter()
+    asyncio.run(Database(path).initialize())
+    
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        INSERT INTO users (user_id, username, first_name, language_code,
+                           is_premium, is_banned, referred_by, created_at)
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+        SELECT n, 'user' || n, 'Name' || (n % 5000), 'en',
+               (n % 20 = 0), (n % 100 = 0), CASE WHEN n % 3 = 0 THEN n / 3 END,
+               datetime('now', '-' || (abs(random()) % 63072000) || ' seconds')
+        FROM seq
+    ''', (users,))
+    conn.execute('''
+        INSERT OR IGNORE INTO usage (user_id, date, count)
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+        SELECT abs(random()) % ? + 1,
+               date('now', '-' || (abs(random()) % 730) || ' days'),
+               abs(random()) % 10 + 1
+        FROM seq
+    ''', (usage_rows, users))
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+    print(f"✅ Built in {time.perf_counter() - started:.1f}s")
+
+
+def timed(func, repeat: int = 5):
+    """Run func several times; return (median seconds, last result)."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+
+async def legacy_chart_data(db_path: str):
+    """The original dashboard chart queries: two queries per day for 7 days."""
+    import aiosqlite
+    async with aiosqlite.connect(db_path) as db:
+        for i in range(7, 0, -1):
+            date = (datetime.now() - timedelta(days=i)).date()
+            async with db.execute(
+                'SELECT COUNT(*) FROM users WHERE DATE(created_at) = ?', (date,)
+            ) as cursor:
+                await cursor.fetchone()
+            async with db.execute(
+                'SELECT SUM(count) FROM usage WHERE date = ?', (date,)
+            ) as cursor:
+                await cursor.fetchone()
+
+
+def bench_chart_data(args):
+    """Dashboard chart data for every window and granularity."""
+    import admin_panel
+    admin_panel.DB_PATH = args.db
+    
+    print("\n📈 Chart data (median of 5 runs)")
+    seconds, _ = timed(lambda: asyncio.run(legacy_chart_data(args.db)))
+    print(f"  legacy 7 days x 2 metrics (14 queries): {seconds * 1000:8.1f} ms")
+    
+    for days in admin_panel.CHART_WINDOWS:
+        for granularity in admin_panel.CHART_GRANULARITIES:
+            if granularity == 'hour' and days > admin_panel.MAX_HOURLY_WINDOW:
+                continue
+            seconds, data = timed(
+                lambda: asyncio.run(admin_panel.get_chart_data(days, granularity))
+            )
+            print(
+                f"  {days:>3} days by {granularity:<4} "
+                f"({len(data['user_growth'])} buckets): {seconds * 1000:8.1f} ms"
+            )
+
+
+USER_SEARCH_CASES = (
+    {},
+    {'search': '123456'},
+    {'search': '@user1'},
+    {'search': 'u'},
+    {'search': 'name12'},
+    {'search': 'name43 user'},
+    {'search': 'name12', 'sort': 'created_at'},
+    {'filters': ['premium']},
+    {'filters': ['banned', 'premium']},
+    {'filters': ['referred']},
+    {'sort': 'referral_count'},
+    {'sort': 'referral_count', 'filters': ['banned']},
+    {'sort': 'created_at', 'descending': False},
+)
+
+
+def bench_user_search(args):
+    """Users page search, filter and sort queries (first and second page)."""
+    import admin_panel
+    admin_panel.DB_PATH = args.db
+    
+    async def first_two_pages(options):
+        users, cursor = await admin_panel.get_users(**options)
+        await admin_panel.get_users(cursor, **options)
+    
+    print("\n🔎 User search (median of 5 runs, two pages each)")
+    for options in USER_SEARCH_CASES:
+        seconds, _ = timed(lambda: asyncio.run(first_two_pages(options)))
+        label = ', '.join(f'{key}={value}' for key, value in options.items()) or 'newest users'
+        print(f"  {label:<45} {seconds * 1000:8.1f} ms")
+
+
+FAQ_LANGUAGES = ('en', 'en', 'en', 'hi', 'es')  # Synthetic FAQ language mix
+
+
+def build_synthetic_faqs(path: str, count: int, vocabulary: int = 3000):
+    """Add synthetic FAQ entries (word<n> keywords and answers) until the table holds `count`."""
+    import random
+    rng = random.Random(42)
+    with sqlite3.connect(path) as conn:
+        existing = conn.execute('SELECT COUNT(*) FROM faq').fetchone()[0]
+        words = lambda n: ' '.join(f'word{rng.randrange(vocabulary)}' for _ in range(n))
+        conn.executemany(
+            'INSERT INTO faq (keywords, answer, language) VALUES (?, ?, ?)',
+            [(words(5), words(40), FAQ_LANGUAGES[i % len(FAQ_LANGUAGES)])
+             for i in range(existing, count)]
+        )
+    return rng
+
+
+async def legacy_search_faq(db_path: str, text: str, language: str = 'en'):
+    """The original FAQ lookup: the whole message as a LIKE substring of the keywords."""
+    import aiosqlite
+    async with aiosqlite.connect(db_path) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(
+            'SELECT * FROM faq WHERE is_active = 1 AND language = ? AND LOWER(keywords) LIKE ? LIMIT 1',
+            (language, f'%{text.lower()}%')
+        ) as cursor:
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+
+
+def bench_faq_search(args):
+    """FAQ auto-reply lookups: LIKE substring scan vs FTS5 with BM25 vs the in-memory index."""
+    rng = build_synthetic_faqs(args.db, args.faqs)
+    db = Database(args.db)
+    asyncio.run(db.initialize())  # Creates the FTS index for older benchmark databases
+    
+    with sqlite3.connect(args.db) as conn:
+        entries = conn.execute(
+            "SELECT keywords FROM faq WHERE language = 'en' ORDER BY random() LIMIT 200"
+        ).fetchall()
+    # User messages: a couple of an entry's keywords among filler words
+    messages = [
+        f"how do i {' '.join(rng.sample(keywords.split(), 2))} please"
+        for (keywords,) in entries
+    ]
+    # Most support-menu text is not a FAQ question: words no entry uses
+    unmatched = [f"thanks, word{3000 + i} worked" for i in range(len(messages))]
+    
+    matcher = FaqMatcher(db)
+    started = time.perf_counter()
+    asyncio.run(matcher.refresh())
+    print(f"\n❓ FAQ search ({args.faqs} entries, {len(messages)} messages each, "
+          f"index built in {(time.perf_counter() - started) * 1000:.0f} ms)")
+    for label, search in (('legacy LIKE', lambda text: legacy_search_faq(args.db, text)),
+                          ('fts5 bm25', lambda text: db.search_faq(text)),
+                          ('in-memory', lambda text: matcher.match(text))):
+        async def run(texts):
+            started = time.perf_counter()
+            found = [await search(text) for text in texts]
+            return time.perf_counter() - started, found
+        
+        elapsed, found = asyncio.run(run(messages))
+        answered = sum(1 for result in found if result)
+        # The entry a message was built from should be the top answer
+        best = sum(
+            1 for result, (keywords,) in zip(found, entries)
+            if result and result['keywords'] == keywords
+        )
+        print(f"  {label:<22} {elapsed / len(messages) * 1e6:9.1f} µs/message   "
+              f"answered {answered}/{len(messages)}, best match {best}")
+        
+        elapsed, found = asyncio.run(run(unmatched))
+        print(f"  {label + ', no match':<22} {elapsed / len(unmatched) * 1e6:9.1f} µs/message   "
+              f"answered {sum(1 for result in found if result)}/{len(unmatched)}")
+
+
+def build_synthetic_tickets(path: str, count: int):
+    """Add open synthetic tickets created over the last two days until there are `count`."""
+    with sqlite3.connect(path) as conn:
+        existing = conn.execute('SELECT COUNT(*) FROM support_tickets').fetchone()[0]
+        if existing >= count:
+            return
+        conn.execute('''
+            INSERT INTO support_tickets (ticket_id, user_id, subject, created_at, first_reply_at)
+            WITH RECURSIVE seq(n) AS (SELECT ? UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+            SELECT 'BENCH' || n, n % 1000 + 1, 'Synthetic ticket',
+                   datetime('now', '-' || (abs(random()) % 172800) || ' seconds'),
+                   CASE WHEN n % 2 = 0 THEN CURRENT_TIMESTAMP END
+            FROM seq
+        ''', (existing + 1, count))
+
+
+def bench_sla(args):
+    """SLA checks: scanning every open ticket vs loading the next window from the deadline index."""
+    build_synthetic_tickets(args.db, args.tickets)
+    db = Database(args.db)
+    with sqlite3.connect(args.db) as conn:
+        open_tickets = conn.execute(
+            "SELECT COUNT(*) FROM support_tickets WHERE status NOT IN ('resolved', 'closed')"
+        ).fetchone()[0]
+        # Steady state: earlier breaches are escalated, the next deadline is due now
+        now = conn.execute('SELECT MIN(sla_due_at) FROM support_tickets').fetchone()[0]
+    
+    print(f"\n⏰ SLA checks ({open_tickets} open tickets)")
+    
+    def full_scan():
+        # The periodic-scan alternative: every open ticket, deadlines computed per check
+        with sqlite3.connect(args.db) as conn:
+            rows = conn.execute('''
+                SELECT ticket_id, CAST(strftime('%s', created_at) AS INTEGER),
+                       first_reply_at, sla_first_reply, sla_resolution, escalated
+                FROM support_tickets WHERE status NOT IN ('resolved', 'closed')
+            ''').fetchall()
+        return [
+            row[0] for row in rows
+            if row[1] + (row[3] if row[2] is None and not row[5] else row[4]) <= now
+        ]
+    
+    started = time.perf_counter()
+    due = full_scan()
+    print(f"  {'full scan per check':<32} {(time.perf_counter() - started) * 1000:8.1f} ms   "
+          f"{len(due)} due, every open ticket read")
+    
+    scheduler = SlaScheduler(db)
+    started = time.perf_counter()
+    asyncio.run(scheduler.load_window(now))
+    print(f"  {'deadline index, window reload':<32} {(time.perf_counter() - started) * 1000:8.1f} ms   "
+          f"{len(scheduler)} deadlines held (next {SLA_WINDOW // 60} min)")
+
+
+async def legacy_create_ticket(db_path: str, user_id: int, subject: str):
+    """The original ticket creation: random 8-character IDs, probed with a SELECT first."""
+    import random
+    import string
+    import aiosqlite
+    for _ in range(10):
+        ticket_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+        async with aiosqlite.connect(db_path) as db:
+            async with db.execute(
+                'SELECT ticket_id FROM support_tickets WHERE ticket_id = ?', (ticket_id,)
+            ) as cursor:
+                if await cursor.fetchone():
+                    continue
+            await db.execute(
+                'INSERT INTO support_tickets (ticket_id, user_id, subject) VALUES (?, ?, ?)',
+                (ticket_id, user_id, subject)
+            )
+            await db.commit()
+            return ticket_id
+
+
+def bench_ticket_create(args):
+    """Ticket creation: random IDs with a probe query vs time-ordered IDs in one INSERT."""
+    build_synthetic_tickets(args.db, args.tickets)
+    db = Database(args.db)
+    count = 1000
+    print(f"\n🎫 Ticket creation ({args.tickets} existing tickets, {count} created per run)")
+    
+    for label, create in (('legacy probe + insert', lambda i: legacy_create_ticket(args.db, i, 'Bench')),
+                          ('single insert', lambda i: db.create_ticket(i, 'Bench'))):
+        async def run():
+            started = time.perf_counter()
+            created = [await create(i) for i in range(count)]
+            return time.perf_counter() - started, created
+        
+        elapsed, created = asyncio.run(run())
+        print(f"  {label:<24} {count / elapsed:8.0f} tickets/s   "
+              f"{elapsed / count * 1000:6.2f} ms/ticket   {sum(1 for t in created if t)} created")
+
+
+def process_snapshot():
+    """Open file descriptors, threads and resident memory (KiB) of this process."""
+    try:
+        fds = len(os.listdir('/proc/self/fd'))
+        with open('/proc/self/status') as status:
+            rss = next(int(line.split()[1]) for line in status if line.startswith('VmRSS:'))
+    except OSError:
+        # /proc is Linux-only
+        fds = rss = None
+    return {'fds': fds, 'threads': threading.active_count(), 'rss_kb': rss}
+
+
+def legacy_run_async(coro):
+    """The original route pattern: a fresh event loop per request, never closed."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop.run_until_complete(coro)
+
+
+def legacy_db_connection():
+    """The original route pattern: a new connection for every query."""
+    import aiosqlite
+    import admin_panel
+    return aiosqlite.connect(admin_panel.DB_PATH)
+
+
+ADMIN_PANEL_PATHS = ('/', '/users', '/tickets', '/agents', '/settings')
+
+
+def bench_admin_panel(args):
+    """Admin panel page views from concurrent worker threads."""
+    import admin_panel
+    admin_panel.DB_PATH = args.db
+    client_app = admin_panel.app
+    
+    def load_test(run_async, db_connection):
+        admin_panel.run_async = run_async
+        admin_panel.db_connection = db_connection
+        local = threading.local()
+        
+        def fetch(i):
+            if not hasattr(local, 'client'):
+                local.client = client_app.test_client()
+                with local.client.session_transaction() as flask_session:
+                    flask_session['logged_in'] = True
+            started = time.perf_counter()
+            response = local.client.get(ADMIN_PANEL_PATHS[i % len(ADMIN_PANEL_PATHS)])
+            assert response.status_code == 200, response.status_code
+            return time.perf_counter() - started
+        
+        before = process_snapshot()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as pool:
+            latencies = sorted(pool.map(fetch, range(args.requests)))
+        elapsed = time.perf_counter() - started
+        return before, process_snapshot(), elapsed, latencies
+    
+    print(f"\n🌐 Admin panel ({args.requests} requests, {args.threads} threads)")
+    shared = (admin_panel.run_async, admin_panel.db_connection)
+    for label, patterns in (('shared loop + pool', shared),
+                            ('legacy loop per request', (legacy_run_async, legacy_db_connection))):
+        before, after, elapsed, latencies = load_test(*patterns)
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+        print(f"  {label}:")
+        print(f"    {args.requests / elapsed:8.1f} req/s   p50 {p50:7.1f} ms   p99 {p99:7.1f} ms")
+        for key in ('fds', 'threads', 'rss_kb'):
+            if before[key] is not None:
+                print(f"    {key:<8} {before[key]:>8} -> {after[key]:>8}")
+    admin_panel.run_async, admin_panel.db_connection = shared
+
+
+def bench_templates(args):
+    """Admin page render time (compiled each time vs cached template) and response size."""
+    import gzip
+    import admin_panel
+    from flask import template_rendered
+    admin_panel.DB_PATH = args.db
+    app = admin_panel.app
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['logged_in'] = True
+    
+    print("\n🧩 Admin templates (median of 5 renders; sizes in bytes)")
+    print(f"  {'page':<10} {'from string':>12} {'cached':>10} {'html':>8} {'gzip':>7}")
+    for path in ADMIN_PANEL_PATHS:
+        rendered = []
+        admin_panel.page_cache = admin_panel.PageCache()  # Render instead of serving a cached page
+        with template_rendered.connected_to(lambda sender, template, context, **extra:
+                                            rendered.append((template, context)), app):
+            html = client.get(path).data
+        template, context = rendered[0]
+        source = admin_panel.TEMPLATES[template.name]
+        
+        with app.test_request_context(path):
+            string_seconds, _ = timed(lambda: app.jinja_env.from_string(source).render(context))
+            cached_seconds, _ = timed(lambda: template.render(context))
+        print(f"  {path:<10} {string_seconds * 1000:9.2f} ms {cached_seconds * 1000:7.2f} ms "
+              f"{len(html):>8} {len(gzip.compress(html)):>7}")
+    
+    for name, filename in admin_panel.ASSET_NAMES.items():
+        _, (_, body, gzipped) = admin_panel.ASSET_FILES[filename]
+        print(f"  asset {name:<14} {len(body):>8} bytes, {len(gzipped):>6} gzipped (cached for a year)")
+
+
+def serve_flask(db_path, port):
+    """Serve the Flask admin panel with the threaded development server."""
+    import admin_panel
+    from werkzeug.serving import make_server
+    admin_panel.DB_PATH = db_path
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    make_server('127.0.0.1', port, admin_panel.app, threaded=True).serve_forever()
+
+
+def serve_aiohttp(db_path, port):
+    """Serve the async admin panel."""
+    import admin_panel
+    import admin_panel_async
+    from aiohttp import web
+    admin_panel.DB_PATH = db_path
+    web.run_app(admin_panel_async.create_app(), host='127.0.0.1', port=port,
+                print=None, access_log=None)
+
+
+async def http_load(base_url, requests, concurrency):
+    """Log in and fetch panel pages from concurrent clients; returns (seconds, latencies)."""
+    import admin_panel
+    import aiohttp
+    
+    async with aiohttp.ClientSession(base_url, cookie_jar=aiohttp.CookieJar(unsafe=True)) as session:
+        credentials = {'username': admin_panel.ADMIN_USERNAME, 'password': admin_panel.ADMIN_PASSWORD}
+        for _ in range(100):
+            try:
+                async with session.post('/login', data=credentials) as response:
+                    response.raise_for_status()
+                break
+            except aiohttp.ClientConnectionError:
+                await asyncio.sleep(0.1)
+        
+        paths = iter(range(requests))
+        latencies = []
+        
+        async def client():
+            for i in paths:
+                started = time.perf_counter()
+                async with session.get(ADMIN_PANEL_PATHS[i % len(ADMIN_PANEL_PATHS)],
+                                       allow_redirects=False) as response:
+                    await response.read()
+                    assert response.status == 200, response.status
+                latencies.append(time.perf_counter() - started)
+        
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return time.perf_counter() - started, sorted(latencies)
+
+
+def bench_admin_panel_http(args):
+    """Flask vs aiohttp admin panel over real HTTP with concurrent clients."""
+    print(f"\n🌍 Admin panel over HTTP ({args.requests} requests, {args.concurrency} clients)")
+    spawn = multiprocessing.get_context('spawn')
+    for label, target in (('flask (threaded)', serve_flask), ('aiohttp', serve_aiohttp)):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        server = spawn.Process(target=target, args=(args.db, port), daemon=True)
+        server.start()
+        try:
+            elapsed, latencies = asyncio.run(
+                http_load(f'http://127.0.0.1:{port}', args.requests, args.concurrency)
+            )
+        finally:
+            server.terminate()
+            server.join()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+        print(f"  {label:<17} {args.requests / elapsed:8.1f} req/s   "
+              f"p50 {p50:7.1f} ms   p99 {p99:7.1f} ms")
+
+
+BENCHMARKS = {
+    'chart_data': bench_chart_data,
+    'user_search': bench_user_search,
+    'admin_panel': bench_admin_panel,
+    'admin_panel_http': bench_admin_panel_http,
+    'templates': bench_templates,
+    'faq_search': bench_faq_search,
+    'sla': bench_sla,
+    'ticket_create': bench_ticket_create,
+}
+
+
+def main():
+    """Parse arguments and run the selected benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help=f"benchmarks to run (default: all): {', '.join(BENCHMARKS)}")
+    parser.add_argument('--users', type=int, default=1_000_000, help='synthetic users')
+    parser.add_argument('--usage-rows', type=int, default=2_000_000, help='synthetic usage rows')
+    parser.add_argument('--db', help='synthetic database path (reused if it exists)')
+    parser.add_argument('--requests', type=int, default=2000, help='admin panel page views')
+    parser.add_argument('--threads', type=int, default=8, help='admin panel worker threads')
+    parser.add_argument('--concurrency', type=int, default=50, help='concurrent HTTP clients')
+    parser.add_argument('--faqs', type=int, default=5000, help='synthetic FAQ entries')
+    parser.add_argument('--tickets', type=int, default=200_000, help='synthetic tickets')
+    args = parser.parse_args()
+    
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+    
+    temp_dir = None
+    if not args.db:
+        temp_dir = tempfile.TemporaryDirectory()
+        args.db = os.path.join(temp_dir.name, 'benchmark.db')
+    
+    build_synthetic_db(args.db, args.users, args.usage_rows)
+    
+    for name in args.benchmarks or BENCHMARKS:
+        BENCHMARKS[name](args)
+    
+    if temp_dir:
+        temp_dir.cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
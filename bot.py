@@ -7,12 +7,15 @@ import logging
 import configparser
 import sys
 import os
+import time
 import zipfile
 import tempfile
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Optional
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButton
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
     CommandHandler,
     MessageHandler,
     ContextTypes,
@@ -20,9 +23,13 @@ from telegram.ext import (
     ConversationHandler,
 )
 
-from database import Database
+from database import Database, CLOSED_TICKET_STATUSES
+from broadcast import BroadcastEngine
 from youtube_utils import YouTubeExtractor
-from i18n import I18n
+from i18n import I18n, USER_LANGUAGE_CACHE_SIZE
+from faq_index import FaqMatcher
+from routing import AgentRouter
+from sla import SlaScheduler, SLA_CHECK_INTERVAL, sla_name
 
 # Configure logging
 logging.basicConfig(
@@ -33,10 +40,14 @@ logger = logging.getLogger(__name__)
 
 # Conversation states
 (MAIN_MENU, ADMIN_MENU, SUPPORT_MENU, TICKET_SUBJECT, TICKET_MESSAGE, 
- TICKET_ATTACHMENT, VIDEO_QUALITY_SELECT, AGENT_MENU) = range(8)
+ TICKET_ATTACHMENT, VIDEO_QUALITY_SELECT, AGENT_MENU, BROADCAST_MESSAGE) = range(9)
 
 # Constants
 TICKET_LIST_LIMIT = 15  # Maximum tickets to show in lists
+TICKET_THREAD_LIMIT = 10  # Messages (and attachments) per page of a ticket's conversation
+THREAD_PREVIEW_CHARS = 300  # Characters of each message shown in the conversation view
+SETTINGS_CHECK_INTERVAL = 2  # Seconds between settings version checks
+AGENT_LOAD_RECONCILE_HOURS = 6  # Hours between agent load reconciliations
 
 
 class ThumbnailBot:
@@ -63,19 +74,60 @@ class ThumbnailBot:
         self.flood_threshold = self.config.getint('limits', 'flood_threshold', fallback=5)
         self.flood_window = self.config.getint('limits', 'flood_window', fallback=60)
         
+        self.usage_retention_days = self.config.getint('retention', 'usage_days', fallback=90)
+        self.rollup_interval_hours = self.config.getint('retention', 'rollup_interval_hours', fallback=24)
+        
         self.referral_bonus = self.config.getint('referral', 'bonus_uses', fallback=5)
         self.premium_referrals = self.config.getint('referral', 'premium_referrals_required', fallback=10)
         
         default_lang = self.config.get('languages', 'default', fallback='en')
-        self.i18n = I18n(default_lang)
+        self.i18n = I18n(
+            default_lang, self.db,
+            cache_size=self.config.getint('languages', 'user_cache_size',
+                                          fallback=USER_LANGUAGE_CACHE_SIZE)
+        )
         
         self.youtube = YouTubeExtractor()
         
+        self.broadcaster = BroadcastEngine(
+            self.db,
+            rate=self.config.getfloat('broadcast', 'messages_per_second', fallback=25),
+            batch_size=self.config.getint('broadcast', 'batch_size', fallback=500),
+        )
+        
+        # Settings snapshot, reloaded when the settings version changes
+        self._settings = {}
+        self._settings_version = None
+        self._settings_checked = 0.0
+        
+        # FAQ auto-replies, answered from an in-memory index
+        self.faq_matcher = FaqMatcher(self.db)
+        
+        # Ticket routing to the least busy online agent
+        self.router = AgentRouter(
+            self.db,
+            use_heap=self.config.get('support', 'routing', fallback='heap') == 'heap',
+        )
+        
+        # SLA deadlines of open tickets
+        self.sla = SlaScheduler(self.db)
+        
         # Store active tickets for users
         self.user_contexts = {}
         
         logger.info("Bot initialized successfully")
     
+    async def get_settings(self) -> dict:
+        """Get bot settings, reloading them when the settings version changes."""
+        now = time.monotonic()
+        if now - self._settings_checked >= SETTINGS_CHECK_INTERVAL:
+            self._settings_checked = now
+            version = await self.db.get_settings_version()
+            if version != self._settings_version:
+                self._settings = await self.db.get_settings()
+                self._settings_version = version
+        return self._settings
+    
     def get_main_keyboard(self, user_id: int, is_premium: bool = False, 
                          is_admin: bool = False, is_agent: bool = False):
         """Get main menu keyboard based on user role."""
@@ -124,6 +176,7 @@ class ThumbnailBot:
         """Get agent panel keyboard."""
         keyboard = [
             ['📋 Open Tickets', '✅ My Tickets'],
+            ['⏭️ More Tickets'],
             ['🟢 Go Online', '🔴 Go Offline'],
             ['📊 My Stats', '🔙 Back to Main']
         ]
@@ -144,8 +197,8 @@ class ThumbnailBot:
         user_id = user.id
         
         # Check maintenance mode
-        maintenance = await self.db.get_setting('maintenance_mode')
-        if maintenance == '1' and user_id not in self.admin_ids:
+        settings = await self.get_settings()
+        if settings.get('maintenance_mode') == '1' and user_id not in self.admin_ids:
             await update.message.reply_text(
                 "🚧 Bot is under maintenance. Please try again later."
             )
@@ -171,9 +224,8 @@ class ThumbnailBot:
         )
         
         # Check force join channel
-        force_join = await self.db.get_setting('force_join_enabled')
-        if force_join == '1':
-            channel = await self.db.get_setting('force_join_channel')
+        if settings.get('force_join_enabled') == '1':
+            channel = settings.get('force_join_channel')
             if channel:
                 try:
                     member = await context.bot.get_chat_member(channel, user_id)
@@ -223,8 +275,8 @@ class ThumbnailBot:
         text = update.message.text
         
         # Check maintenance mode
-        maintenance = await self.db.get_setting('maintenance_mode')
-        if maintenance == '1' and user_id not in self.admin_ids:
+        settings = await self.get_settings()
+        if settings.get('maintenance_mode') == '1' and user_id not in self.admin_ids:
             await update.message.reply_text(
                 "🚧 Bot is under maintenance. Please try again later."
             )
@@ -550,7 +602,7 @@ class ThumbnailBot:
             return TICKET_SUBJECT
         
         elif text == '📋 My Tickets':
-            tickets = await self.db.get_user_tickets(user_id)
+            tickets = await self.db.get_user_tickets(user_id, limit=10)  # Show last 10
             
             if not tickets:
                 await update.message.reply_text(
@@ -559,7 +611,7 @@ class ThumbnailBot:
                 )
             else:
                 ticket_list = "📋 Your Support Tickets:\n\n"
-                for ticket in tickets[:10]:  # Show last 10
+                for ticket in tickets:
                     status_emoji = "🟢" if ticket['status'] == 'open' else "🔴"
                     ticket_list += (
                         f"{status_emoji} {ticket['ticket_id']}\n"
@@ -585,8 +637,9 @@ class ThumbnailBot:
             return MAIN_MENU
         
         else:
-            # Check FAQ for auto-reply
-            faq = await self.db.search_faq(text)
+            # Check FAQ for auto-reply, in the user's language
+            language = await self.i18n.load_user_language(user_id, update.effective_user.language_code)
+            faq = await self.faq_matcher.match(text, language)
             if faq:
                 await update.message.reply_text(
                     f"💡 FAQ Answer:\n\n{faq['answer']}\n\n"
@@ -620,33 +673,32 @@ class ThumbnailBot:
         message = update.message.text
         subject = context.user_data.get('ticket_subject', 'No Subject')
         
-        # Create ticket
-        ticket_id = await self.db.create_ticket(user_id, subject)
+        # Create the ticket with its first message, assigned to the least busy agent
+        ticket, agent = await self.router.open_ticket(user_id, subject, message)
         
-        if not ticket_id:
+        if not ticket:
             await update.message.reply_text("❌ Error creating ticket. Please try again.")
             keyboard = self.get_support_keyboard()
             await update.message.reply_text("Returning to support menu...", reply_markup=keyboard)
             return SUPPORT_MENU
         
-        # Add message to ticket
-        await self.db.add_ticket_message(ticket_id, user_id, message)
+        ticket_id = ticket['ticket_id']
+        self.sla.schedule(ticket_id, ticket['sla_due_at'])
         
-        # Auto-assign to least busy agent
-        agent = await self.db.get_least_busy_agent()
         if agent:
-            await self.db.assign_ticket(ticket_id, agent['id'])
-            # Notify agent
+            # Notify agent; replies to the notification are relayed to the user
             try:
-                await context.bot.send_message(
+                sent = await context.bot.send_message(
                     chat_id=agent['user_id'],
                     text=(
                         f"🎫 New Ticket Assigned: {ticket_id}\n"
                         f"Subject: {subject}\n"
                         f"User: {user_id}\n\n"
-                        f"Message: {message}"
+                        f"Message: {message}\n\n"
+                        f"↩️ Reply to this message to answer the user."
                     )
                 )
+                await self.db.link_ticket_message(agent['user_id'], sent.message_id, ticket_id)
             except Exception as e:
                 logger.error(f"Could not notify agent {agent['user_id']}: {e}")
         
@@ -793,15 +845,16 @@ class ThumbnailBot:
             current = await self.db.get_setting('maintenance_mode')
             new_value = '0' if current == '1' else '1'
             await self.db.set_setting('maintenance_mode', new_value)
+            self._settings_checked = 0.0  # Pick up the change immediately
             status = "ENABLED ✅" if new_value == '1' else "DISABLED ❌"
             await update.message.reply_text(f"🔧 Maintenance Mode: {status}")
             return ADMIN_MENU
         
         elif text == '🔗 Force Join':
             # Show force join settings
-            enabled = await self.db.get_setting('force_join_enabled')
-            channel = await self.db.get_setting('force_join_channel')
-            status = "ENABLED ✅" if enabled == '1' else "DISABLED ❌"
+            settings = await self.db.get_settings()
+            channel = settings.get('force_join_channel')
+            status = "ENABLED ✅" if settings.get('force_join_enabled') == '1' else "DISABLED ❌"
             await update.message.reply_text(
                 f"🔗 Force Join Settings\n\n"
                 f"Status: {status}\n"
@@ -855,17 +908,25 @@ class ThumbnailBot:
             return ADMIN_MENU
         
         elif text == '📢 Broadcast':
+            active = await self.db.get_active_broadcasts()
+            if active:
+                await update.message.reply_text(
+                    BroadcastEngine.format_progress(active[0]) +
+                    "\n\nWait for it to finish before starting a new broadcast."
+                )
+                return ADMIN_MENU
+            
+            keyboard = ReplyKeyboardMarkup([['🔙 Back to Admin']], resize_keyboard=True)
             await update.message.reply_text(
                 "📢 Broadcast Message\n\n"
-                "Feature available via web admin panel.\n"
-                "Start admin panel: python3 admin_panel.py"
+                "Send the message to deliver to all users:",
+                reply_markup=keyboard
             )
-            return ADMIN_MENU
+            return BROADCAST_MESSAGE
         
         elif text == '🎫 Support Tickets':
             # Show admin ticket management
-            open_tickets = await self.db.get_open_tickets()
-            total_tickets = len(open_tickets) if open_tickets else 0
+            total_tickets = await self.db.count_open_tickets()
             await update.message.reply_text(
                 f"🎫 Support Tickets\n\n"
                 f"Open Tickets: {total_tickets}\n\n"
@@ -890,6 +951,39 @@ class ThumbnailBot:
             )
             return ADMIN_MENU
     
+    async def handle_broadcast_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Start a broadcast with the message sent by an admin."""
+        user_id = update.effective_user.id
+        text = update.message.text
+        
+        if user_id not in self.admin_ids:
+            await update.message.reply_text("❌ Access denied.")
+            return MAIN_MENU
+        
+        keyboard = self.get_admin_keyboard()
+        
+        if text == '🔙 Back to Admin':
+            await update.message.reply_text("👑 Admin Panel", reply_markup=keyboard)
+            return ADMIN_MENU
+        
+        broadcast_id = await self.broadcaster.start(
+            context.bot, text, user_id, update.effective_chat.id
+        )
+        
+        if broadcast_id:
+            await update.message.reply_text(
+                f"🚀 Broadcast #{broadcast_id} started.\n"
+                f"Progress is updated live above.",
+                reply_markup=keyboard
+            )
+        else:
+            await update.message.reply_text(
+                "❌ Error starting broadcast. Please try again.",
+                reply_markup=keyboard
+            )
+        
+        return ADMIN_MENU
+    
     async def show_bot_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show bot statistics."""
         stats = await self.db.get_stats()
@@ -899,6 +993,9 @@ class ThumbnailBot:
             f"👥 Total Users: {stats['total_users']}\n"
             f"💎 Premium Users: {stats['premium_users']}\n"
             f"📈 Today's Requests: {stats['today_requests']}\n"
+            f"🚫 Banned Users: {stats['banned_users']}\n"
+            f"🎫 Open Tickets: {stats['open_tickets']}\n"
+            f"🟢 Online Agents: {stats['online_agents']}\n"
         )
         
         await update.message.reply_text(stats_text)
@@ -913,50 +1010,30 @@ class ThumbnailBot:
             return MAIN_MENU
         
         if text == '🟢 Go Online':
-            await self.db.set_agent_online(user_id, True)
+            await self.router.set_online(user_id, True)
             await update.message.reply_text("✅ You are now ONLINE for ticket assignments!")
             return AGENT_MENU
         
         elif text == '🔴 Go Offline':
-            await self.db.set_agent_online(user_id, False)
+            await self.router.set_online(user_id, False)
             await update.message.reply_text("✅ You are now OFFLINE. No new tickets will be assigned.")
             return AGENT_MENU
         
         elif text == '📋 Open Tickets':
-            tickets = await self.db.get_open_tickets()
-            
-            if not tickets:
-                await update.message.reply_text("📋 No open tickets at the moment!")
-            else:
-                ticket_list = "📋 Open Tickets:\n\n"
-                for ticket in tickets[:TICKET_LIST_LIMIT]:
-                    ticket_list += (
-                        f"🎫 {ticket['ticket_id']}\n"
-                        f"Subject: {ticket['subject']}\n"
-                        f"Status: {ticket['status']}\n"
-                        f"Created: {ticket['created_at'][:16]}\n\n"
-                    )
-                await update.message.reply_text(ticket_list)
-            
+            await self.show_agent_ticket_page(update, context, 'open')
             return AGENT_MENU
         
         elif text == '✅ My Tickets':
             # Show agent's assigned tickets
-            tickets = await self.db.get_agent_tickets(user_id)
-            
-            if not tickets:
-                await update.message.reply_text("📋 You have no assigned tickets!")
+            await self.show_agent_ticket_page(update, context, 'assigned')
+            return AGENT_MENU
+        
+        elif text == '⏭️ More Tickets':
+            page = context.user_data.get('agent_ticket_page')
+            if not page:
+                await update.message.reply_text("📋 No more tickets to show.")
             else:
-                ticket_list = "📋 Your Assigned Tickets:\n\n"
-                for ticket in tickets[:TICKET_LIST_LIMIT]:
-                    ticket_list += (
-                        f"🎫 {ticket['ticket_id']}\n"
-                        f"Subject: {ticket['subject']}\n"
-                        f"Status: {ticket['status']}\n"
-                        f"Created: {ticket['created_at'][:16]}\n\n"
-                    )
-                await update.message.reply_text(ticket_list)
-            
+                await self.show_agent_ticket_page(update, context, page['list'], page['cursor'])
             return AGENT_MENU
         
         elif text == '📊 My Stats':
@@ -966,6 +1043,7 @@ class ThumbnailBot:
                 stats_text = (
                     f"📊 Agent Statistics\n\n"
                     f"🎫 Assigned Tickets: {stats.get('assigned_tickets', 0)}\n"
+                    f"📬 Open Now: {stats.get('open_tickets', 0)}\n"
                     f"✅ Resolved Tickets: {stats.get('resolved_tickets', 0)}\n"
                     f"🟢 Status: {'Online' if stats.get('is_online') else 'Offline'}"
                 )
@@ -989,10 +1067,302 @@ class ThumbnailBot:
             )
             return AGENT_MENU
     
+    async def show_agent_ticket_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                     list_name: str, cursor: int = None):
+        """Show one page of open or assigned tickets, remembering where it ended."""
+        user_id = update.effective_user.id
+        
+        # Fetch one extra row to know whether another page exists
+        if list_name == 'open':
+            title = "📋 Open Tickets"
+            tickets = await self.db.get_open_tickets(
+                limit=TICKET_LIST_LIMIT + 1, after_id=cursor or 0
+            )
+        else:
+            title = "📋 Your Assigned Tickets"
+            kwargs = {'before_id': cursor} if cursor else {}
+            tickets = await self.db.get_agent_tickets(
+                user_id, limit=TICKET_LIST_LIMIT + 1, **kwargs
+            )
+        
+        has_more = len(tickets) > TICKET_LIST_LIMIT
+        tickets = tickets[:TICKET_LIST_LIMIT]
+        
+        if not tickets:
+            context.user_data.pop('agent_ticket_page', None)
+            if cursor:
+                await update.message.reply_text("📋 No more tickets to show.")
+            elif list_name == 'open':
+                await update.message.reply_text("📋 No open tickets at the moment!")
+            else:
+                await update.message.reply_text("📋 You have no assigned tickets!")
+            return
+        
+        ticket_list = f"{title}:\n\n"
+        for ticket in tickets:
+            ticket_list += (
+                f"🎫 {ticket['ticket_id']}\n"
+                f"Subject: {ticket['subject']}\n"
+                f"Status: {ticket['status']}\n"
+                f"Created: {ticket['created_at'][:16]}\n\n"
+            )
+        
+        ticket_list += "🔎 Send /ticket <ticket_id> to read a conversation.\n"
+        if has_more:
+            context.user_data['agent_ticket_page'] = {
+                'list': list_name, 'cursor': tickets[-1]['id']
+            }
+            ticket_list += "⏭️ Tap 'More Tickets' for the next page."
+        else:
+            context.user_data.pop('agent_ticket_page', None)
+        
+        await update.message.reply_text(ticket_list)
+    
     async def post_init(self, application: Application):
         """Initialize database after application starts."""
         await self.db.initialize()
         logger.info("Database initialized")
+        
+        drift = await self.db.check_stats_counters(repair=True)
+        if drift:
+            logger.warning(f"Repaired drifted stats counters: {sorted(drift)}")
+        await self.db.reconcile_agent_loads()
+        
+        if application.job_queue:
+            application.job_queue.run_repeating(
+                self.rollup_usage_job,
+                interval=timedelta(hours=self.rollup_interval_hours),
+                first=timedelta(minutes=1),
+                name='usage_rollup'
+            )
+            application.job_queue.run_repeating(
+                self.reconcile_agent_loads_job,
+                interval=timedelta(hours=AGENT_LOAD_RECONCILE_HOURS),
+                first=timedelta(hours=AGENT_LOAD_RECONCILE_HOURS),
+                name='agent_load_reconcile'
+            )
+            application.job_queue.run_repeating(
+                self.sla_job,
+                interval=SLA_CHECK_INTERVAL,
+                first=SLA_CHECK_INTERVAL,
+                name='sla_timers'
+            )
+        else:
+            logger.warning("Job queue unavailable; usage rollup, agent load checks and SLA timers "
+                           "will not run. Install python-telegram-bot[job-queue].")
+        
+        resumed = await self.broadcaster.resume_pending(application.bot)
+        if resumed:
+            logger.info(f"Resumed broadcasts: {resumed}")
+    
+    async def rollup_usage_job(self, context: ContextTypes.DEFAULT_TYPE):
+        """Periodic job: roll up finished usage days and prune old detail rows."""
+        await self.db.rollup_usage(self.usage_retention_days)
+    
+    async def reconcile_agent_loads_job(self, context: ContextTypes.DEFAULT_TYPE):
+        """Periodic job: correct agent loads that drifted from their open tickets."""
+        if await self.db.reconcile_agent_loads():
+            await self.router.refresh(force=True)
+    
+    async def sla_job(self, context: ContextTypes.DEFAULT_TYPE):
+        """Periodic job: escalate tickets whose SLA deadline has passed."""
+        for ticket in await self.sla.tick():
+            text = (
+                f"⏰ SLA Breached: {sla_name(ticket['escalated'])}\n"
+                f"Ticket: {ticket['ticket_id']}\n"
+                f"Subject: {ticket['subject']}\n"
+                f"User: {ticket['user_id']}"
+            )
+            recipients = set(self.admin_ids)
+            if ticket['agent_user_id']:
+                recipients.add(ticket['agent_user_id'])
+            for chat_id in recipients:
+                try:
+                    sent = await context.bot.send_message(chat_id=chat_id, text=text)
+                    await self.db.link_ticket_message(chat_id, sent.message_id, ticket['ticket_id'])
+                except Exception as e:
+                    logger.error(f"Could not notify {chat_id} of SLA breach: {e}")
+    
+    async def relay_ticket_message(self, context: ContextTypes.DEFAULT_TYPE, ticket_id: str,
+                                   sender_id: int, text: str) -> Optional[dict]:
+        """
+        Store a message on a ticket and forward it to the other side: agent and
+        admin replies go to the user, user replies to the assigned agent. The
+        forwarded message is linked to the ticket so it can be replied to in turn.
+        Callers check ticket_reply_error first. Returns the ticket, or None if it
+        does not exist.
+        """
+        ticket = await self.db.add_ticket_message(
+            ticket_id, sender_id, text, is_staff=True if sender_id in self.admin_ids else None
+        )
+        if not ticket:
+            return None
+        
+        if sender_id == ticket['user_id']:
+            recipient = ticket['agent_user_id']
+            relayed = f"💬 Ticket {ticket_id} — message from user {sender_id}:\n\n{text}"
+        else:
+            recipient = ticket['user_id']
+            relayed = f"💬 Support reply on ticket {ticket_id}:\n\n{text}"
+        if not recipient:
+            return ticket  # Unassigned; agents see the message in the ticket
+        
+        try:
+            sent = await context.bot.send_message(
+                chat_id=recipient,
+                text=f"{relayed}\n\n↩️ Reply to this message to respond."
+            )
+            await self.db.link_ticket_message(recipient, sent.message_id, ticket_id)
+        except Exception as e:
+            logger.error(f"Could not relay message on ticket {ticket_id} to {recipient}: {e}")
+        return ticket
+    
+    async def ticket_reply_error(self, ticket: Optional[dict], ticket_id: str,
+                                 user_id: int) -> Optional[str]:
+        """
+        Why a user may not post on a ticket, or None if they may: only open
+        tickets take messages, and only from their user, the assigned agent
+        or an admin.
+        """
+        if not ticket:
+            return f"❌ Ticket {ticket_id} not found."
+        if ticket['status'] in CLOSED_TICKET_STATUSES:
+            return f"❌ Ticket {ticket_id} is {ticket['status']}. Please open a new ticket."
+        if user_id == ticket['user_id'] or user_id in self.admin_ids:
+            return None
+        agent = await self.db.get_agent_by_user_id(user_id)
+        if not agent or agent['id'] != ticket['assigned_agent_id']:
+            return f"❌ Ticket {ticket_id} is not assigned to you."
+        return None
+    
+    async def language_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /language <code>: store the user's language preference."""
+        user_id = update.effective_user.id
+        languages = self.i18n.get_available_languages()
+        
+        language = self.i18n.supported_language(context.args[0]) if context.args else None
+        if language:
+            if await self.i18n.set_user_language(user_id, language):
+                await update.message.reply_text(f"✅ Language set to {languages[language]}.")
+            else:
+                # No users row (the user never ran /start) or a failed write
+                await update.message.reply_text(
+                    "❌ Your language could not be saved. Send /start, then try again."
+                )
+            return
+        
+        current = await self.i18n.load_user_language(user_id, update.effective_user.language_code)
+        options = '\n'.join(f"{code} - {name}" for code, name in languages.items())
+        await update.message.reply_text(
+            f"🌐 Current language: {languages.get(current, current)}\n\n"
+            f"{options}\n\n"
+            f"Usage: /language <code>"
+        )
+    
+    async def reply_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /reply <ticket_id> <message> from agents and admins."""
+        user_id = update.effective_user.id
+        if user_id not in self.admin_ids and not await self.db.is_agent(user_id):
+            await update.message.reply_text("❌ Access denied.")
+            return
+        
+        if len(context.args) < 2:
+            await update.message.reply_text("Usage: /reply <ticket_id> <message>")
+            return
+        
+        ticket_id = context.args[0]
+        text = update.message.text.split(None, 2)[2]
+        error = await self.ticket_reply_error(await self.db.get_ticket(ticket_id), ticket_id, user_id)
+        if error:
+            await update.message.reply_text(error)
+        elif await self.relay_ticket_message(context, ticket_id, user_id, text):
+            await update.message.reply_text(f"✅ Reply sent on ticket {ticket_id}.")
+        else:
+            await update.message.reply_text(f"❌ Ticket {ticket_id} not found.")
+    
+    async def ticket_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /ticket <ticket_id> (open a conversation) and /ticket (its next page)."""
+        user_id = update.effective_user.id
+        if user_id not in self.admin_ids and not await self.db.is_agent(user_id):
+            await update.message.reply_text("❌ Access denied.")
+            return
+        
+        if context.args:
+            thread = {'ticket_id': context.args[0], 'messages': 0, 'attachments': 0}
+        else:
+            thread = context.user_data.get('ticket_thread')
+            if not thread:
+                await update.message.reply_text("Usage: /ticket <ticket_id>")
+                return
+        await self.show_ticket_thread(update, context, thread)
+    
+    async def show_ticket_thread(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                 thread: dict):
+        """Show one page of a ticket's messages and attachments, remembering where it ended."""
+        ticket_id = thread['ticket_id']
+        ticket = await self.db.get_ticket(ticket_id)
+        if not ticket:
+            context.user_data.pop('ticket_thread', None)
+            await update.message.reply_text(f"❌ Ticket {ticket_id} not found.")
+            return
+        
+        # Fetch one extra row of each to know whether another page exists
+        messages = await self.db.get_ticket_messages(
+            ticket_id, limit=TICKET_THREAD_LIMIT + 1, after_id=thread['messages']
+        )
+        attachments = await self.db.get_ticket_attachments(
+            ticket_id, limit=TICKET_THREAD_LIMIT + 1, after_id=thread['attachments']
+        )
+        has_more = len(messages) > TICKET_THREAD_LIMIT or len(attachments) > TICKET_THREAD_LIMIT
+        messages = messages[:TICKET_THREAD_LIMIT]
+        attachments = attachments[:TICKET_THREAD_LIMIT]
+        
+        text = f"🎫 {ticket_id} · {ticket['status']} · {ticket['subject']}\n\n"
+        for message in messages:
+            sender = '👤' if message['sender_id'] == ticket['user_id'] else '🎧'
+            body = message['message'] or ''
+            if len(body) > THREAD_PREVIEW_CHARS:
+                body = body[:THREAD_PREVIEW_CHARS - 1] + '…'
+            text += f"[{message['created_at'][5:16]}] {sender} {body}\n"
+        for attachment in attachments:
+            text += (
+                f"[{attachment['created_at'][5:16]}] 📎 {attachment['file_type']} "
+                f"{attachment['file_name'] or ''}\n"
+            )
+        if not messages and not attachments:
+            first_page = not thread['messages'] and not thread['attachments']
+            text += "No messages yet.\n" if first_page else "No more messages.\n"
+        
+        text += "\n↩️ Reply to this message to answer the user."
+        if has_more:
+            context.user_data['ticket_thread'] = {
+                'ticket_id': ticket_id,
+                'messages': messages[-1]['id'] if messages else thread['messages'],
+                'attachments': attachments[-1]['id'] if attachments else thread['attachments'],
+            }
+            text += "\n⏭️ Send /ticket for the next page."
+        else:
+            context.user_data.pop('ticket_thread', None)
+        
+        sent = await update.message.reply_text(text)
+        await self.db.link_ticket_message(sent.chat_id, sent.message_id, ticket_id)
+    
+    async def handle_ticket_reply(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Relay a reply to a message linked to a ticket, ahead of the menu handlers."""
+        message = update.message
+        ticket_id = await self.db.get_linked_ticket(message.chat_id, message.reply_to_message.message_id)
+        if not ticket_id:
+            return  # An ordinary reply; the conversation handles it
+        
+        user_id = update.effective_user.id
+        error = await self.ticket_reply_error(await self.db.get_ticket(ticket_id), ticket_id, user_id)
+        if error:
+            await message.reply_text(error)
+        elif await self.relay_ticket_message(context, ticket_id, user_id, message.text):
+            await message.reply_text(f"✅ Message sent on ticket {ticket_id}.")
+        else:
+            await message.reply_text(f"❌ Ticket {ticket_id} is not available.")
+        raise ApplicationHandlerStop
     
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Cancel current operation and return to main menu."""
@@ -1043,10 +1413,21 @@ class ThumbnailBot:
                 AGENT_MENU: [
                     MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_agent_menu)
                 ],
+                BROADCAST_MESSAGE: [
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_broadcast_message)
+                ],
             },
             fallbacks=[CommandHandler("cancel", self.cancel)],
         )
         
+        # Ticket replies are relayed whatever state the conversation is in
+        application.add_handler(
+            MessageHandler(filters.REPLY & filters.TEXT & ~filters.COMMAND, self.handle_ticket_reply),
+            group=-1
+        )
+        application.add_handler(CommandHandler("reply", self.reply_command))
+        application.add_handler(CommandHandler("ticket", self.ticket_command))
+        application.add_handler(CommandHandler("language", self.language_command))
         application.add_handler(conv_handler)
         
         logger.info("Bot started successfully with ReplyKeyboard UI")
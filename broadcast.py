@@ -0,0 +1,261 @@
+"""
+Broadcast engine for sending admin announcements to every user.
+Streams recipients page by page, sends through a rate limiter and persists
+progress so an interrupted broadcast resumes where it stopped after a restart.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from telegram.error import Forbidden, RetryAfter, NetworkError, TelegramError
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Constants
+PROGRESS_INTERVAL = 5  # Seconds between live progress updates
+MAX_SEND_ATTEMPTS = 3
+RECIPIENT_READ_ATTEMPTS = 3  # Reads of a recipient page before the run gives up
+RECIPIENT_RETRY_DELAY = 1  # Seconds before the first retry; doubled after each
+
+
+class RateLimiter:
+    """Token bucket limiting how many messages are sent per second."""
+    
+    def __init__(self, rate: float, burst: int = None):
+        """Initialize limiter with a rate in messages per second."""
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+    
+    def pause(self, seconds: float):
+        """Stop handing out tokens for a while (e.g. after a flood wait)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    
+    async def acquire(self):
+        """Wait until a message may be sent."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BroadcastEngine:
+    """Runs resumable broadcast jobs stored in the database."""
+    
+    def __init__(self, db: Database, rate: float = 25, batch_size: int = 500,
+                 concurrency: int = 10):
+        """Initialize the engine."""
+        self.db = db
+        self.limiter = RateLimiter(rate)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._running: Dict[int, asyncio.Task] = {}
+    
+    def is_running(self, broadcast_id: int) -> bool:
+        """Check if a broadcast is being sent by this process."""
+        task = self._running.get(broadcast_id)
+        return task is not None and not task.done()
+    
+    async def start(self, bot, message: str, created_by: int, chat_id: int) -> Optional[int]:
+        """Create a broadcast job and start sending it in the background."""
+        broadcast_id = await self.db.create_broadcast(message, created_by)
+        if not broadcast_id:
+            return None
+        
+        broadcast = await self.db.get_broadcast(broadcast_id)
+        try:
+            progress = await bot.send_message(chat_id=chat_id, text=self.format_progress(broadcast))
+            await self.db.set_broadcast_progress_message(
+                broadcast_id, progress.chat_id, progress.message_id
+            )
+        except TelegramError as e:
+            logger.warning(f"Could not send progress message for broadcast {broadcast_id}: {e}")
+        
+        self.spawn(bot, broadcast_id)
+        return broadcast_id
+    
+    async def resume_pending(self, bot) -> List[int]:
+        """Resume broadcasts interrupted by a restart."""
+        resumed = []
+        for broadcast in await self.db.get_active_broadcasts():
+            if not self.is_running(broadcast['id']):
+                logger.info(f"Resuming broadcast {broadcast['id']} after user {broadcast['last_user_id']}")
+                self.spawn(bot, broadcast['id'])
+                resumed.append(broadcast['id'])
+        return resumed
+    
+    def spawn(self, bot, broadcast_id: int) -> asyncio.Task:
+        """Run a broadcast as a background task."""
+        task = asyncio.create_task(self.run(bot, broadcast_id))
+        self._running[broadcast_id] = task
+        task.add_done_callback(lambda t: self._on_done(broadcast_id, t))
+        return task
+    
+    def _on_done(self, broadcast_id: int, task: asyncio.Task):
+        """Forget a finished task; failed jobs stay 'running' and resume on restart."""
+        self._running.pop(broadcast_id, None)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Broadcast {broadcast_id} stopped: {task.exception()}")
+    
+    async def cancel(self, broadcast_id: int):
+        """Stop a broadcast; it will not be resumed."""
+        task = self._running.get(broadcast_id)
+        if task:
+            task.cancel()
+        await self.db.set_broadcast_status(broadcast_id, 'cancelled')
+    
+    async def run(self, bot, broadcast_id: int):
+        """Send a broadcast from its saved cursor until all recipients are done."""
+        broadcast = await self.db.get_broadcast(broadcast_id)
+        if not broadcast or broadcast['status'] not in ('pending', 'running'):
+            return
+        
+        await self.db.set_broadcast_status(broadcast_id, 'running')
+        
+        cursor = broadcast['last_user_id'] or 0
+        started = time.monotonic()
+        processed_this_run = 0
+        last_report = 0.0
+        
+        page = await self._recipients(cursor)
+        next_page = None
+        try:
+            while page:
+                # Prefetch the next page while this one is being sent
+                next_page = asyncio.create_task(self._recipients(page[-1]))
+                
+                sent, failed, blocked = await self._send_page(bot, broadcast['message'], page)
+                
+                cursor = page[-1]
+                await self.db.update_broadcast_progress(
+                    broadcast_id, cursor, sent=sent, failed=failed, blocked_user_ids=blocked
+                )
+                processed_this_run += len(page)
+                
+                now = time.monotonic()
+                if now - last_report >= PROGRESS_INTERVAL:
+                    last_report = now
+                    rate = processed_this_run / max(now - started, 1e-6)
+                    await self._report(bot, broadcast_id, rate)
+                
+                page = await next_page
+                next_page = None
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+        
+        if page is None:
+            # A failed read is not the end of the list: the job stays 'running'
+            # at its saved cursor and resumes on restart
+            logger.error(f"Broadcast {broadcast_id} interrupted after user {cursor}: "
+                         f"recipients could not be read")
+            return
+        
+        await self.db.set_broadcast_status(broadcast_id, 'completed')
+        rate = processed_this_run / max(time.monotonic() - started, 1e-6)
+        await self._report(bot, broadcast_id, rate)
+        logger.info(f"Broadcast {broadcast_id} completed")
+    
+    async def _recipients(self, after_user_id: int) -> Optional[List[int]]:
+        """Next page of recipients, retrying failed reads; None if they keep failing."""
+        for attempt in range(RECIPIENT_READ_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(RECIPIENT_RETRY_DELAY * 2 ** (attempt - 1))
+            page = await self.db.get_broadcast_recipients(after_user_id, self.batch_size)
+            if page is not None:
+                return page
+        return None
+    
+    async def _send_page(self, bot, message: str, user_ids: List[int]):
+        """Send one page of recipients; returns (sent, failed, blocked_ids)."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def send(user_id: int) -> str:
+            async with semaphore:
+                return await self._send_one(bot, message, user_id)
+        
+        results = await asyncio.gather(*(send(user_id) for user_id in user_ids))
+        
+        sent = results.count('sent')
+        failed = results.count('failed')
+        blocked = [user_id for user_id, result in zip(user_ids, results) if result == 'blocked']
+        return sent, failed, blocked
+    
+    async def _send_one(self, bot, message: str, user_id: int) -> str:
+        """Send a message to one user; returns 'sent', 'blocked' or 'failed'."""
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            await self.limiter.acquire()
+            try:
+                await bot.send_message(chat_id=user_id, text=message)
+                return 'sent'
+            except Forbidden:
+                # User blocked the bot or deleted their account
+                return 'blocked'
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"Flood limit hit while broadcasting, pausing {retry_after}s")
+                self.limiter.pause(retry_after)
+            except NetworkError as e:
+                logger.warning(f"Network error sending broadcast to {user_id} (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt)
+            except TelegramError as e:
+                logger.warning(f"Could not send broadcast to {user_id}: {e}")
+                return 'failed'
+        return 'failed'
+    
+    async def _report(self, bot, broadcast_id: int, rate: float):
+        """Update the live progress message."""
+        broadcast = await self.db.get_broadcast(broadcast_id)
+        if not broadcast or not broadcast['progress_message_id']:
+            return
+        try:
+            await bot.edit_message_text(
+                chat_id=broadcast['progress_chat_id'],
+                message_id=broadcast['progress_message_id'],
+                text=self.format_progress(broadcast, rate)
+            )
+        except TelegramError as e:
+            logger.debug(f"Could not update progress for broadcast {broadcast_id}: {e}")
+    
+    @staticmethod
+    def format_progress(broadcast: dict, rate: float = 0.0) -> str:
+        """Format broadcast progress with throughput and ETA."""
+        total = broadcast['total_recipients']
+        processed = broadcast['sent_count'] + broadcast['failed_count'] + broadcast['blocked_count']
+        percent = (processed / total * 100) if total else 100.0
+        
+        if broadcast['status'] == 'completed':
+            eta = "done"
+        elif rate > 0:
+            eta_seconds = int(max(total - processed, 0) / rate)
+            eta = f"{eta_seconds // 60}m {eta_seconds % 60}s"
+        else:
+            eta = "calculating..."
+        
+        return (
+            f"📢 Broadcast #{broadcast['id']} ({broadcast['status']})\n\n"
+            f"📊 Progress: {processed}/{total} ({percent:.1f}%)\n"
+            f"✅ Sent: {broadcast['sent_count']}\n"
+            f"🚫 Blocked: {broadcast['blocked_count']}\n"
+            f"❌ Failed: {broadcast['failed_count']}\n"
+            f"⚡ Speed: {rate:.1f} msg/s\n"
+            f"⏱️ ETA: {eta}"
+        )
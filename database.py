@@ -4,9 +4,15 @@ Handles all SQLite database operations including user management, referrals, and
 """
 
 import aiosqlite
+import asyncio
 import logging
+import random
+import re
+import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import Optional, Tuple, List
+from typing import Optional, Tuple, List, AsyncIterator
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +20,90 @@ logger = logging.getLogger(__name__)
 TICKET_STATUS_OPEN = 'open'
 TICKET_STATUS_CLOSED = 'closed'
 TICKET_STATUS_PENDING = 'pending'
+PAGE_SIZE = 500  # Rows fetched per round trip by the keyset iterators
+MAX_ROWID = 2 ** 63 - 1  # Cursor start for newest-first iteration
+WRITE_LOCK_TIMEOUT = 30.0  # Seconds ticket writes wait for SQLite's write lock (default 5)
+
+# Materialized statistics counters: name -> (table, watched column, predicate).
+# The predicate template is formatted with the row prefix ('NEW.', 'OLD.' or '').
+STATS_COUNTERS = {
+    'users_total': ('users', None, None),
+    'users_premium': ('users', 'is_premium', '{r}is_premium = 1'),
+    'users_banned': ('users', 'is_banned', '{r}is_banned = 1'),
+    'tickets_open': ('support_tickets', 'status', "{r}status != 'resolved'"),
+    'agents_total': ('agents', None, None),
+    'agents_online': ('agents', 'is_online', '{r}is_online = 1'),
+    'payments_pending': ('payment_proofs', 'status', "{r}status = 'pending'"),
+}
+REQUESTS_COUNTER_PREFIX = 'requests:'  # Followed by the usage date
+USAGE_RETENTION_DAYS = 90  # Days of per-user usage detail kept by default
+PRUNE_BATCH_SIZE = 1000  # Usage rows deleted per transaction when pruning
+SETTINGS_VERSION_KEY = 'settings_version'  # Bumped on every settings write
+# Tables whose writes bump a 'gen:<table>' counter, used to validate cached data
+GENERATION_TABLES = (
+    'users', 'usage', 'support_tickets', 'support_messages', 'support_attachments',
+    'agents', 'payment_proofs', 'bot_settings', 'faq'
+)
+GENERATION_PREFIX = 'gen:'
+# Statuses that end a ticket; an agent's load counts its other assigned tickets
+CLOSED_TICKET_STATUSES = ('resolved', TICKET_STATUS_CLOSED)
+# Values of support_tickets.escalated: the last SLA a ticket breached
+ESCALATION_FIRST_REPLY = 1
+ESCALATION_RESOLUTION = 2
+FAQ_SEARCH_LIMIT = 5  # Ranked FAQ entries returned by search_faqs
+FAQ_KEYWORD_WEIGHT = 10.0  # BM25 weight of FAQ keywords relative to answers
+# Words too common to tell FAQ entries apart; a message of only these matches nothing
+FAQ_STOPWORDS = frozenset(
+    'a an and are am be can could do does for from hello hey hi how i in is it me my '
+    'no not of on or please the to what when where why with you your'.split()
+)
+
+TICKET_ID_EPOCH_MS = 1704067200000  # 2024-01-01 UTC; ticket IDs count milliseconds from here
+TICKET_ID_LENGTH = 10  # Base-36 characters: 41 bits of milliseconds, 10 bits of sequence
+TICKET_ID_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+TICKET_ID_ATTEMPTS = 3
+
+
+class TicketIdGenerator:
+    """
+    Time-ordered ticket IDs, unique within a process by construction.
+    Each ID encodes the creation millisecond and a per-millisecond sequence
+    number; the sequence starts at a random offset so that IDs from other
+    processes rarely meet. IDs sort in creation order.
+    """
+    
+    SEQUENCE_BITS = 10
+    
+    def __init__(self):
+        """Initialize the generator."""
+        self._lock = threading.Lock()
+        self._millis = 0
+        self._sequence = 0
+    
+    def next_id(self) -> str:
+        """Return the next ticket ID."""
+        limit = 1 << self.SEQUENCE_BITS
+        with self._lock:
+            millis = max(int(time.time() * 1000) - TICKET_ID_EPOCH_MS, self._millis)
+            if millis > self._millis:
+                self._millis = millis
+                self._sequence = random.randrange(limit // 2)
+            else:
+                self._sequence += 1
+                if self._sequence >= limit:
+                    # Sequence exhausted: borrow the next millisecond
+                    self._millis += 1
+                    self._sequence = 0
+            value = (self._millis << self.SEQUENCE_BITS) | self._sequence
+        
+        chars = []
+        for _ in range(TICKET_ID_LENGTH):
+            value, digit = divmod(value, len(TICKET_ID_ALPHABET))
+            chars.append(TICKET_ID_ALPHABET[digit])
+        return ''.join(reversed(chars))
+
+
+ticket_ids = TicketIdGenerator()
 
 
 class Database:
@@ -38,10 +128,13 @@ class Database:
                     referred_by INTEGER,
                     referral_count INTEGER DEFAULT 0,
                     is_banned BOOLEAN DEFAULT 0,
+                    is_blocked BOOLEAN DEFAULT 0,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
+            # Databases created before broadcast support lack this column
+            await self._ensure_column(db, 'users', 'is_blocked', 'BOOLEAN DEFAULT 0')
             
             # Usage tracking table
             await db.execute('''
@@ -55,6 +148,24 @@ class Database:
                 )
             ''')
             
+            # Usage rollups: all-user totals per day and per-user totals per month
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS usage_daily_totals (
+                    date DATE PRIMARY KEY,
+                    total_requests INTEGER DEFAULT 0,
+                    active_users INTEGER DEFAULT 0
+                )
+            ''')
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS usage_monthly_totals (
+                    user_id INTEGER,
+                    month TEXT,
+                    total_requests INTEGER DEFAULT 0,
+                    active_days INTEGER DEFAULT 0,
+                    PRIMARY KEY (user_id, month)
+                )
+            ''')
+            
             # Referrals table
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS referrals (
@@ -105,10 +216,13 @@ class Database:
                     sla_first_reply INTEGER DEFAULT 3600,
                     sla_resolution INTEGER DEFAULT 86400,
                     escalated BOOLEAN DEFAULT 0,
+                    sla_due_at INTEGER,
                     FOREIGN KEY (user_id) REFERENCES users (user_id),
                     FOREIGN KEY (assigned_agent_id) REFERENCES agents (id)
                 )
             ''')
+            # Databases created before SLA tracking lack the next-deadline column
+            await self._ensure_column(db, 'support_tickets', 'sla_due_at', 'INTEGER')
             
             # Support messages table
             await db.execute('''
@@ -136,6 +250,16 @@ class Database:
                 )
             ''')
             
+            # Telegram messages that belong to a ticket thread, for reply relays
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS ticket_message_links (
+                    chat_id INTEGER NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    ticket_id TEXT NOT NULL,
+                    PRIMARY KEY (chat_id, message_id)
+                ) WITHOUT ROWID
+            ''')
+            
             # Agents table
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS agents (
@@ -173,6 +297,139 @@ class Database:
                 )
             ''')
             
+            # Broadcast jobs table
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    message TEXT,
+                    created_by INTEGER,
+                    status TEXT DEFAULT 'pending',
+                    last_user_id INTEGER DEFAULT 0,
+                    total_recipients INTEGER DEFAULT 0,
+                    sent_count INTEGER DEFAULT 0,
+                    failed_count INTEGER DEFAULT 0,
+                    blocked_count INTEGER DEFAULT 0,
+                    progress_chat_id INTEGER,
+                    progress_message_id INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            ''')
+            
+            # Materialized statistics counters
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS stats_counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER DEFAULT 0
+                )
+            ''')
+            for trigger_sql in self._stats_trigger_statements():
+                await db.execute(trigger_sql)
+            
+            async with db.execute('SELECT COUNT(*) FROM stats_counters') as cursor:
+                counters_missing = (await cursor.fetchone())[0] == 0
+            if counters_missing:
+                # Backfill once; the triggers keep the counters current afterwards
+                await self._rebuild_stats_counters(db)
+            await db.executemany(
+                'INSERT OR IGNORE INTO stats_counters (name, value) VALUES (?, 0)',
+                [(GENERATION_PREFIX + table,) for table in GENERATION_TABLES]
+            )
+            
+            # Agent loads (open assigned tickets), kept in step by triggers
+            async with db.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'load_support_tickets_update'"
+            ) as cursor:
+                agent_loads_missing = await cursor.fetchone() is None
+            for trigger_sql in self._agent_load_trigger_statements():
+                await db.execute(trigger_sql)
+            if agent_loads_missing:
+                # Older databases counted every ticket ever assigned
+                await self._reconcile_agent_loads(db, repair=True)
+            
+            # Next SLA deadline per ticket, kept in step by triggers
+            async with db.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'sla_support_tickets_update'"
+            ) as cursor:
+                sla_due_missing = await cursor.fetchone() is None
+            for trigger_sql in self._sla_trigger_statements():
+                await db.execute(trigger_sql)
+            if sla_due_missing:
+                await db.execute(f'UPDATE support_tickets SET sla_due_at = {self._sla_due_expression("")}')
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_tickets_sla_due ON support_tickets (sla_due_at) '
+                'WHERE sla_due_at IS NOT NULL'
+            )
+            
+            # Indexes backing keyset pagination
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at, user_id)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_tickets_user ON support_tickets (user_id, id)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_tickets_agent ON support_tickets (assigned_agent_id, id)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_messages_ticket ON support_messages (ticket_id, id)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_attachments_ticket ON support_attachments (ticket_id, id)'
+            )
+            
+            # Covering index for date-range request aggregates (admin charts)
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_usage_date ON usage (date, count)'
+            )
+            
+            # Indexes backing the admin user search filters and sorts
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_users_premium ON users (created_at, user_id) '
+                'WHERE is_premium = 1'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_users_banned ON users (created_at, user_id) '
+                'WHERE is_banned = 1'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_users_referrals ON users (referral_count, user_id)'
+            )
+            
+            # Full-text index over user names, kept in step by triggers
+            async with db.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'users_fts'"
+            ) as cursor:
+                users_fts_missing = await cursor.fetchone() is None
+            await db.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+                    first_name, username,
+                    content='users', content_rowid='user_id',
+                    prefix='1 2 3 4', detail='column'
+                )
+            ''')
+            for trigger_sql in self._fts_trigger_statements('users', 'user_id', ['first_name', 'username']):
+                await db.execute(trigger_sql)
+            if users_fts_missing:
+                await db.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+            
+            # Full-text index over FAQ keywords and answers for ranked search
+            async with db.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'faq_fts'"
+            ) as cursor:
+                faq_fts_missing = await cursor.fetchone() is None
+            await db.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS faq_fts USING fts5(
+                    keywords, answer,
+                    content='faq', content_rowid='id',
+                    tokenize='porter unicode61 remove_diacritics 2'
+                )
+            ''')
+            for trigger_sql in self._fts_trigger_statements('faq', 'id', ['keywords', 'answer']):
+                await db.execute(trigger_sql)
+            if faq_fts_missing:
+                await db.execute("INSERT INTO faq_fts (faq_fts) VALUES ('rebuild')")
+            
             # Initialize default settings
             await db.execute('''
                 INSERT OR IGNORE INTO bot_settings (key, value) VALUES
@@ -188,6 +445,217 @@ class Database:
             await db.commit()
             logger.info("Database initialized successfully")
     
+    @staticmethod
+    def _stats_trigger_statements() -> List[str]:
+        """Build the triggers that keep stats_counters in step with writes."""
+        def delta(predicate: str, row: str) -> str:
+            if predicate is None:
+                return '1'
+            return f'COALESCE({predicate.format(r=row)}, 0)'
+        
+        def counter_update(cases: List[Tuple[str, str]]) -> str:
+            names = ', '.join(f"'{name}'" for name, _ in cases)
+            whens = ' '.join(f"WHEN '{name}' THEN {expr}" for name, expr in cases)
+            return (
+                f"UPDATE stats_counters SET value = value + CASE name {whens} ELSE 0 END "
+                f"WHERE name IN ({names});"
+            )
+        
+        statements = []
+        tables = sorted({table for table, _, _ in STATS_COUNTERS.values()})
+        for table in tables:
+            counters = [
+                (name, column, predicate)
+                for name, (counter_table, column, predicate) in STATS_COUNTERS.items()
+                if counter_table == table
+            ]
+            watched = [(name, column, predicate) for name, column, predicate in counters if column]
+            
+            triggers = {
+                f'stats_{table}_insert': (
+                    f'AFTER INSERT ON {table}',
+                    [(name, delta(predicate, 'NEW.')) for name, _, predicate in counters]
+                ),
+                f'stats_{table}_delete': (
+                    f'AFTER DELETE ON {table}',
+                    [(name, f'-{delta(predicate, "OLD.")}') for name, _, predicate in counters]
+                ),
+            }
+            if watched:
+                columns = ', '.join(sorted({column for _, column, _ in watched}))
+                triggers[f'stats_{table}_update'] = (
+                    f'AFTER UPDATE OF {columns} ON {table}',
+                    [
+                        (name, f'{delta(predicate, "NEW.")} - {delta(predicate, "OLD.")}')
+                        for name, _, predicate in watched
+                    ]
+                )
+            
+            for trigger_name, (event, cases) in triggers.items():
+                statements.append(f'DROP TRIGGER IF EXISTS {trigger_name}')
+                statements.append(
+                    f'CREATE TRIGGER {trigger_name} {event} BEGIN {counter_update(cases)} END'
+                )
+        
+        # Daily request totals, one counter row per usage date. There is no
+        # delete trigger: pruning old usage rows must not shrink the totals.
+        # (INSERT OR IGNORE would inherit the outer upsert's conflict policy,
+        # hence the NOT EXISTS guard.)
+        statements.append('DROP TRIGGER IF EXISTS stats_usage_insert')
+        statements.append(f'''
+            CREATE TRIGGER stats_usage_insert AFTER INSERT ON usage BEGIN
+                INSERT INTO stats_counters (name, value)
+                SELECT '{REQUESTS_COUNTER_PREFIX}' || NEW.date, 0
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM stats_counters
+                    WHERE name = '{REQUESTS_COUNTER_PREFIX}' || NEW.date
+                );
+                UPDATE stats_counters SET value = value + NEW.count
+                WHERE name = '{REQUESTS_COUNTER_PREFIX}' || NEW.date;
+            END
+        ''')
+        statements.append('DROP TRIGGER IF EXISTS stats_usage_update')
+        statements.append(f'''
+            CREATE TRIGGER stats_usage_update AFTER UPDATE OF count, date ON usage BEGIN
+                UPDATE stats_counters SET value = value - OLD.count
+                WHERE name = '{REQUESTS_COUNTER_PREFIX}' || OLD.date;
+                INSERT INTO stats_counters (name, value)
+                SELECT '{REQUESTS_COUNTER_PREFIX}' || NEW.date, 0
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM stats_counters
+                    WHERE name = '{REQUESTS_COUNTER_PREFIX}' || NEW.date
+                );
+                UPDATE stats_counters SET value = value + NEW.count
+                WHERE name = '{REQUESTS_COUNTER_PREFIX}' || NEW.date;
+            END
+        ''')
+        
+        # Generation counters: any write to a table moves its generation on
+        for table in GENERATION_TABLES:
+            bump = f"UPDATE stats_counters SET value = value + 1 WHERE name = '{GENERATION_PREFIX}{table}';"
+            for event in ('insert', 'update', 'delete'):
+                statements.append(f'DROP TRIGGER IF EXISTS gen_{table}_{event}')
+                statements.append(
+                    f'CREATE TRIGGER gen_{table}_{event} AFTER {event.upper()} ON {table} '
+                    f'BEGIN {bump} END'
+                )
+        return statements
+    
+    @staticmethod
+    def _agent_load_trigger_statements() -> List[str]:
+        """Build the triggers that keep agents.assigned_tickets equal to their open tickets."""
+        closed = ', '.join(f"'{status}'" for status in CLOSED_TICKET_STATUSES)
+        
+        def change(row: str, sign: str) -> str:
+            return (
+                f"UPDATE agents SET assigned_tickets = assigned_tickets {sign} 1 "
+                f"WHERE id = {row}assigned_agent_id AND {row}status NOT IN ({closed});"
+            )
+        
+        triggers = {
+            'load_support_tickets_insert': ('AFTER INSERT ON support_tickets', change('NEW.', '+')),
+            'load_support_tickets_delete': ('AFTER DELETE ON support_tickets', change('OLD.', '-')),
+            'load_support_tickets_update': (
+                'AFTER UPDATE OF assigned_agent_id, status ON support_tickets '
+                'WHEN OLD.assigned_agent_id IS NOT NEW.assigned_agent_id '
+                f'OR (OLD.status NOT IN ({closed})) IS NOT (NEW.status NOT IN ({closed}))',
+                change('OLD.', '-') + ' ' + change('NEW.', '+')
+            ),
+        }
+        statements = []
+        for trigger_name, (event, body) in triggers.items():
+            statements.append(f'DROP TRIGGER IF EXISTS {trigger_name}')
+            statements.append(f'CREATE TRIGGER {trigger_name} {event} BEGIN {body} END')
+        return statements
+    
+    @staticmethod
+    def _sla_due_expression(row: str) -> str:
+        """SQL for a ticket's next unbreached SLA deadline (unix time), or NULL if none is pending."""
+        closed = ', '.join(f"'{status}'" for status in CLOSED_TICKET_STATUSES)
+        created = f"CAST(strftime('%s', {row}created_at) AS INTEGER)"
+        level = f'COALESCE({row}escalated, 0)'
+        return (
+            f'CASE WHEN {row}status IN ({closed}) THEN NULL '
+            f'WHEN {row}first_reply_at IS NULL AND {level} < {ESCALATION_FIRST_REPLY} '
+            f'THEN {created} + {row}sla_first_reply '
+            f'WHEN {level} < {ESCALATION_RESOLUTION} THEN {created} + {row}sla_resolution '
+            f'ELSE NULL END'
+        )
+    
+    @classmethod
+    def _sla_trigger_statements(cls) -> List[str]:
+        """Build the triggers that keep support_tickets.sla_due_at current."""
+        update = f"UPDATE support_tickets SET sla_due_at = {cls._sla_due_expression('NEW.')} WHERE id = NEW.id;"
+        triggers = {
+            'sla_support_tickets_insert': 'AFTER INSERT ON support_tickets',
+            'sla_support_tickets_update': (
+                'AFTER UPDATE OF created_at, status, first_reply_at, escalated, '
+                'sla_first_reply, sla_resolution ON support_tickets'
+            ),
+        }
+        statements = []
+        for trigger_name, event in triggers.items():
+            statements.append(f'DROP TRIGGER IF EXISTS {trigger_name}')
+            statements.append(f'CREATE TRIGGER {trigger_name} {event} BEGIN {update} END')
+        return statements
+    
+    @staticmethod
+    def _fts_trigger_statements(table: str, key: str, columns: List[str]) -> List[str]:
+        """Build the triggers that mirror `columns` of `table` into its <table>_fts index."""
+        fts = f'{table}_fts'
+        names = ', '.join(columns)
+        insert = (
+            f'INSERT INTO {fts} (rowid, {names}) '
+            f"VALUES (NEW.{key}, {', '.join('NEW.' + column for column in columns)});"
+        )
+        delete = (
+            f"INSERT INTO {fts} ({fts}, rowid, {names}) "
+            f"VALUES ('delete', OLD.{key}, {', '.join('OLD.' + column for column in columns)});"
+        )
+        return [
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN {insert} END',
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN {delete} END',
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {names} '
+            f'ON {table} BEGIN {delete} {insert} END',
+        ]
+    
+    @staticmethod
+    async def _compute_stats_counters(db, day: str) -> dict:
+        """Recompute all counters (and the request total for one day) from scratch."""
+        counters = {}
+        for name, (table, _, predicate) in STATS_COUNTERS.items():
+            where = f' WHERE {predicate.format(r="")}' if predicate else ''
+            async with db.execute(f'SELECT COUNT(*) FROM {table}{where}') as cursor:
+                counters[name] = (await cursor.fetchone())[0]
+        
+        async with db.execute(
+            'SELECT COALESCE(SUM(count), 0) FROM usage WHERE date = ?', (day,)
+        ) as cursor:
+            counters[REQUESTS_COUNTER_PREFIX + day] = (await cursor.fetchone())[0]
+        return counters
+    
+    async def _rebuild_stats_counters(self, db):
+        """Reset every counter, including per-day request totals, from the base tables."""
+        counters = await self._compute_stats_counters(db, str(datetime.now().date()))
+        # Generations are left alone so they never move backwards
+        await db.execute(
+            'DELETE FROM stats_counters WHERE name NOT LIKE ?', (GENERATION_PREFIX + '%',)
+        )
+        await db.executemany(
+            'INSERT INTO stats_counters (name, value) VALUES (?, ?)', counters.items()
+        )
+        await db.execute(f'''
+            INSERT OR REPLACE INTO stats_counters (name, value)
+            SELECT '{REQUESTS_COUNTER_PREFIX}' || date, SUM(count) FROM usage GROUP BY date
+        ''')
+    
+    async def _ensure_column(self, db, table: str, column: str, definition: str):
+        """Add a column to an existing table if it is missing."""
+        async with db.execute(f'PRAGMA table_info({table})') as cursor:
+            columns = [row[1] for row in await cursor.fetchall()]
+        if column not in columns:
+            await db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    
     async def add_user(self, user_id: int, username: str = None, 
                       first_name: str = None, language_code: str = None,
                       referred_by: int = None) -> bool:
@@ -200,9 +668,10 @@ class Database:
                     VALUES (?, ?, ?, ?, ?)
                 ''', (user_id, username, first_name, language_code, referred_by))
                 
-                # Update last_active for existing users
+                # Update last_active for existing users; a returning user
+                # has unblocked the bot, so they receive broadcasts again
                 await db.execute('''
-                    UPDATE users SET last_active = CURRENT_TIMESTAMP
+                    UPDATE users SET last_active = CURRENT_TIMESTAMP, is_blocked = 0
                     WHERE user_id = ?
                 ''', (user_id,))
                 
@@ -246,6 +715,32 @@ class Database:
             logger.error(f"Error getting user {user_id}: {e}")
             return None
     
+    async def get_user_language(self, user_id: int) -> Optional[str]:
+        """Get a user's stored language code."""
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                async with db.execute(
+                    'SELECT language_code FROM users WHERE user_id = ?', (user_id,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+                    return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Error getting language for user {user_id}: {e}")
+            return None
+    
+    async def set_user_language(self, user_id: int, language: str) -> bool:
+        """Store a user's language preference; False if the user is unknown."""
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                cursor = await db.execute(
+                    'UPDATE users SET language_code = ? WHERE user_id = ?', (language, user_id)
+                )
+                await db.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Error setting language for user {user_id}: {e}")
+            return False
+    
     async def is_premium(self, user_id: int) -> bool:
         """Check if user is premium."""
         user = await self.get_user(user_id)
@@ -330,8 +825,42 @@ class Database:
         except Exception as e:
             logger.error(f"Error updating payment status for {user_id}: {e}")
     
+    async def _fetch_page(self, query: str, params: tuple) -> List[dict]:
+        """Run a paginated query and return its rows as dicts."""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+    
+    async def _iter_keyset(self, query: str, params: tuple, key: str,
+                           cursor, batch_size: int) -> AsyncIterator[dict]:
+        """
+        Iterate a query page by page using keyset pagination.
+        The query must end with placeholders for the cursor and the limit.
+        """
+        while True:
+            rows = await self._fetch_page(query, params + (cursor, batch_size))
+            for row in rows:
+                yield row
+            if len(rows) < batch_size:
+                return
+            cursor = rows[-1][key]
+    
+    async def iter_users(self, include_banned: bool = False,
+                         batch_size: int = PAGE_SIZE) -> AsyncIterator[dict]:
+        """Iterate over users in user_id order without loading them all."""
+        banned_filter = '' if include_banned else 'AND is_banned = 0'
+        async for user in self._iter_keyset(f'''
+            SELECT * FROM users
+            WHERE user_id > ? {banned_filter}
+            ORDER BY user_id ASC
+            LIMIT ?
+        ''', (), 'user_id', 0, batch_size):
+            yield user
+    
     async def get_all_users(self) -> List[dict]:
-        """Get all users for broadcasting."""
+        """Get all users for broadcasting. Prefer iter_users for large tables."""
         try:
             async with aiosqlite.connect(self.db_path) as db:
                 db.row_factory = aiosqlite.Row
@@ -343,7 +872,7 @@ class Database:
             return []
     
     async def get_daily_usage(self, user_id: int) -> int:
-        """Get user's usage count for today."""
+        """Get user's usage count for today (always in the detail tier)."""
         try:
             today = datetime.now().date()
             async with aiosqlite.connect(self.db_path) as db:
@@ -372,6 +901,94 @@ class Database:
         except Exception as e:
             logger.error(f"Error incrementing usage for {user_id}: {e}")
     
+    async def get_monthly_usage(self, user_id: int, month: str = None) -> int:
+        """
+        Get a user's total requests for a month ('YYYY-MM', default current).
+        Combines rolled-up totals with detail rows not rolled up yet.
+        """
+        month = month or datetime.now().strftime('%Y-%m')
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                async with db.execute('''
+                    SELECT
+                        COALESCE((SELECT total_requests FROM usage_monthly_totals
+                                  WHERE user_id = ? AND month = ?), 0)
+                        + COALESCE((SELECT SUM(count) FROM usage
+                                    WHERE user_id = ? AND date >= ? AND date < ?
+                                    AND date > (SELECT COALESCE(MAX(date), '')
+                                                FROM usage_daily_totals)), 0)
+                ''', (user_id, month, user_id, f'{month}-01', f'{month}-32')) as cursor:
+                    return (await cursor.fetchone())[0]
+        except Exception as e:
+            logger.error(f"Error getting monthly usage for {user_id}: {e}")
+            return 0
+    
+    async def rollup_usage(self, retention_days: int = USAGE_RETENTION_DAYS,
+                           batch_size: int = PRUNE_BATCH_SIZE) -> dict:
+        """
+        Aggregate finished days into the rollup tables, then prune usage
+        detail older than the retention window in small batches.
+        Returns counts of rolled-up days and pruned rows.
+        """
+        today = str(datetime.now().date())
+        cutoff = str(datetime.now().date() - timedelta(days=max(retention_days, 1)))
+        result = {'days_rolled_up': 0, 'rows_pruned': 0}
+        
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                # Roll up every finished day after the watermark in one transaction
+                await db.execute('BEGIN IMMEDIATE')
+                async with db.execute(
+                    "SELECT COALESCE(MAX(date), '') FROM usage_daily_totals"
+                ) as cursor:
+                    watermark = (await cursor.fetchone())[0]
+                
+                cursor = await db.execute('''
+                    INSERT INTO usage_daily_totals (date, total_requests, active_users)
+                    SELECT date, SUM(count), COUNT(*) FROM usage
+                    WHERE date > ? AND date < ?
+                    GROUP BY date
+                ''', (watermark, today))
+                result['days_rolled_up'] = cursor.rowcount
+                
+                await db.execute('''
+                    INSERT INTO usage_monthly_totals (user_id, month, total_requests, active_days)
+                    SELECT user_id, substr(date, 1, 7), SUM(count), COUNT(*) FROM usage
+                    WHERE date > ? AND date < ?
+                    GROUP BY user_id, substr(date, 1, 7)
+                    ON CONFLICT (user_id, month) DO UPDATE SET
+                        total_requests = total_requests + excluded.total_requests,
+                        active_days = active_days + excluded.active_days
+                ''', (watermark, today))
+                
+                # Per-day request counters are only needed until the day is rolled up
+                await db.execute(
+                    'DELETE FROM stats_counters WHERE name >= ? AND name < ?',
+                    (REQUESTS_COUNTER_PREFIX, f'{REQUESTS_COUNTER_PREFIX}{cutoff}')
+                )
+                await db.commit()
+                
+                # Only rolled-up days may be pruned; batches keep write locks short
+                while True:
+                    cursor = await db.execute('''
+                        DELETE FROM usage WHERE id IN (
+                            SELECT id FROM usage WHERE date < ? LIMIT ?
+                        )
+                    ''', (cutoff, batch_size))
+                    await db.commit()
+                    result['rows_pruned'] += cursor.rowcount
+                    if cursor.rowcount < batch_size:
+                        break
+                    await asyncio.sleep(0)
+            
+            logger.info(
+                f"Usage rollup: {result['days_rolled_up']} days rolled up, "
+                f"{result['rows_pruned']} detail rows pruned"
+            )
+        except Exception as e:
+            logger.error(f"Error rolling up usage: {e}")
+        return result
+    
     async def check_flood_control(self, user_id: int, threshold: int, 
                                   window_seconds: int) -> Tuple[bool, int]:
         """
@@ -438,76 +1055,212 @@ class Database:
         """Generate referral link for a user."""
         return f"https://t.me/{bot_username}?start=ref_{user_id}"
     
+    async def get_stats_counters(self) -> dict:
+        """Read the fixed counters and today's request total in one query."""
+        today_key = REQUESTS_COUNTER_PREFIX + str(datetime.now().date())
+        names = list(STATS_COUNTERS) + [today_key]
+        counters = dict.fromkeys(names, 0)
+        
+        async with aiosqlite.connect(self.db_path) as db:
+            placeholders = ', '.join('?' for _ in names)
+            async with db.execute(
+                f'SELECT name, value FROM stats_counters WHERE name IN ({placeholders})', names
+            ) as cursor:
+                for name, value in await cursor.fetchall():
+                    counters[name] = value
+        
+        counters['requests_today'] = counters.pop(today_key)
+        return counters
+    
     async def get_stats(self) -> dict:
         """Get overall bot statistics."""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                # Total users
-                async with db.execute('SELECT COUNT(*) FROM users') as cursor:
-                    total_users = (await cursor.fetchone())[0]
-                
-                # Premium users
-                async with db.execute(
-                    'SELECT COUNT(*) FROM users WHERE is_premium = 1'
-                ) as cursor:
-                    premium_users = (await cursor.fetchone())[0]
-                
-                # Total requests today
-                today = datetime.now().date()
-                async with db.execute(
-                    'SELECT SUM(count) FROM usage WHERE date = ?', (today,)
-                ) as cursor:
-                    row = await cursor.fetchone()
-                    today_requests = row[0] if row[0] else 0
-                
-                return {
-                    'total_users': total_users,
-                    'premium_users': premium_users,
-                    'today_requests': today_requests
-                }
+            counters = await self.get_stats_counters()
+            return {
+                'total_users': counters['users_total'],
+                'premium_users': counters['users_premium'],
+                'banned_users': counters['users_banned'],
+                'today_requests': counters['requests_today'],
+                'open_tickets': counters['tickets_open'],
+                'online_agents': counters['agents_online'],
+            }
         except Exception as e:
             logger.error(f"Error getting stats: {e}")
             return {
                 'total_users': 0,
                 'premium_users': 0,
-                'today_requests': 0
+                'banned_users': 0,
+                'today_requests': 0,
+                'open_tickets': 0,
+                'online_agents': 0,
             }
     
-    # Support Ticket Methods
-    async def create_ticket(self, user_id: int, subject: str) -> str:
-        """Create a new support ticket with unique ID."""
-        import random
-        import string
+    @staticmethod
+    async def _reconcile_agent_loads(db, repair: bool) -> dict:
+        """Compare agents.assigned_tickets with a count of open assigned tickets."""
+        closed = ', '.join('?' for _ in CLOSED_TICKET_STATUSES)
+        async with db.execute(f'''
+            SELECT a.id, a.assigned_tickets, COUNT(t.id) FROM agents a
+            LEFT JOIN support_tickets t
+                ON t.assigned_agent_id = a.id AND t.status NOT IN ({closed})
+            GROUP BY a.id
+        ''', CLOSED_TICKET_STATUSES) as cursor:
+            drift = {
+                agent_id: (stored, actual)
+                for agent_id, stored, actual in await cursor.fetchall()
+                if stored != actual
+            }
         
-        # Generate unique ticket ID with retry logic
-        max_attempts = 10
-        for attempt in range(max_attempts):
-            ticket_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+        if drift and repair:
+            await db.executemany(
+                'UPDATE agents SET assigned_tickets = ? WHERE id = ?',
+                [(actual, agent_id) for agent_id, (_, actual) in drift.items()]
+            )
+        return drift
+    
+    async def reconcile_agent_loads(self, repair: bool = True) -> dict:
+        """
+        Recompute agent loads from support_tickets and report drift.
+        Returns {agent_id: (stored, actual)} for every agent whose load
+        disagrees; with repair=True the stored loads are corrected.
+        """
+        drift = {}
+        try:
+            async with aiosqlite.connect(self.db_path, timeout=WRITE_LOCK_TIMEOUT) as db:
+                # Hold the write lock so no ticket changes between count and repair
+                await db.execute('BEGIN IMMEDIATE')
+                drift = await self._reconcile_agent_loads(db, repair)
+                await db.commit()
             
-            try:
-                async with aiosqlite.connect(self.db_path) as db:
-                    # Check if ticket ID already exists
-                    async with db.execute(
-                        'SELECT ticket_id FROM support_tickets WHERE ticket_id = ?',
-                        (ticket_id,)
-                    ) as cursor:
-                        existing = await cursor.fetchone()
-                    
-                    if not existing:
-                        # ID is unique, create ticket
+            for agent_id, (stored, actual) in drift.items():
+                logger.warning(
+                    f"Agent {agent_id} load drifted: stored {stored}, actual {actual}"
+                    f"{' (repaired)' if repair else ''}"
+                )
+        except Exception as e:
+            logger.error(f"Error reconciling agent loads: {e}")
+        return drift
+    
+    async def check_stats_counters(self, repair: bool = False) -> dict:
+        """
+        Recompute the statistics counters from scratch and report drift.
+        Returns {name: (stored, actual)} for every counter that disagrees;
+        with repair=True the stored values are corrected.
+        """
+        drift = {}
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                # Hold the write lock so no trigger fires between the two reads
+                await db.execute('BEGIN IMMEDIATE')
+                actual = await self._compute_stats_counters(db, str(datetime.now().date()))
+                
+                placeholders = ', '.join('?' for _ in actual)
+                async with db.execute(
+                    f'SELECT name, value FROM stats_counters WHERE name IN ({placeholders})',
+                    list(actual)
+                ) as cursor:
+                    stored = dict(await cursor.fetchall())
+                
+                for name, value in actual.items():
+                    if stored.get(name, 0) != value:
+                        drift[name] = (stored.get(name, 0), value)
+                
+                if drift and repair:
+                    await db.executemany(
+                        'INSERT OR REPLACE INTO stats_counters (name, value) VALUES (?, ?)',
+                        [(name, value) for name, (_, value) in drift.items()]
+                    )
+                await db.commit()
+            
+            for name, (stored_value, actual_value) in drift.items():
+                logger.warning(
+                    f"Stats counter '{name}' drifted: stored {stored_value}, actual {actual_value}"
+                    f"{' (repaired)' if repair else ''}"
+                )
+        except Exception as e:
+            logger.error(f"Error checking stats counters: {e}")
+        return drift
+    
+    # Support Ticket Methods
+    # Online agents, preferred agent (a parameter, may be NULL) first, then least busy
+    _ROUTING_AGENT_QUERY = '''
+        SELECT * FROM agents
+        WHERE is_online = 1
+        ORDER BY id IS ? DESC, assigned_tickets ASC, id ASC
+        LIMIT 1
+    '''
+    
+    async def create_ticket(self, user_id: int, subject: str) -> Optional[str]:
+        """Create a new support ticket with a unique, time-ordered ID in a single INSERT."""
+        try:
+            async with aiosqlite.connect(self.db_path, timeout=WRITE_LOCK_TIMEOUT) as db:
+                # IDs are unique within this process; the UNIQUE constraint settles
+                # the rare clash with another process
+                for _ in range(TICKET_ID_ATTEMPTS):
+                    ticket_id = ticket_ids.next_id()
+                    try:
                         await db.execute('''
                             INSERT INTO support_tickets (ticket_id, user_id, subject)
                             VALUES (?, ?, ?)
                         ''', (ticket_id, user_id, subject))
-                        await db.commit()
-                        return ticket_id
-            except Exception as e:
-                logger.error(f"Error creating ticket (attempt {attempt + 1}): {e}")
-        
-        # If all attempts failed, return None
-        logger.error(f"Failed to create unique ticket ID after {max_attempts} attempts")
+                    except sqlite3.IntegrityError:
+                        continue
+                    await db.commit()
+                    return ticket_id
+            logger.error(f"Failed to create unique ticket ID after {TICKET_ID_ATTEMPTS} attempts")
+        except Exception as e:
+            logger.error(f"Error creating ticket for user {user_id}: {e}")
         return None
     
+    async def open_ticket(self, user_id: int, subject: str, message: str,
+                          agent_id: Optional[int] = None) -> Tuple[Optional[dict], Optional[dict]]:
+        """
+        Create a ticket with its first message and assign it, in one transaction.
+        The preferred agent is used while online, otherwise the least busy one.
+        Returns (ticket, agent); agent is None if nobody is online, and both are
+        None if the ticket could not be created.
+        """
+        try:
+            async with aiosqlite.connect(self.db_path, timeout=WRITE_LOCK_TIMEOUT) as db:
+                db.row_factory = aiosqlite.Row
+                await db.execute('BEGIN IMMEDIATE')
+                async with db.execute(self._ROUTING_AGENT_QUERY, (agent_id,)) as cursor:
+                    agent = await cursor.fetchone()
+                
+                # The agent load and SLA triggers see the assignment on insert
+                for _ in range(TICKET_ID_ATTEMPTS):
+                    ticket_id = ticket_ids.next_id()
+                    try:
+                        await db.execute('''
+                            INSERT INTO support_tickets (ticket_id, user_id, subject, assigned_agent_id)
+                            VALUES (?, ?, ?, ?)
+                        ''', (ticket_id, user_id, subject, agent['id'] if agent else None))
+                        break
+                    except sqlite3.IntegrityError:
+                        continue
+                else:
+                    await db.rollback()
+                    logger.error(f"Failed to create unique ticket ID after {TICKET_ID_ATTEMPTS} attempts")
+                    return None, None
+                
+                await db.execute('''
+                    INSERT INTO support_messages (ticket_id, sender_id, message)
+                    VALUES (?, ?, ?)
+                ''', (ticket_id, user_id, message))
+                
+                async with db.execute(
+                    'SELECT * FROM support_tickets WHERE ticket_id = ?', (ticket_id,)
+                ) as cursor:
+                    ticket = dict(await cursor.fetchone())
+                if agent:
+                    async with db.execute('SELECT * FROM agents WHERE id = ?', (agent['id'],)) as cursor:
+                        agent = dict(await cursor.fetchone())
+                await db.commit()
+                return ticket, agent
+        except Exception as e:
+            logger.error(f"Error opening ticket for user {user_id}: {e}")
+            return None, None
+    
     async def get_ticket(self, ticket_id: str) -> Optional[dict]:
         """Get ticket information."""
         try:
@@ -524,36 +1277,88 @@ class Database:
             logger.error(f"Error getting ticket {ticket_id}: {e}")
             return None
     
-    async def add_ticket_message(self, ticket_id: str, sender_id: int, message: str):
-        """Add a message to a ticket."""
+    async def add_ticket_message(self, ticket_id: str, sender_id: int, message: str,
+                                 is_staff: Optional[bool] = None) -> Optional[dict]:
+        """
+        Add a message to a ticket. The first message from staff sets first_reply_at;
+        is_staff says whether the sender is staff (admins are not in the agents
+        table), and None checks the agents table. Returns the ticket with its
+        agent's user_id as agent_user_id (for relaying the message), or None if
+        the ticket does not exist or the message could not be stored.
+        """
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with aiosqlite.connect(self.db_path, timeout=WRITE_LOCK_TIMEOUT) as db:
+                db.row_factory = aiosqlite.Row
+                async with db.execute('''
+                    SELECT t.*, a.user_id AS agent_user_id,
+                           EXISTS (SELECT 1 FROM agents WHERE user_id = ?) AS sender_is_agent
+                    FROM support_tickets t
+                    LEFT JOIN agents a ON a.id = t.assigned_agent_id
+                    WHERE t.ticket_id = ?
+                ''', (sender_id, ticket_id)) as cursor:
+                    row = await cursor.fetchone()
+                if row is None:
+                    return None
+                ticket = dict(row)
+                
                 await db.execute('''
                     INSERT INTO support_messages (ticket_id, sender_id, message)
                     VALUES (?, ?, ?)
                 ''', (ticket_id, sender_id, message))
                 
-                # Update first_reply_at if this is the first agent reply
-                ticket = await self.get_ticket(ticket_id)
-                if ticket and not ticket.get('first_reply_at'):
-                    # Check if sender is an agent
-                    is_agent = await self.is_agent(sender_id)
-                    if is_agent:
-                        await db.execute('''
-                            UPDATE support_tickets 
-                            SET first_reply_at = CURRENT_TIMESTAMP
-                            WHERE ticket_id = ?
-                        ''', (ticket_id,))
+                # The first message from staff is the first reply; the row
+                # read above decides, so later messages need no extra write
+                sender_is_agent = ticket.pop('sender_is_agent')
+                if is_staff is None:
+                    is_staff = bool(sender_is_agent)
+                if is_staff and ticket['first_reply_at'] is None:
+                    async with db.execute('''
+                        UPDATE support_tickets
+                        SET first_reply_at = CURRENT_TIMESTAMP
+                        WHERE ticket_id = ? AND first_reply_at IS NULL
+                        RETURNING first_reply_at
+                    ''', (ticket_id,)) as cursor:
+                        row = await cursor.fetchone()
+                    if row:
+                        ticket['first_reply_at'] = row[0]
                 
                 await db.commit()
+                return ticket
         except Exception as e:
             logger.error(f"Error adding message to ticket {ticket_id}: {e}")
+            return None
+    
+    async def link_ticket_message(self, chat_id: int, message_id: int, ticket_id: str):
+        """Remember that a Telegram message belongs to a ticket, so replies to it reach the ticket."""
+        try:
+            async with aiosqlite.connect(self.db_path, timeout=WRITE_LOCK_TIMEOUT) as db:
+                await db.execute('''
+                    INSERT OR REPLACE INTO ticket_message_links (chat_id, message_id, ticket_id)
+                    VALUES (?, ?, ?)
+                ''', (chat_id, message_id, ticket_id))
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Error linking message {message_id} to ticket {ticket_id}: {e}")
+    
+    async def get_linked_ticket(self, chat_id: int, message_id: int) -> Optional[str]:
+        """Ticket id a Telegram message belongs to, or None."""
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                async with db.execute('''
+                    SELECT ticket_id FROM ticket_message_links
+                    WHERE chat_id = ? AND message_id = ?
+                ''', (chat_id, message_id)) as cursor:
+                    row = await cursor.fetchone()
+                    return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Error getting ticket for message {message_id}: {e}")
+            return None
     
     async def add_ticket_attachment(self, ticket_id: str, file_id: str, 
                                    file_unique_id: str, file_type: str, file_name: str = None):
         """Add an attachment to a ticket."""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with aiosqlite.connect(self.db_path, timeout=WRITE_LOCK_TIMEOUT) as db:
                 await db.execute('''
                     INSERT INTO support_attachments 
                     (ticket_id, file_id, file_unique_id, file_type, file_name)
@@ -563,34 +1368,39 @@ class Database:
         except Exception as e:
             logger.error(f"Error adding attachment to ticket {ticket_id}: {e}")
     
-    async def get_ticket_messages(self, ticket_id: str) -> List[dict]:
-        """Get all messages for a ticket."""
+    # A ticket's messages and attachments are paged in creation (id) order
+    _TICKET_MESSAGES_QUERY = '''
+        SELECT * FROM support_messages
+        WHERE ticket_id = ? AND id > ?
+        ORDER BY id ASC
+        LIMIT ?
+    '''
+    
+    _TICKET_ATTACHMENTS_QUERY = '''
+        SELECT * FROM support_attachments
+        WHERE ticket_id = ? AND id > ?
+        ORDER BY id ASC
+        LIMIT ?
+    '''
+    
+    async def get_ticket_messages(self, ticket_id: str, limit: int = -1,
+                                  after_id: int = 0) -> List[dict]:
+        """Get a ticket's messages, oldest first, sent after after_id."""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                async with db.execute('''
-                    SELECT * FROM support_messages 
-                    WHERE ticket_id = ?
-                    ORDER BY created_at ASC
-                ''', (ticket_id,)) as cursor:
-                    rows = await cursor.fetchall()
-                    return [dict(row) for row in rows]
+            return await self._fetch_page(
+                self._TICKET_MESSAGES_QUERY, (ticket_id, after_id, limit)
+            )
         except Exception as e:
             logger.error(f"Error getting messages for ticket {ticket_id}: {e}")
             return []
     
-    async def get_ticket_attachments(self, ticket_id: str) -> List[dict]:
-        """Get all attachments for a ticket."""
+    async def get_ticket_attachments(self, ticket_id: str, limit: int = -1,
+                                     after_id: int = 0) -> List[dict]:
+        """Get a ticket's attachments, oldest first, added after after_id."""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                async with db.execute('''
-                    SELECT * FROM support_attachments 
-                    WHERE ticket_id = ?
-                    ORDER BY created_at ASC
-                ''', (ticket_id,)) as cursor:
-                    rows = await cursor.fetchall()
-                    return [dict(row) for row in rows]
+            return await self._fetch_page(
+                self._TICKET_ATTACHMENTS_QUERY, (ticket_id, after_id, limit)
+            )
         except Exception as e:
             logger.error(f"Error getting attachments for ticket {ticket_id}: {e}")
             return []
@@ -598,7 +1408,7 @@ class Database:
     async def update_ticket_status(self, ticket_id: str, status: str):
         """Update ticket status."""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with aiosqlite.connect(self.db_path, timeout=WRITE_LOCK_TIMEOUT) as db:
                 if status == 'resolved':
                     await db.execute('''
                         UPDATE support_tickets 
@@ -615,59 +1425,140 @@ class Database:
         except Exception as e:
             logger.error(f"Error updating ticket status {ticket_id}: {e}")
     
-    async def assign_ticket(self, ticket_id: str, agent_id: int):
-        """Assign a ticket to an agent."""
+    async def assign_ticket(self, ticket_id: str, agent_id: Optional[int]):
+        """Assign or reassign a ticket to an agent (None unassigns it); agent loads follow."""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with aiosqlite.connect(self.db_path, timeout=WRITE_LOCK_TIMEOUT) as db:
                 await db.execute('''
-                    UPDATE support_tickets 
+                    UPDATE support_tickets
                     SET assigned_agent_id = ?
                     WHERE ticket_id = ?
                 ''', (agent_id, ticket_id))
-                
-                # Update agent assigned_tickets count
-                await db.execute('''
-                    UPDATE agents 
-                    SET assigned_tickets = assigned_tickets + 1
-                    WHERE id = ?
-                ''', (agent_id,))
-                
                 await db.commit()
         except Exception as e:
             logger.error(f"Error assigning ticket {ticket_id} to agent {agent_id}: {e}")
     
-    async def get_user_tickets(self, user_id: int) -> List[dict]:
-        """Get all tickets for a user."""
+    async def get_sla_deadlines(self, until: int) -> List[tuple]:
+        """Get (ticket_id, sla_due_at) of tickets with an SLA deadline at or before `until`."""
         try:
             async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
                 async with db.execute('''
-                    SELECT * FROM support_tickets 
-                    WHERE user_id = ?
-                    ORDER BY created_at DESC
-                ''', (user_id,)) as cursor:
-                    rows = await cursor.fetchall()
-                    return [dict(row) for row in rows]
+                    SELECT ticket_id, sla_due_at FROM support_tickets
+                    WHERE sla_due_at IS NOT NULL AND sla_due_at <= ?
+                    ORDER BY sla_due_at
+                ''', (until,)) as cursor:
+                    return await cursor.fetchall()
         except Exception as e:
-            logger.error(f"Error getting tickets for user {user_id}: {e}")
+            logger.error(f"Error getting SLA deadlines: {e}")
             return []
     
-    async def get_open_tickets(self) -> List[dict]:
-        """Get all open tickets."""
+    async def escalate_ticket(self, ticket_id: str, now: int) -> Optional[dict]:
+        """
+        Record an SLA breach if the ticket's next deadline has passed.
+        Sets escalated to the breached SLA (first reply or resolution), which
+        moves sla_due_at on to the next deadline. Returns the ticket with its
+        agent's user_id as agent_user_id, or None if nothing was breached.
+        """
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with aiosqlite.connect(self.db_path, timeout=WRITE_LOCK_TIMEOUT) as db:
                 db.row_factory = aiosqlite.Row
+                await db.execute('BEGIN IMMEDIATE')
                 async with db.execute('''
-                    SELECT * FROM support_tickets 
-                    WHERE status != 'resolved'
-                    ORDER BY created_at ASC
-                ''', ()) as cursor:
-                    rows = await cursor.fetchall()
-                    return [dict(row) for row in rows]
+                    SELECT t.*, a.user_id AS agent_user_id FROM support_tickets t
+                    LEFT JOIN agents a ON a.id = t.assigned_agent_id
+                    WHERE t.ticket_id = ? AND t.sla_due_at <= ?
+                ''', (ticket_id, now)) as cursor:
+                    row = await cursor.fetchone()
+                if row is None:
+                    await db.rollback()
+                    return None
+                
+                ticket = dict(row)
+                if ticket['first_reply_at'] is None and (ticket['escalated'] or 0) < ESCALATION_FIRST_REPLY:
+                    ticket['escalated'] = ESCALATION_FIRST_REPLY
+                else:
+                    ticket['escalated'] = ESCALATION_RESOLUTION
+                await db.execute(
+                    'UPDATE support_tickets SET escalated = ? WHERE ticket_id = ?',
+                    (ticket['escalated'], ticket_id)
+                )
+                await db.commit()
+                return ticket
+        except Exception as e:
+            logger.error(f"Error escalating ticket {ticket_id}: {e}")
+            return None
+    
+    # Ticket list queries are ordered by id, which follows creation order,
+    # so the id doubles as the keyset cursor.
+    _USER_TICKETS_QUERY = '''
+        SELECT * FROM support_tickets
+        WHERE user_id = ? AND id < ?
+        ORDER BY id DESC
+        LIMIT ?
+    '''
+    
+    _OPEN_TICKETS_QUERY = '''
+        SELECT * FROM support_tickets
+        WHERE status != 'resolved' AND id > ?
+        ORDER BY id ASC
+        LIMIT ?
+    '''
+    
+    _AGENT_TICKETS_QUERY = '''
+        SELECT * FROM support_tickets
+        WHERE assigned_agent_id = (SELECT id FROM agents WHERE user_id = ?)
+        AND id < ?
+        ORDER BY id DESC
+        LIMIT ?
+    '''
+    
+    async def get_user_tickets(self, user_id: int, limit: int = -1,
+                               before_id: int = MAX_ROWID) -> List[dict]:
+        """Get a user's tickets, newest first, older than before_id."""
+        try:
+            return await self._fetch_page(
+                self._USER_TICKETS_QUERY, (user_id, before_id, limit)
+            )
+        except Exception as e:
+            logger.error(f"Error getting tickets for user {user_id}: {e}")
+            return []
+    
+    async def iter_user_tickets(self, user_id: int,
+                                batch_size: int = PAGE_SIZE) -> AsyncIterator[dict]:
+        """Iterate over a user's tickets, newest first."""
+        async for ticket in self._iter_keyset(
+            self._USER_TICKETS_QUERY, (user_id,), 'id', MAX_ROWID, batch_size
+        ):
+            yield ticket
+    
+    async def get_open_tickets(self, limit: int = -1, after_id: int = 0) -> List[dict]:
+        """Get open tickets, oldest first, created after after_id."""
+        try:
+            return await self._fetch_page(self._OPEN_TICKETS_QUERY, (after_id, limit))
         except Exception as e:
             logger.error(f"Error getting open tickets: {e}")
             return []
     
+    async def iter_open_tickets(self, batch_size: int = PAGE_SIZE) -> AsyncIterator[dict]:
+        """Iterate over open tickets, oldest first."""
+        async for ticket in self._iter_keyset(
+            self._OPEN_TICKETS_QUERY, (), 'id', 0, batch_size
+        ):
+            yield ticket
+    
+    async def count_open_tickets(self) -> int:
+        """Count open tickets."""
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                async with db.execute(
+                    "SELECT value FROM stats_counters WHERE name = 'tickets_open'"
+                ) as cursor:
+                    row = await cursor.fetchone()
+                    return row[0] if row else 0
+        except Exception as e:
+            logger.error(f"Error counting open tickets: {e}")
+            return 0
+    
     # Agent Methods
     async def add_agent(self, user_id: int, role: str = 'support') -> bool:
         """Add a new agent."""
@@ -731,6 +1622,60 @@ class Database:
             logger.error(f"Error getting least busy agent: {e}")
             return None
     
+    async def get_online_agents(self) -> List[dict]:
+        """Get online agents, least busy first."""
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                db.row_factory = aiosqlite.Row
+                async with db.execute('''
+                    SELECT * FROM agents
+                    WHERE is_online = 1
+                    ORDER BY assigned_tickets ASC, id ASC
+                ''') as cursor:
+                    rows = await cursor.fetchall()
+                    return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Error getting online agents: {e}")
+            return []
+    
+    async def assign_ticket_to_agent(self, ticket_id: str,
+                                     agent_id: Optional[int] = None) -> Optional[dict]:
+        """
+        Assign an unassigned ticket to an online agent in one transaction.
+        The preferred agent is used while online, otherwise the least busy one;
+        picking the agent and raising its load under the write lock means
+        concurrent assignments never see the same load. Returns the updated
+        agent, or None if no agent is online or the ticket is missing or
+        already assigned.
+        """
+        try:
+            async with aiosqlite.connect(self.db_path, timeout=WRITE_LOCK_TIMEOUT) as db:
+                db.row_factory = aiosqlite.Row
+                await db.execute('BEGIN IMMEDIATE')
+                async with db.execute(self._ROUTING_AGENT_QUERY, (agent_id,)) as cursor:
+                    row = await cursor.fetchone()
+                if row is None:
+                    await db.rollback()
+                    return None
+                
+                # The agent load triggers count the ticket
+                cursor = await db.execute('''
+                    UPDATE support_tickets
+                    SET assigned_agent_id = ?
+                    WHERE ticket_id = ? AND assigned_agent_id IS NULL
+                ''', (row['id'], ticket_id))
+                if cursor.rowcount == 0:
+                    await db.rollback()
+                    return None
+                
+                async with db.execute('SELECT * FROM agents WHERE id = ?', (row['id'],)) as cursor:
+                    agent = await cursor.fetchone()
+                await db.commit()
+                return dict(agent)
+        except Exception as e:
+            logger.error(f"Error assigning ticket {ticket_id}: {e}")
+            return None
+    
     async def set_agent_online(self, user_id: int, is_online: bool):
         """Set agent online/offline status."""
         try:
@@ -756,33 +1701,25 @@ class Database:
             logger.error(f"Error getting all agents: {e}")
             return []
     
-    async def get_agent_tickets(self, user_id: int) -> List[dict]:
-        """Get tickets assigned to a specific agent."""
+    async def get_agent_tickets(self, user_id: int, limit: int = -1,
+                                before_id: int = MAX_ROWID) -> List[dict]:
+        """Get tickets assigned to an agent (by user ID), newest first."""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                # First get the agent's id from user_id
-                async with db.execute(
-                    'SELECT id FROM agents WHERE user_id = ?', (user_id,)
-                ) as cursor:
-                    agent = await cursor.fetchone()
-                    if not agent:
-                        return []
-                    
-                    agent_id = agent['id']
-                
-                # Get tickets assigned to this agent
-                async with db.execute('''
-                    SELECT * FROM support_tickets 
-                    WHERE assigned_agent_id = ?
-                    ORDER BY created_at DESC
-                ''', (agent_id,)) as cursor:
-                    rows = await cursor.fetchall()
-                    return [dict(row) for row in rows]
+            return await self._fetch_page(
+                self._AGENT_TICKETS_QUERY, (user_id, before_id, limit)
+            )
         except Exception as e:
             logger.error(f"Error getting agent tickets for user {user_id}: {e}")
             return []
     
+    async def iter_agent_tickets(self, user_id: int,
+                                 batch_size: int = PAGE_SIZE) -> AsyncIterator[dict]:
+        """Iterate over tickets assigned to an agent, newest first."""
+        async for ticket in self._iter_keyset(
+            self._AGENT_TICKETS_QUERY, (user_id,), 'id', MAX_ROWID, batch_size
+        ):
+            yield ticket
+    
     async def get_agent_stats(self, user_id: int) -> Optional[dict]:
         """Get statistics for a specific agent."""
         try:
@@ -814,6 +1751,7 @@ class Database:
                 
                 return {
                     'assigned_tickets': assigned['count'] if assigned else 0,
+                    'open_tickets': agent['assigned_tickets'],
                     'resolved_tickets': resolved['count'] if resolved else 0,
                     'is_online': bool(agent['is_online'])
                 }
@@ -822,27 +1760,46 @@ class Database:
             return None
     
     # FAQ Methods
-    async def search_faq(self, keywords: str, language: str = 'en') -> Optional[dict]:
-        """Search FAQ by keywords."""
+    @staticmethod
+    def faq_match_query(text: str) -> Optional[str]:
+        """FTS5 query matching any meaningful word of a message, or None if there is none."""
+        terms = dict.fromkeys(
+            term for term in re.findall(r'\w+', text.lower()) if term not in FAQ_STOPWORDS
+        )
+        if not terms:
+            return None
+        return ' OR '.join(f'"{term}"' for term in terms)
+    
+    async def search_faqs(self, text: str, language: str = 'en',
+                          limit: int = FAQ_SEARCH_LIMIT) -> List[dict]:
+        """Active FAQ entries in a language matching a message, best BM25 rank first."""
+        query = self.faq_match_query(text)
+        if not query:
+            return []
+        
         try:
             async with aiosqlite.connect(self.db_path) as db:
                 db.row_factory = aiosqlite.Row
-                # Simple keyword matching
-                keywords_lower = keywords.lower()
-                async with db.execute('''
-                    SELECT * FROM faq 
-                    WHERE is_active = 1 
-                    AND language = ?
-                    AND LOWER(keywords) LIKE ?
-                    LIMIT 1
-                ''', (language, f'%{keywords_lower}%')) as cursor:
-                    row = await cursor.fetchone()
-                    if row:
-                        return dict(row)
-            return None
+                async with db.execute(f'''
+                    SELECT faq.*, bm25(faq_fts, {FAQ_KEYWORD_WEIGHT}, 1.0) AS rank
+                    FROM faq_fts JOIN faq ON faq.id = faq_fts.rowid
+                    WHERE faq_fts MATCH ? AND faq.language = ? AND faq.is_active = 1
+                    ORDER BY rank
+                    LIMIT ?
+                ''', (query, language, limit)) as cursor:
+                    return [dict(row) for row in await cursor.fetchall()]
         except Exception as e:
             logger.error(f"Error searching FAQ: {e}")
-            return None
+            return []
+    
+    async def search_faq(self, keywords: str, language: str = 'en') -> Optional[dict]:
+        """Best FAQ answer for a message, falling back to English entries."""
+        language = (language or 'en').split('-')[0].lower()
+        for candidate in dict.fromkeys((language, 'en')):
+            results = await self.search_faqs(keywords, candidate, limit=1)
+            if results:
+                return results[0]
+        return None
     
     async def add_faq(self, keywords: str, answer: str, language: str = 'en'):
         """Add a new FAQ entry."""
@@ -856,6 +1813,22 @@ class Database:
         except Exception as e:
             logger.error(f"Error adding FAQ: {e}")
     
+    async def get_active_faqs(self) -> List[dict]:
+        """Get all active FAQ entries; errors raise, so a failed read is not an empty table."""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute('SELECT * FROM faq WHERE is_active = 1 ORDER BY id') as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+    
+    async def get_generation(self, table: str) -> int:
+        """Get a table's generation counter; it changes whenever the table is written."""
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(
+                'SELECT value FROM stats_counters WHERE name = ?', (GENERATION_PREFIX + table,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
+    
     # Settings Methods
     async def get_setting(self, key: str) -> Optional[str]:
         """Get a bot setting."""
@@ -870,14 +1843,182 @@ class Database:
             logger.error(f"Error getting setting {key}: {e}")
             return None
     
+    async def get_settings(self) -> dict:
+        """Get all bot settings as one consistent snapshot."""
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                async with db.execute('SELECT key, value FROM bot_settings') as cursor:
+                    return dict(await cursor.fetchall())
+        except Exception as e:
+            logger.error(f"Error getting settings: {e}")
+            return {}
+    
+    async def get_settings_version(self) -> int:
+        """Get the settings version; it changes whenever any setting is written."""
+        return int(await self.get_setting(SETTINGS_VERSION_KEY) or 0)
+    
     async def set_setting(self, key: str, value: str):
         """Set a bot setting."""
+        await self.update_settings({key: value})
+    
+    async def update_settings(self, settings: dict) -> Optional[int]:
+        """Set several bot settings atomically; returns the new settings version."""
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                version = await self.write_settings(db, settings)
+                await db.commit()
+                return version
+        except Exception as e:
+            logger.error(f"Error updating settings {list(settings)}: {e}")
+            return None
+    
+    @staticmethod
+    async def write_settings(db, settings: dict) -> int:
+        """
+        Upsert settings and bump the settings version on an open connection.
+        The caller commits, so readers see either none or all of the new values.
+        """
+        if SETTINGS_VERSION_KEY in settings:
+            raise ValueError(f"{SETTINGS_VERSION_KEY} is maintained automatically")
+        
+        await db.executemany('''
+            INSERT INTO bot_settings (key, value, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+        ''', [(key, str(value)) for key, value in settings.items()])
+        async with db.execute('''
+            INSERT INTO bot_settings (key, value) VALUES (?, '1')
+            ON CONFLICT(key) DO UPDATE SET
+                value = CAST(value AS INTEGER) + 1, updated_at = CURRENT_TIMESTAMP
+            RETURNING value
+        ''', (SETTINGS_VERSION_KEY,)) as cursor:
+            return int((await cursor.fetchone())[0])
+    
+    # Broadcast Methods
+    async def create_broadcast(self, message: str, created_by: int) -> Optional[int]:
+        """Create a broadcast job covering all current recipients."""
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                async with db.execute(
+                    'SELECT COUNT(*) FROM users WHERE is_banned = 0 AND is_blocked = 0'
+                ) as cursor:
+                    total = (await cursor.fetchone())[0]
+                
+                cursor = await db.execute('''
+                    INSERT INTO broadcasts (message, created_by, total_recipients)
+                    VALUES (?, ?, ?)
+                ''', (message, created_by, total))
+                await db.commit()
+                return cursor.lastrowid
+        except Exception as e:
+            logger.error(f"Error creating broadcast: {e}")
+            return None
+    
+    async def get_broadcast(self, broadcast_id: int) -> Optional[dict]:
+        """Get a broadcast job."""
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                db.row_factory = aiosqlite.Row
+                async with db.execute(
+                    'SELECT * FROM broadcasts WHERE id = ?', (broadcast_id,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+                    if row:
+                        return dict(row)
+            return None
+        except Exception as e:
+            logger.error(f"Error getting broadcast {broadcast_id}: {e}")
+            return None
+    
+    async def get_active_broadcasts(self) -> List[dict]:
+        """Get broadcast jobs that have not finished yet."""
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                db.row_factory = aiosqlite.Row
+                async with db.execute('''
+                    SELECT * FROM broadcasts
+                    WHERE status IN ('pending', 'running')
+                    ORDER BY id ASC
+                ''') as cursor:
+                    rows = await cursor.fetchall()
+                    return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Error getting active broadcasts: {e}")
+            return []
+    
+    async def get_broadcast_recipients(self, after_user_id: int = 0,
+                                       limit: int = 500) -> Optional[List[int]]:
+        """
+        Get the next page of broadcast recipients after a user ID.
+        Returns an empty list at the end and None if the page could not be read.
+        """
         try:
             async with aiosqlite.connect(self.db_path) as db:
+                async with db.execute('''
+                    SELECT user_id FROM users
+                    WHERE user_id > ? AND is_banned = 0 AND is_blocked = 0
+                    ORDER BY user_id ASC
+                    LIMIT ?
+                ''', (after_user_id, limit)) as cursor:
+                    rows = await cursor.fetchall()
+                    return [row[0] for row in rows]
+        except Exception as e:
+            logger.error(f"Error getting broadcast recipients after {after_user_id}: {e}")
+            return None
+    
+    async def update_broadcast_progress(self, broadcast_id: int, last_user_id: int,
+                                        sent: int = 0, failed: int = 0,
+                                        blocked_user_ids: List[int] = None):
+        """Record a finished page of a broadcast and mark blocked users."""
+        blocked_user_ids = blocked_user_ids or []
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                await db.executemany(
+                    'UPDATE users SET is_blocked = 1 WHERE user_id = ?',
+                    [(user_id,) for user_id in blocked_user_ids]
+                )
                 await db.execute('''
-                    INSERT OR REPLACE INTO bot_settings (key, value, updated_at)
-                    VALUES (?, ?, CURRENT_TIMESTAMP)
-                ''', (key, value))
+                    UPDATE broadcasts
+                    SET status = 'running',
+                        last_user_id = ?,
+                        sent_count = sent_count + ?,
+                        failed_count = failed_count + ?,
+                        blocked_count = blocked_count + ?
+                    WHERE id = ?
+                ''', (last_user_id, sent, failed, len(blocked_user_ids), broadcast_id))
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Error updating broadcast {broadcast_id} progress: {e}")
+    
+    async def set_broadcast_progress_message(self, broadcast_id: int,
+                                             chat_id: int, message_id: int):
+        """Remember which message shows live progress for a broadcast."""
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                await db.execute('''
+                    UPDATE broadcasts
+                    SET progress_chat_id = ?, progress_message_id = ?
+                    WHERE id = ?
+                ''', (chat_id, message_id, broadcast_id))
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Error setting broadcast {broadcast_id} progress message: {e}")
+    
+    async def set_broadcast_status(self, broadcast_id: int, status: str):
+        """Update broadcast status."""
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                if status in ('completed', 'cancelled'):
+                    await db.execute('''
+                        UPDATE broadcasts
+                        SET status = ?, finished_at = CURRENT_TIMESTAMP
+                        WHERE id = ?
+                    ''', (status, broadcast_id))
+                else:
+                    await db.execute(
+                        'UPDATE broadcasts SET status = ? WHERE id = ?',
+                        (status, broadcast_id)
+                    )
                 await db.commit()
         except Exception as e:
-            logger.error(f"Error setting {key}: {e}")
+            logger.error(f"Error setting broadcast {broadcast_id} status: {e}")
@@ -0,0 +1,118 @@
+"""
+Streaming data exports for the admin panel.
+Reads rows in keyset-ordered batches and yields CSV or NDJSON chunks, so an
+export of any size runs in constant memory and can resume after the last key.
+"""
+
+import csv
+import io
+import json
+import sqlite3
+import zlib
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+# Export name -> (table, keyset column, key type)
+EXPORTS = {
+    'users': ('users', 'user_id', int),
+    'usage': ('usage', 'id', int),
+    'usage_daily': ('usage_daily_totals', 'date', str),
+    'tickets': ('support_tickets', 'id', int),
+}
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+EXPORT_BATCH_SIZE = 1000  # Rows read per query; locks are released between batches
+
+
+class ExportError(ValueError):
+    """Raised for an unknown export, format or resume key."""
+
+
+def parse_export(name: str, fmt: str, after: Optional[str] = None):
+    """Validate export arguments; returns (table, key column, typed after key)."""
+    if name not in EXPORTS:
+        raise ExportError(f"Unknown export: {name}")
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError(f"Unknown format: {fmt}")
+    
+    table, key, key_type = EXPORTS[name]
+    if after:
+        try:
+            after = key_type(after)
+        except ValueError:
+            raise ExportError(f"Invalid resume key: {after}")
+    return table, key, after or None
+
+
+def iter_batches(db_path: str, table: str, key: str, after=None,
+                 batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[tuple]:
+    """
+    Yield (columns, rows) batches in key order after a resume key.
+    Each batch is its own short query, so a long export never holds a read
+    lock that would block the bot's writes.
+    """
+    # Async callers advance the generator from executor threads, one at a time
+    # as_uri() percent-encodes '?', '#' and '%' that would otherwise end the path
+    uri = Path(db_path).resolve().as_uri() + '?mode=ro'
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    try:
+        while True:
+            if after is None:
+                cursor = conn.execute(
+                    f'SELECT * FROM {table} ORDER BY {key} LIMIT ?', (batch_size,)
+                )
+            else:
+                cursor = conn.execute(
+                    f'SELECT * FROM {table} WHERE {key} > ? ORDER BY {key} LIMIT ?',
+                    (after, batch_size)
+                )
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            yield columns, rows
+            after = rows[-1][columns.index(key)]
+    finally:
+        conn.close()
+
+
+def _format_batch(fmt: str, columns: List[str], rows: list, header: bool) -> str:
+    """Format one batch of rows as CSV or NDJSON text."""
+    if fmt == 'ndjson':
+        return ''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in rows)
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def export_chunks(db_path: str, name: str, fmt: str = 'csv', after: Optional[str] = None,
+                  compress: bool = False, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    Stream an export as encoded chunks, gzip-compressed if requested.
+    CSV output starts with a header row unless the export is resumed.
+    """
+    table, key, after = parse_export(name, fmt, after)
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31: gzip container
+    
+    header = after is None
+    for columns, rows in iter_batches(db_path, table, key, after, batch_size):
+        chunk = _format_batch(fmt, columns, rows, header).encode()
+        header = False
+        if compressor:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    
+    if compressor:
+        yield compressor.flush()
+
+
+def export_filename(name: str, fmt: str, compress: bool = False) -> str:
+    """Download file name for an export."""
+    return f"{name}.{fmt}{'.gz' if compress else ''}"
@@ -0,0 +1,263 @@
+"""
+In-memory FAQ matcher for auto-replies.
+Keeps the active FAQ entries in an inverted index (token -> entries, per
+language) scored with BM25, so matching a message takes microseconds. The index
+is rebuilt when the FAQ table's generation changes; SQL full-text search is
+only consulted when the index could not be built.
+"""
+
+import logging
+import math
+import re
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+from database import Database, FAQ_KEYWORD_WEIGHT, FAQ_SEARCH_LIMIT, FAQ_STOPWORDS
+
+logger = logging.getLogger(__name__)
+
+FAQ_CHECK_INTERVAL = 10  # Seconds between FAQ generation checks
+BM25_K1 = 1.2
+BM25_B = 0.75
+TOKEN_CACHE_SIZE = 100000  # Distinct words whose normalized form is remembered
+
+
+# Porter stemmer rules as SQLite's porter tokenizer applies them: the first
+# suffix that matches decides, and is replaced only if the stem qualifies
+PORTER_STEP2 = (
+    ('ational', 'ate'), ('tional', 'tion'), ('enci', 'ence'), ('anci', 'ance'),
+    ('izer', 'ize'), ('logi', 'log'), ('bli', 'ble'), ('alli', 'al'), ('entli', 'ent'),
+    ('eli', 'e'), ('ousli', 'ous'), ('ization', 'ize'), ('ation', 'ate'), ('ator', 'ate'),
+    ('alism', 'al'), ('iveness', 'ive'), ('fulness', 'ful'), ('ousness', 'ous'),
+    ('aliti', 'al'), ('iviti', 'ive'), ('biliti', 'ble'),
+)
+PORTER_STEP3 = (
+    ('icate', 'ic'), ('ative', ''), ('alize', 'al'), ('iciti', 'ic'), ('ical', 'ic'),
+    ('ful', ''), ('ness', ''),
+)
+PORTER_STEP4 = (
+    'al', 'ance', 'ence', 'er', 'ic', 'able', 'ible', 'ant', 'ement', 'ment', 'ent',
+    'ion', 'ou', 'ism', 'ate', 'iti', 'ous', 'ive', 'ize',
+)
+PORTER_MAX_TOKEN = 64  # Longer tokens, like shorter than 3 characters, are not stemmed
+
+
+def _is_consonant(word: str, i: int) -> bool:
+    """Porter's consonant: not a vowel, and 'y' only after a vowel or at the start."""
+    if word[i] in 'aeiou':
+        return False
+    if word[i] == 'y':
+        return i == 0 or not _is_consonant(word, i - 1)
+    return True
+
+
+def _measure(stem: str) -> int:
+    """Number of vowel-consonant sequences in a stem (Porter's m)."""
+    pattern = ''.join('c' if _is_consonant(stem, i) else 'v' for i in range(len(stem)))
+    return re.sub(r'(.)\1+', r'\1', pattern).count('vc')
+
+
+def _has_vowel(stem: str) -> bool:
+    """Whether a stem contains a vowel."""
+    return any(not _is_consonant(stem, i) for i in range(len(stem)))
+
+
+def _ends_cvc(stem: str) -> bool:
+    """Whether a stem ends consonant-vowel-consonant, the last not w, x or y."""
+    return (
+        len(stem) >= 3 and stem[-1] not in 'wxy' and _is_consonant(stem, len(stem) - 1)
+        and not _is_consonant(stem, len(stem) - 2) and _is_consonant(stem, len(stem) - 3)
+    )
+
+
+def _ends_double_consonant(word: str) -> bool:
+    """Whether a word ends in a doubled consonant."""
+    return len(word) >= 2 and word[-1] == word[-2] and _is_consonant(word, len(word) - 1)
+
+
+def _replace_suffix(word: str, rules, min_measure: int) -> str:
+    """Apply the first matching rule if the remaining stem measures above min_measure."""
+    for suffix, replacement in rules:
+        if word.endswith(suffix) and len(word) > len(suffix):
+            stem = word[:-len(suffix)]
+            return stem + replacement if _measure(stem) > min_measure else word
+    return word
+
+
+def porter_stem(word: str) -> str:
+    """Stem a lowercase ASCII word with the Porter algorithm, as FTS5's porter tokenizer does."""
+    if len(word) < 3 or len(word) > PORTER_MAX_TOKEN:
+        return word
+    
+    # Step 1a: plurals
+    if (word.endswith('sses') and len(word) > 4) or (word.endswith('ies') and len(word) > 3):
+        word = word[:-2]
+    elif word.endswith('s') and not word.endswith('ss'):
+        word = word[:-1]
+    
+    # Step 1b: past tenses and gerunds
+    removed = False
+    if word.endswith('eed') and len(word) > 3:
+        if _measure(word[:-3]) > 0:
+            word = word[:-1]
+    elif word.endswith('ed') and _has_vowel(word[:-2]):
+        word, removed = word[:-2], True
+    elif word.endswith('ing') and _has_vowel(word[:-3]):
+        word, removed = word[:-3], True
+    if removed:
+        if word.endswith(('at', 'bl', 'iz')):
+            word += 'e'
+        elif _ends_double_consonant(word) and word[-1] not in 'lsz':
+            word = word[:-1]
+        elif _measure(word) == 1 and _ends_cvc(word):
+            word += 'e'
+    
+    # Step 1c: terminal y
+    if word.endswith('y') and _has_vowel(word[:-1]):
+        word = word[:-1] + 'i'
+    
+    # Steps 2 and 3: double and single suffixes
+    word = _replace_suffix(word, PORTER_STEP2, 0)
+    word = _replace_suffix(word, PORTER_STEP3, 0)
+    
+    # Step 4: remaining suffixes of longer stems
+    for suffix in sorted(PORTER_STEP4, key=len, reverse=True):
+        if word.endswith(suffix) and len(word) > len(suffix):
+            stem = word[:-len(suffix)]
+            if _measure(stem) > 1 and (suffix != 'ion' or stem[-1] in 'st'):
+                word = stem
+            break
+    
+    # Step 5: final e and double l
+    if word.endswith('e'):
+        stem = word[:-1]
+        if _measure(stem) > 1 or (_measure(stem) == 1 and not _ends_cvc(stem)):
+            word = stem
+    if word.endswith('ll') and _measure(word) > 1:
+        word = word[:-1]
+    return word
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def normalize_token(token: str) -> str:
+    """Fold Latin diacritics and Porter-stem the word, matching the FTS index's tokenizer."""
+    folded = ''.join(c for c in unicodedata.normalize('NFKD', token) if not unicodedata.combining(c))
+    if not folded.isascii():
+        return token  # Other scripts are matched as written
+    return porter_stem(folded)
+
+
+def tokenize(text: str) -> List[str]:
+    """Normalized words of a text, without stopwords; underscores separate words, as in FTS5."""
+    return [
+        normalize_token(word) for word in re.findall(r'[^\W_]+', text.lower())
+        if word not in FAQ_STOPWORDS
+    ]
+
+
+class FaqIndex:
+    """Inverted index over FAQ keywords and answers, one per language."""
+    
+    def __init__(self, entries: Iterable[dict]):
+        """Build the index from FAQ rows."""
+        self._entries: Dict[int, dict] = {}
+        self._postings: Dict[str, Dict[str, Dict[int, float]]] = defaultdict(lambda: defaultdict(dict))
+        self._lengths: Dict[int, int] = {}
+        totals = Counter()
+        
+        for entry in entries:
+            language = entry['language']
+            keywords = tokenize(entry['keywords'] or '')
+            answer = tokenize(entry['answer'] or '')
+            
+            # Term frequency weighted by column, as FTS5's bm25() does
+            frequencies = Counter()
+            for token in keywords:
+                frequencies[token] += FAQ_KEYWORD_WEIGHT
+            for token in answer:
+                frequencies[token] += 1.0
+            for token, frequency in frequencies.items():
+                self._postings[language][token][entry['id']] = frequency
+            
+            self._entries[entry['id']] = entry
+            self._lengths[entry['id']] = len(keywords) + len(answer)
+            totals[language] += len(keywords) + len(answer)
+        
+        self._counts = Counter(entry['language'] for entry in self._entries.values())
+        self._average_lengths = {
+            language: totals[language] / count for language, count in self._counts.items()
+        }
+    
+    def __len__(self):
+        """Number of indexed entries."""
+        return len(self._entries)
+    
+    def search(self, text: str, language: str = 'en', limit: int = FAQ_SEARCH_LIMIT) -> List[dict]:
+        """Entries in a language matching a message, best BM25 score first."""
+        postings = self._postings.get(language)
+        if not postings:
+            return []
+        
+        count = self._counts[language]
+        average_length = self._average_lengths[language] or 1
+        scores = defaultdict(float)
+        for token in dict.fromkeys(tokenize(text)):
+            matches = postings.get(token)
+            if not matches:
+                continue
+            idf = max(math.log((count - len(matches) + 0.5) / (len(matches) + 0.5)), 1e-6)
+            for entry_id, frequency in matches.items():
+                length_norm = 1 - BM25_B + BM25_B * self._lengths[entry_id] / average_length
+                scores[entry_id] += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+        
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [dict(self._entries[entry_id], rank=-score) for entry_id, score in best]
+
+
+class FaqMatcher:
+    """Answers messages from an in-memory FaqIndex kept in step with the FAQ table."""
+    
+    def __init__(self, db: Database, check_interval: float = FAQ_CHECK_INTERVAL):
+        """Initialize the matcher; the index is built on first use."""
+        self.db = db
+        self.check_interval = check_interval
+        self.index: Optional[FaqIndex] = None
+        self._generation = None
+        self._checked = 0.0
+    
+    async def refresh(self, force: bool = False):
+        """
+        Rebuild the index if the FAQ table changed since it was built. Read errors
+        raise and leave the previous index and generation in place.
+        """
+        now = time.monotonic()
+        if not force and self.index is not None and now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        
+        generation = await self.db.get_generation('faq')
+        if self.index is None or generation != self._generation:
+            self.index = FaqIndex(await self.db.get_active_faqs())
+            self._generation = generation
+            logger.info(f"FAQ index rebuilt: {len(self.index)} entries")
+    
+    async def match(self, text: str, language: str = 'en') -> Optional[dict]:
+        """Best FAQ answer for a message, falling back to English entries."""
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Error refreshing FAQ index: {e}")
+        
+        if self.index is None:
+            # Never built (the FAQ table could not be read); SQL search may still work
+            return await self.db.search_faq(text, language)
+        
+        language = (language or 'en').split('-')[0].lower()
+        for candidate in dict.fromkeys((language, 'en')):
+            results = self.index.search(text, candidate, limit=1)
+            if results:
+                return results[0]
+        return None
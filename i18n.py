@@ -1,14 +1,19 @@
 """
 Internationalization module with auto-language detection.
 Provides multi-language support for the bot.
+Language preferences are stored in users.language_code; the most recently
+used ones are kept in a bounded LRU cache.
 """
 
 import logging
+from collections import OrderedDict
 from typing import Dict, Optional
 from langdetect import detect, LangDetectException
 
 logger = logging.getLogger(__name__)
 
+USER_LANGUAGE_CACHE_SIZE = 10000  # Users whose language is kept in memory
+
 
 class I18n:
     """Handles internationalization and auto-language detection."""
@@ -383,10 +388,35 @@ class I18n:
         'hi': 'हिंदी 🇮🇳',
     }
     
-    def __init__(self, default_language: str = 'en'):
-        """Initialize i18n with default language."""
+    def __init__(self, default_language: str = 'en', db=None,
+                 cache_size: int = USER_LANGUAGE_CACHE_SIZE):
+        """
+        Initialize i18n with default language.
+        
+        Args:
+            default_language: Language used when nothing else applies
+            db: Optional Database storing user language preferences
+            cache_size: Maximum users whose language is kept in memory
+        """
         self.default_language = default_language
-        self.user_languages = {}
+        self.db = db
+        self.cache_size = cache_size
+        # LRU of user ID -> stored language code (None when nothing is stored)
+        self.user_languages = OrderedDict()
+    
+    def _remember(self, user_id: int, language: Optional[str]):
+        """Cache a user's stored language, evicting the least recently used users."""
+        self.user_languages[user_id] = language
+        self.user_languages.move_to_end(user_id)
+        while len(self.user_languages) > self.cache_size:
+            self.user_languages.popitem(last=False)
+    
+    def supported_language(self, language_code: Optional[str]) -> Optional[str]:
+        """Supported language for a code such as 'es' or 'pt-BR', or None."""
+        if not language_code:
+            return None
+        language = language_code.split('-')[0].lower()
+        return language if language in self.TRANSLATIONS else None
     
     def detect_language(self, text: str) -> str:
         """
@@ -410,17 +440,26 @@ class I18n:
             logger.warning(f"Could not detect language from: {text}")
             return self.default_language
     
-    def set_user_language(self, user_id: int, language: str):
-        """Set language preference for a user."""
-        if language in self.TRANSLATIONS:
-            self.user_languages[user_id] = language
-            logger.info(f"Set language for user {user_id}: {language}")
-        else:
+    async def set_user_language(self, user_id: int, language: str) -> bool:
+        """
+        Set and store language preference for a user, normalizing codes such as
+        'es-ES'; returns whether it was saved.
+        """
+        supported = self.supported_language(language)
+        if supported is None:
             logger.warning(f"Unsupported language: {language}")
+            return False
+        language = supported
+        if self.db is not None and not await self.db.set_user_language(user_id, language):
+            return False
+        
+        self._remember(user_id, language)
+        logger.info(f"Set language for user {user_id}: {language}")
+        return True
     
-    def get_user_language(self, user_id: int, language_code: str = None) -> str:
+    async def load_user_language(self, user_id: int, language_code: str = None) -> str:
         """
-        Get user's preferred language.
+        Get user's preferred language, reading the stored preference on a cache miss.
         
         Args:
             user_id: User ID
@@ -429,14 +468,31 @@ class I18n:
         Returns:
             Language code
         """
-        # Priority: user setting > stored preference > Telegram language > default
-        if user_id in self.user_languages:
-            return self.user_languages[user_id]
+        if user_id not in self.user_languages and self.db is not None:
+            self._remember(user_id, await self.db.get_user_language(user_id))
+        return self.get_user_language(user_id, language_code)
+    
+    def get_user_language(self, user_id: int, language_code: str = None) -> str:
+        """
+        Get user's preferred language from the cache, without a database read.
         
-        if language_code and language_code in self.TRANSLATIONS:
-            return language_code
+        Args:
+            user_id: User ID
+            language_code: Optional language code from Telegram
+            
+        Returns:
+            Language code
+        """
+        # Priority: stored preference > Telegram language > default
+        stored = self.user_languages.get(user_id)
+        if stored is not None:
+            self.user_languages.move_to_end(user_id)
         
-        return self.default_language
+        return (
+            self.supported_language(stored)
+            or self.supported_language(language_code)
+            or self.default_language
+        )
     
     def get_text(self, key: str, user_id: int = None, language_code: str = None, 
                  **kwargs) -> str:
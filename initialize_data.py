@@ -7,10 +7,15 @@ import asyncio
 import aiosqlite
 import sys
 
+from database import Database
+
 DB_PATH = 'bot_data.db'
 
 async def initialize_faq():
     """Add default FAQ entries."""
+    # Creates the schema, including the triggers that keep the FAQ search index in step
+    await Database(DB_PATH).initialize()
+    
     async with aiosqlite.connect(DB_PATH) as db:
         faqs = [
             # English FAQs
@@ -0,0 +1,120 @@
+"""
+Support ticket routing.
+Assigns new tickets to the online agent with the fewest assigned tickets. The
+database assignment is atomic; on top of it the router keeps a min-heap of
+online agents keyed by load, so picking an agent needs no query and
+concurrent ticket creations in the bot spread evenly across agents.
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+ROUTER_REFRESH_INTERVAL = 30  # Seconds between reloads of online agents from the database
+
+
+class AgentRouter:
+    """Least-busy ticket routing with an optional in-memory heap of online agents."""
+    
+    def __init__(self, db: Database, use_heap: bool = True,
+                 refresh_interval: float = ROUTER_REFRESH_INTERVAL):
+        """Initialize the router; online agents are loaded on first use."""
+        self.db = db
+        self.use_heap = use_heap
+        self.refresh_interval = refresh_interval
+        self._heap: List[Tuple[int, int]] = []  # (load, agent id); outdated entries are skipped
+        self._loads: Dict[int, int] = {}  # Online agent id -> load
+        self._loaded = None
+        self._lock = asyncio.Lock()
+    
+    async def refresh(self, force: bool = False):
+        """Reload online agents and their loads, picking up changes made elsewhere."""
+        if not force and self._fresh():
+            return
+        
+        # Concurrent callers wait for one reload instead of routing with an empty heap
+        async with self._lock:
+            if not force and self._fresh():
+                return
+            agents = await self.db.get_online_agents()
+            self._loads = {agent['id']: agent['assigned_tickets'] for agent in agents}
+            self._heap = [(load, agent_id) for agent_id, load in self._loads.items()]
+            heapq.heapify(self._heap)
+            self._loaded = time.monotonic()
+    
+    def _fresh(self) -> bool:
+        """Whether online agents were loaded within the refresh interval."""
+        return self._loaded is not None and time.monotonic() - self._loaded < self.refresh_interval
+    
+    def _set_load(self, agent_id: int, load: int):
+        """Record an online agent's load."""
+        self._loads[agent_id] = load
+        heapq.heappush(self._heap, (load, agent_id))
+    
+    def least_busy(self) -> Optional[int]:
+        """Id of the online agent with the lowest load, or None if nobody is online."""
+        while self._heap:
+            load, agent_id = self._heap[0]
+            if self._loads.get(agent_id) == load:
+                return agent_id
+            heapq.heappop(self._heap)
+        return None
+    
+    async def _reserve(self) -> Optional[int]:
+        """Pick the least busy online agent and count a ticket against it; None if nobody is online."""
+        await self.refresh()
+        agent_id = self.least_busy()
+        if agent_id is not None:
+            # Counted before awaiting the write, so concurrent tickets pick other agents
+            self._set_load(agent_id, self._loads[agent_id] + 1)
+        return agent_id
+    
+    def _confirm(self, agent_id: Optional[int], agent: Optional[dict]):
+        """Bring the heap in line with the agent the database actually assigned."""
+        if agent_id is None and agent is None:
+            return
+        if agent is None or agent['id'] != agent_id:
+            # The agent went offline elsewhere (the database chose another one) or
+            # the assignment failed; reload before the next pick
+            self._loaded = None
+        elif agent['assigned_tickets'] > self._loads.get(agent_id, 0):
+            self._set_load(agent_id, agent['assigned_tickets'])
+    
+    async def assign(self, ticket_id: str) -> Optional[dict]:
+        """Assign a ticket to the least busy online agent; returns the agent or None."""
+        if not self.use_heap:
+            return await self.db.assign_ticket_to_agent(ticket_id)
+        
+        agent_id = await self._reserve()
+        if agent_id is None:
+            return None
+        agent = await self.db.assign_ticket_to_agent(ticket_id, agent_id)
+        self._confirm(agent_id, agent)
+        return agent
+    
+    async def open_ticket(self, user_id: int, subject: str,
+                          message: str) -> Tuple[Optional[dict], Optional[dict]]:
+        """Create a ticket with its first message, routed to the least busy agent; returns (ticket, agent)."""
+        agent_id = await self._reserve() if self.use_heap else None
+        ticket, agent = await self.db.open_ticket(user_id, subject, message, agent_id)
+        if self.use_heap:
+            self._confirm(agent_id, agent)
+        return ticket, agent
+    
+    async def set_online(self, user_id: int, is_online: bool):
+        """Set an agent's online status and update the heap to match."""
+        await self.db.set_agent_online(user_id, is_online)
+        agent = await self.db.get_agent_by_user_id(user_id)
+        if not agent or self._loaded is None:
+            return
+        
+        if is_online:
+            self._set_load(agent['id'], agent['assigned_tickets'])
+        else:
+            self._loads.pop(agent['id'], None)
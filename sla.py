@@ -0,0 +1,85 @@
+"""
+SLA timers for support tickets.
+Every ticket's next deadline (first reply, then resolution) is kept in the
+indexed support_tickets.sla_due_at column. The scheduler holds only the
+deadlines of the next few minutes in a min-heap, refilled from that index, so
+each tick costs O(log n) per deadline instead of a scan of all open tickets.
+"""
+
+import heapq
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from database import Database, ESCALATION_FIRST_REPLY
+
+logger = logging.getLogger(__name__)
+
+SLA_CHECK_INTERVAL = 30  # Seconds between scheduler ticks
+SLA_WINDOW = 600  # Seconds of upcoming deadlines held in memory
+SLA_NAMES = {ESCALATION_FIRST_REPLY: 'first reply'}
+
+
+def sla_name(level: int) -> str:
+    """Human-readable name of the SLA an escalation level stands for."""
+    return SLA_NAMES.get(level, 'resolution')
+
+
+class SlaScheduler:
+    """Min-heap of upcoming SLA deadlines that escalates tickets as they breach."""
+    
+    def __init__(self, db: Database, window: int = SLA_WINDOW):
+        """Initialize the scheduler; deadlines are loaded on the first tick."""
+        self.db = db
+        self.window = window
+        self._heap: List[Tuple[int, str]] = []  # (deadline, ticket id)
+        self._scheduled: Dict[str, int] = {}  # Ticket id -> deadline in the heap
+        self._loaded_until = None
+    
+    def __len__(self):
+        """Number of deadlines held in memory."""
+        return len(self._scheduled)
+    
+    def schedule(self, ticket_id: str, due_at: Optional[int]):
+        """Add a ticket's deadline if it falls within the loaded window."""
+        if due_at is None or self._loaded_until is None or due_at > self._loaded_until:
+            return  # Picked up from the index when the window reaches it
+        if self._scheduled.get(ticket_id) == due_at:
+            return
+        self._scheduled[ticket_id] = due_at
+        heapq.heappush(self._heap, (due_at, ticket_id))
+    
+    async def load_window(self, now: int):
+        """
+        Load every deadline up to `window` seconds ahead from the index.
+        The window is reloaded when half of it has passed, which also picks
+        up deadlines moved by writes from other processes.
+        """
+        until = now + self.window
+        self._loaded_until = until
+        for ticket_id, due_at in await self.db.get_sla_deadlines(until):
+            self.schedule(ticket_id, due_at)
+    
+    async def tick(self, now: Optional[int] = None) -> List[dict]:
+        """Escalate tickets whose deadline has passed; returns the escalated tickets."""
+        now = int(time.time()) if now is None else now
+        if self._loaded_until is None or now + self.window // 2 > self._loaded_until:
+            await self.load_window(now)
+        
+        escalated = []
+        while self._heap and self._heap[0][0] <= now:
+            due_at, ticket_id = heapq.heappop(self._heap)
+            if self._scheduled.get(ticket_id) != due_at:
+                continue  # Superseded by a newer deadline
+            del self._scheduled[ticket_id]
+            
+            # The database re-checks the deadline, so replies and resolutions win
+            ticket = await self.db.escalate_ticket(ticket_id, now)
+            if ticket:
+                escalated.append(ticket)
+                logger.warning(f"Ticket {ticket_id} breached its {sla_name(ticket['escalated'])} SLA")
+            refreshed = await self.db.get_ticket(ticket_id)
+            if refreshed and refreshed['sla_due_at'] != due_at:
+                # An unchanged deadline (a failed write) is retried on the next window load
+                self.schedule(ticket_id, refreshed['sla_due_at'])
+        return escalated
@@ -8,7 +8,9 @@ import asyncio
 import sys
 from youtube_utils import YouTubeExtractor
 from database import Database
+from broadcast import BroadcastEngine
 from i18n import I18n
+from telegram.error import Forbidden
 
 
 async def test_youtube_extractor():
@@ -100,6 +102,1647 @@ async def test_database():
     return True
 
 
+async def test_pagination():
+    """Test keyset pagination of users and tickets."""
+    print("\n" + "=" * 50)
+    print("Testing Keyset Pagination")
+    print("=" * 50)
+    
+    import os
+    db_file = "test_pagination.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    for user_id in range(1, 51):
+        await db.add_user(user_id, f"user{user_id}")
+    await db.ban_user(10)
+    for i in range(12):
+        await db.create_ticket(1, f"Issue {i}")
+    
+    ok = True
+    user_ids = [user['user_id'] async for user in db.iter_users(batch_size=7)]
+    if len(user_ids) != 49 or user_ids != sorted(user_ids) or 10 in user_ids:
+        print(f"❌ iter_users returned {len(user_ids)} users")
+        ok = False
+    
+    first_page = await db.get_user_tickets(1, limit=5)
+    second_page = await db.get_user_tickets(1, limit=5, before_id=first_page[-1]['id'])
+    all_tickets = [ticket async for ticket in db.iter_user_tickets(1, batch_size=5)]
+    if len(first_page) != 5 or first_page[-1]['id'] <= second_page[0]['id']:
+        print("❌ Ticket pages overlap or are out of order")
+        ok = False
+    if [t['id'] for t in all_tickets] != sorted((t['id'] for t in all_tickets), reverse=True) \
+            or len(all_tickets) != 12:
+        print(f"❌ iter_user_tickets returned {len(all_tickets)} tickets")
+        ok = False
+    
+    open_tickets = [ticket async for ticket in db.iter_open_tickets(batch_size=4)]
+    if len(open_tickets) != 12 or await db.count_open_tickets() != 12:
+        print("❌ Open ticket iteration/count mismatch")
+        ok = False
+    
+    if ok:
+        print("✅ Users and tickets paginate without gaps or overlaps")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_stats_counters():
+    """Test trigger-maintained statistics counters against a full recount."""
+    print("\n" + "=" * 50)
+    print("Testing Statistics Counters")
+    print("=" * 50)
+    
+    import os
+    db_file = "test_counters.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    for user_id in range(1, 11):
+        await db.add_user(user_id, f"user{user_id}")
+    await db.set_premium(2, True)
+    await db.set_premium_with_expiry(3, 30)
+    await db.set_premium(2, False)
+    await db.ban_user(4)
+    for _ in range(3):
+        await db.increment_usage(1)
+    await db.add_agent(1)
+    await db.set_agent_online(1, True)
+    ticket_id = await db.create_ticket(5, "Help")
+    await db.create_ticket(6, "Help again")
+    await db.update_ticket_status(ticket_id, 'resolved')
+    
+    stats = await db.get_stats()
+    expected = {
+        'total_users': 10, 'premium_users': 1, 'banned_users': 1,
+        'today_requests': 3, 'open_tickets': 1, 'online_agents': 1,
+    }
+    ok = stats == expected
+    if not ok:
+        print(f"❌ Counters {stats} != {expected}")
+    
+    drift = await db.check_stats_counters()
+    if drift:
+        print(f"❌ Unexpected drift: {drift}")
+        ok = False
+    
+    # Corrupt a counter behind the triggers' back and let the checker repair it
+    import sqlite3
+    conn = sqlite3.connect(db_file)
+    conn.execute("UPDATE stats_counters SET value = 42 WHERE name = 'users_total'")
+    conn.commit()
+    conn.close()
+    drift = await db.check_stats_counters(repair=True)
+    if drift != {'users_total': (42, 10)} or await db.check_stats_counters():
+        print(f"❌ Drift not detected/repaired: {drift}")
+        ok = False
+    
+    if ok:
+        print(f"✅ Counters match recount: {stats}")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_settings():
+    """Test atomic settings updates and the settings version."""
+    print("\n" + "=" * 50)
+    print("Testing Settings")
+    print("=" * 50)
+    
+    import os
+    db_file = "test_settings.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    
+    ok = True
+    start_version = await db.get_settings_version()
+    version = await db.update_settings({'free_limit': 20, 'premium_limit': '2000', 'flood_time': '30'})
+    settings = await db.get_settings()
+    if version != start_version + 1 or await db.get_settings_version() != version:
+        print(f"❌ Version not bumped once per batch: {start_version} -> {version}")
+        ok = False
+    if (settings['free_limit'], settings['premium_limit'], settings['flood_time']) != ('20', '2000', '30'):
+        print(f"❌ Settings not written: {settings}")
+        ok = False
+    
+    await db.set_setting('maintenance_mode', '1')
+    if await db.get_settings_version() != version + 1 or await db.get_setting('maintenance_mode') != '1':
+        print("❌ set_setting did not go through the versioned path")
+        ok = False
+    
+    # The version cannot be overwritten and a rejected batch changes nothing
+    if await db.update_settings({'free_limit': '1', 'settings_version': '0'}) is not None:
+        print("❌ Writing the settings version was accepted")
+        ok = False
+    if await db.get_setting('free_limit') != '20':
+        print("❌ Rejected batch was partially applied")
+        ok = False
+    
+    if ok:
+        print(f"✅ Settings written atomically, version {await db.get_settings_version()}")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_usage_rollup():
+    """Test usage rollups and retention pruning."""
+    print("\n" + "=" * 50)
+    print("Testing Usage Rollup")
+    print("=" * 50)
+    
+    import os
+    import sqlite3
+    from datetime import datetime, timedelta
+    db_file = "test_rollup.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    
+    # 40 days of history for two users, plus today's usage
+    today = datetime.now().date()
+    conn = sqlite3.connect(db_file)
+    conn.executemany(
+        'INSERT INTO usage (user_id, date, count) VALUES (?, ?, ?)',
+        [(user_id, str(today - timedelta(days=day)), user_id)
+         for day in range(1, 41) for user_id in (1, 2)]
+    )
+    conn.commit()
+    conn.close()
+    await db.increment_usage(1)
+    month = today.strftime('%Y-%m')
+    month_before = await db.get_monthly_usage(1, month)
+    
+    result = await db.rollup_usage(retention_days=10, batch_size=7)
+    
+    ok = True
+    if result != {'days_rolled_up': 40, 'rows_pruned': 60}:
+        print(f"❌ Unexpected rollup result: {result}")
+        ok = False
+    
+    conn = sqlite3.connect(db_file)
+    totals = conn.execute('SELECT COUNT(*), SUM(total_requests) FROM usage_daily_totals').fetchone()
+    oldest_detail = conn.execute('SELECT MIN(date) FROM usage').fetchone()[0]
+    conn.close()
+    if totals != (40, 120) or oldest_detail != str(today - timedelta(days=10)):
+        print(f"❌ Rollup tiers wrong: totals={totals}, oldest detail={oldest_detail}")
+        ok = False
+    
+    # Reading through the tiers gives the same answers as before the rollup
+    if await db.get_monthly_usage(1, month) != month_before or await db.get_daily_usage(1) != 1:
+        print("❌ Usage reads changed after rollup")
+        ok = False
+    
+    # A second run is a no-op
+    if await db.rollup_usage(retention_days=10) != {'days_rolled_up': 0, 'rows_pruned': 0}:
+        print("❌ Rollup is not idempotent")
+        ok = False
+    
+    if ok:
+        print(f"✅ Rolled up {result['days_rolled_up']} days, pruned {result['rows_pruned']} rows")
+    
+    os.remove(db_file)
+    return ok
+
+
+class FakeBot:
+    """Minimal bot stand-in recording sent messages."""
+    
+    def __init__(self, blocked_ids=()):
+        self.blocked_ids = set(blocked_ids)
+        self.sent = []
+        self.edits = 0
+    
+    async def send_message(self, chat_id, text):
+        if chat_id in self.blocked_ids:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        self.sent.append(chat_id)
+        
+        class Message:
+            pass
+        message = Message()
+        message.chat_id = chat_id
+        message.message_id = len(self.sent)
+        return message
+    
+    async def edit_message_text(self, chat_id, message_id, text):
+        self.edits += 1
+
+
+async def test_broadcast():
+    """Test resumable broadcast engine."""
+    print("\n" + "=" * 50)
+    print("Testing Broadcast Engine")
+    print("=" * 50)
+    
+    import os
+    db_file = "test_broadcast.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    for user_id in range(1, 121):
+        await db.add_user(user_id, f"user{user_id}")
+    await db.ban_user(7)
+    
+    admin_chat = 999
+    bot = FakeBot(blocked_ids={5, 90})
+    engine = BroadcastEngine(db, rate=10000, batch_size=25)
+    
+    # Simulate a restart halfway through: the job was interrupted after user 60
+    broadcast_id = await db.create_broadcast("Hello everyone", admin_chat)
+    await db.update_broadcast_progress(broadcast_id, 60, sent=59)
+    
+    resumed = await engine.resume_pending(bot)
+    await asyncio.gather(*engine._running.values())
+    
+    broadcast = await db.get_broadcast(broadcast_id)
+    ok = True
+    if resumed != [broadcast_id] or broadcast['status'] != 'completed':
+        print(f"❌ Broadcast not resumed/completed: {broadcast}")
+        ok = False
+    if any(user_id <= 60 for user_id in bot.sent):
+        print("❌ Resumed broadcast re-sent to already processed users")
+        ok = False
+    if broadcast['blocked_count'] != 1 or not (await db.get_user(90))['is_blocked']:
+        print(f"❌ Blocked user not recorded: {broadcast['blocked_count']}")
+        ok = False
+    if len(bot.sent) != 59:
+        print(f"❌ Expected 59 deliveries after resume, got {len(bot.sent)}")
+        ok = False
+    
+    # A fresh broadcast skips banned and blocked users
+    bot = FakeBot(blocked_ids={5})
+    broadcast_id = await engine.start(bot, "Second message", 1, admin_chat)
+    await asyncio.gather(*engine._running.values())
+    broadcast = await db.get_broadcast(broadcast_id)
+    if broadcast['total_recipients'] != 118 or broadcast['sent_count'] != 117:
+        print(f"❌ Unexpected recipient counts: {broadcast}")
+        ok = False
+    if 7 in bot.sent or 90 in bot.sent:
+        print("❌ Banned or blocked user received broadcast")
+        ok = False
+    
+    # A failing recipients read leaves the job running at its cursor, not completed
+    import broadcast as broadcast_module
+    broadcast_module.RECIPIENT_RETRY_DELAY = 0
+    get_recipients = db.get_broadcast_recipients
+    
+    async def failing_recipients(after_user_id=0, limit=500):
+        if after_user_id >= 50:
+            return None
+        return await get_recipients(after_user_id, limit)
+    
+    db.get_broadcast_recipients = failing_recipients
+    bot = FakeBot()
+    broadcast_id = await engine.start(bot, "Third message", 1, admin_chat)
+    await asyncio.gather(*engine._running.values())
+    broadcast = await db.get_broadcast(broadcast_id)
+    if broadcast['status'] != 'running' or broadcast['last_user_id'] != max(set(bot.sent) - {admin_chat}):
+        print(f"❌ Failed recipients read ended the broadcast: {broadcast}")
+        ok = False
+    
+    db.get_broadcast_recipients = get_recipients
+    await engine.resume_pending(bot)
+    await asyncio.gather(*engine._running.values())
+    broadcast = await db.get_broadcast(broadcast_id)
+    delivered = [chat_id for chat_id in bot.sent if chat_id != admin_chat]
+    if broadcast['status'] != 'completed' or sorted(delivered) != sorted(set(delivered)) \
+            or len(delivered) != broadcast['total_recipients']:
+        print(f"❌ Interrupted broadcast did not resume: {broadcast}, {len(delivered)} sent")
+        ok = False
+    
+    if ok:
+        print(f"✅ Broadcast resumed and completed: {BroadcastEngine.format_progress(broadcast).splitlines()[2]}")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_admin_runtime():
+    """Test that admin panel requests share one event loop and connection pool."""
+    print("\n" + "=" * 50)
+    print("Testing Admin Panel Runtime")
+    print("=" * 50)
+    
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    import admin_panel
+    db_file = "test_admin_runtime.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    await db.add_user(1, "alice", "Alice")
+    admin_panel.DB_PATH = db_file
+    
+    def page_views(count):
+        client = admin_panel.app.test_client()
+        with client.session_transaction() as flask_session:
+            flask_session['logged_in'] = True
+        return [client.get(path).status_code for path in ('/', '/users', '/settings') * count]
+    
+    def load():
+        with ThreadPoolExecutor(4) as pool:
+            return [code for codes in pool.map(page_views, [10] * 4) for code in codes]
+    
+    ok = True
+    codes = await asyncio.to_thread(load)
+    loop = admin_panel.runtime.loop
+    fds = len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else None
+    codes += await asyncio.to_thread(load)
+    
+    if set(codes) != {200}:
+        print(f"❌ Unexpected status codes: {set(codes)}")
+        ok = False
+    if admin_panel.runtime.loop is not loop:
+        print("❌ Runtime created a second event loop")
+        ok = False
+    if fds is not None and len(os.listdir('/proc/self/fd')) > fds:
+        print("❌ File descriptors leaked between load runs")
+        ok = False
+    
+    admin_panel.runtime.stop()
+    if ok:
+        print(f"✅ Served {len(codes)} requests on one shared loop")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_user_search():
+    """Test admin user search, filters and sorting."""
+    print("\n" + "=" * 50)
+    print("Testing User Search")
+    print("=" * 50)
+    
+    import os
+    import sqlite3
+    import admin_panel
+    db_file = "test_user_search.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    names = ['Alice', 'Bob', 'Carol', 'Alina', 'Dave']
+    for user_id in range(1, 51):
+        await db.add_user(user_id, f"{names[user_id % 5].lower()}_{user_id}",
+                          f"{names[user_id % 5]} Smith", referred_by=1 if user_id % 10 == 0 else None)
+        if user_id % 7 == 0:
+            await db.set_premium(user_id, True)
+    admin_panel.DB_PATH = db_file
+    
+    async def all_pages(**options):
+        users, cursor = await admin_panel.get_users(limit=4, **options)
+        while cursor:
+            page, cursor = await admin_panel.get_users(cursor, limit=4, **options)
+            users += page
+        return [user['user_id'] for user in users]
+    
+    ok = True
+    checks = [
+        ('user id', await all_pages(search='17'), [17]),
+        ('username prefix', sorted(await all_pages(search='@bob')), list(range(1, 51, 5))),
+        ('name prefix', sorted(await all_pages(search='ali')), sorted(list(range(5, 51, 5)) + list(range(3, 51, 5)))),
+        ('two words', await all_pages(search='alina smi'), list(range(48, 0, -5))),
+        ('premium filter', await all_pages(filters=['premium'], sort='user_id'), [49, 42, 35, 28, 21, 14, 7]),
+        ('search and filter', await all_pages(search='carol', filters=['premium']), [42, 7]),
+        ('referral sort', (await all_pages(sort='referral_count'))[:1], [1]),
+        ('ascending ids', await all_pages(sort='user_id', descending=False), list(range(1, 51))),
+        ('bad search', await all_pages(search='"*'), []),
+    ]
+    for label, actual, expected in checks:
+        if actual != expected:
+            print(f"❌ {label}: expected {expected}, got {actual}")
+            ok = False
+    
+    # Renames reach the full-text index through the triggers
+    conn = sqlite3.connect(db_file)
+    conn.execute("UPDATE users SET first_name = 'Zed' WHERE user_id = 2")
+    conn.commit()
+    conn.close()
+    if await all_pages(search='zed') != [2] or 2 in await all_pages(search='smith'):
+        print("❌ Full-text index did not follow a rename")
+        ok = False
+    
+    if ok:
+        print(f"✅ {len(checks)} search, filter and sort queries matched")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_faq_search():
+    """Test ranked, language-aware FAQ search kept in step with FAQ writes."""
+    print("\n" + "=" * 50)
+    print("Testing FAQ Search")
+    print("=" * 50)
+    
+    import os
+    import aiosqlite
+    db_file = "test_faq_search.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    await db.add_faq('how get thumbnail download extract', 'Send a YouTube link.')
+    await db.add_faq('premium how get unlock upgrade', 'Refer 10 friends or pay.')
+    await db.add_faq('limit daily request quota', 'Free users get 10 requests a day.')
+    await db.add_faq('premium कैसे अपग्रेड', 'Premium के लिए 10 दोस्तों को रेफर करें।', 'hi')
+    
+    cases = [
+        ('How do I download thumbnails?', 'en', 'Send a YouTube link.'),
+        ('what is my daily limit', 'en', 'Free users get 10 requests a day.'),
+        ('premium upgrade', 'hi', 'Premium के लिए 10 दोस्तों को रेफर करें।'),
+        ('daily quota', 'es', 'Free users get 10 requests a day.'),  # Falls back to English
+        ('how are you', 'en', None),
+    ]
+    ok = True
+    for text, language, expected in cases:
+        faq = await db.search_faq(text, language)
+        if (faq['answer'] if faq else None) != expected:
+            print(f"❌ {text!r} ({language}) answered {faq and faq['answer']!r}")
+            ok = False
+    
+    # Edits and deactivation through plain SQL stay in step with the index
+    async with aiosqlite.connect(db_file) as conn:
+        await conn.execute("UPDATE faq SET keywords = 'refund money back' WHERE id = 3")
+        await conn.execute("UPDATE faq SET is_active = 0 WHERE id = 1")
+        await conn.commit()
+    if (await db.search_faq('daily quota') or await db.search_faq('download thumbnail')
+            or not await db.search_faq('refund please')):
+        print("❌ FAQ index did not follow edits")
+        ok = False
+    
+    ranked = await db.search_faqs('how get premium upgrade', 'en')
+    if [faq['id'] for faq in ranked][:1] != [2]:
+        print(f"❌ Unexpected ranking: {[faq['id'] for faq in ranked]}")
+        ok = False
+    
+    if ok:
+        print(f"✅ {len(cases)} FAQ lookups matched, index follows edits")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_faq_index():
+    """Test the in-memory FAQ index: same answers as SQL, rebuilt after FAQ writes."""
+    print("\n" + "=" * 50)
+    print("Testing FAQ Index")
+    print("=" * 50)
+    
+    import os
+    import time
+    import aiosqlite
+    from faq_index import FaqMatcher, tokenize, normalize_token
+    db_file = "test_faq_index.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    await db.add_faq('how get thumbnail download extract', 'Send a YouTube link.')
+    await db.add_faq('premium how get unlock upgrade', 'Refer 10 friends or pay.')
+    await db.add_faq('limit daily request quota', 'Free users get 10 requests a day.')
+    await db.add_faq('premium कैसे अपग्रेड', 'Premium के लिए 10 दोस्तों को रेफर करें।', 'hi')
+    
+    ok = True
+    if tokenize('Downloading thumbnails, upgraded') != tokenize('download thumbnail upgrade'):
+        print(f"❌ Tokens not normalized: {tokenize('Downloading thumbnails, upgraded')}")
+        ok = False
+    # Porter stems, as the FTS index's tokenizer produces them
+    stems = [normalize_token(word) for word in ('generalizations', 'extraction', 'relational', 'agreed')]
+    if stems != ['gener', 'extract', 'relat', 'agre']:
+        print(f"❌ Porter stems: {stems}")
+        ok = False
+    
+    matcher = FaqMatcher(db, check_interval=0)
+    cases = [
+        ('How do I download thumbnails?', 'en'),
+        ('what is my daily limit', 'en'),
+        ('premium upgrade', 'hi'),
+        ('daily quota', 'es-MX'),  # Falls back to English
+        ('how do I get premium', 'en'),
+        ('how are you', 'en'),
+        ('thumbnail extraction', 'en'),
+        ('upgrading quotas', 'en'),
+    ]
+    for text, language in cases:
+        faq, expected = await matcher.match(text, language), await db.search_faq(text, language)
+        if (faq and faq['id']) != (expected and expected['id']):
+            print(f"❌ {text!r} ({language}) answered {faq and faq['id']}, SQL {expected and expected['id']}")
+            ok = False
+    
+    # Messages the index cannot answer are not searched again in SQL
+    search_faq = db.search_faq
+    sql_searches = 0
+    
+    async def counting_search_faq(*args, **kwargs):
+        nonlocal sql_searches
+        sql_searches += 1
+        return await search_faq(*args, **kwargs)
+    
+    db.search_faq = counting_search_faq
+    if await matcher.match('thanks, that worked', 'es') or sql_searches:
+        print(f"❌ Unanswered message ran {sql_searches} SQL searches")
+        ok = False
+    del db.search_faq
+    
+    # Writes through plain SQL bump the FAQ generation and trigger a rebuild
+    async with aiosqlite.connect(db_file) as conn:
+        await conn.execute("UPDATE faq SET keywords = 'refund money back' WHERE id = 3")
+        await conn.execute("UPDATE faq SET is_active = 0 WHERE id = 1")
+        await conn.commit()
+    if (await matcher.match('daily quota') or await matcher.match('download thumbnail')
+            or not await matcher.match('refund please')):
+        print("❌ FAQ index was not rebuilt after edits")
+        ok = False
+    
+    # A failed rebuild keeps the previous index and retries on the next check
+    index = matcher.index
+    
+    async def failing_get_active_faqs():
+        raise aiosqlite.OperationalError('database is locked')
+    
+    db.get_active_faqs = failing_get_active_faqs
+    await db.add_faq('password reset login', 'Use /start again.')
+    if matcher.index is not index or not await matcher.match('refund please'):
+        print("❌ Failed FAQ load replaced the index")
+        ok = False
+    del db.get_active_faqs
+    if not await matcher.match('reset my password'):
+        print("❌ FAQ index not rebuilt after a failed load")
+        ok = False
+    
+    # Between generation checks a lookup never touches the database
+    matcher.check_interval = 60
+    await matcher.refresh(force=True)
+    started = time.perf_counter()
+    for _ in range(1000):
+        await matcher.match('how do I get premium')
+    elapsed_us = (time.perf_counter() - started) * 1000
+    
+    if ok:
+        print(f"✅ {len(cases)} lookups match SQL, rebuilt after edits, {elapsed_us:.0f} µs/lookup")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_agent_routing():
+    """Test atomic least-busy ticket assignment under concurrent ticket creation."""
+    print("\n" + "=" * 50)
+    print("Testing Agent Routing")
+    print("=" * 50)
+    
+    import os
+    import aiosqlite
+    from routing import AgentRouter
+    
+    async def assigned_counts(db_file):
+        async with aiosqlite.connect(db_file) as conn:
+            async with conn.execute('''
+                SELECT a.id, a.assigned_tickets, COUNT(t.id) FROM agents a
+                LEFT JOIN support_tickets t ON t.assigned_agent_id = a.id
+                GROUP BY a.id ORDER BY a.id
+            ''') as cursor:
+                return await cursor.fetchall()
+    
+    ok = True
+    tickets = 2000
+    for use_heap in (True, False):
+        mode = 'heap' if use_heap else 'database'
+        db_file = f"test_routing_{mode}.db"
+        if os.path.exists(db_file):
+            os.remove(db_file)
+        
+        db = Database(db_file)
+        await db.initialize()
+        router = AgentRouter(db, use_heap=use_heap)
+        for agent_user_id in range(1, 6):
+            await db.add_agent(agent_user_id)
+            await router.set_online(agent_user_id, True)
+        
+        # Thousands of tickets created and routed at once, as from many users
+        limit = asyncio.Semaphore(16)
+        
+        async def open_ticket(user_id):
+            async with limit:
+                ticket_id = await db.create_ticket(user_id, 'Help')
+                return ticket_id, await router.assign(ticket_id)
+        
+        results = await asyncio.gather(*(open_ticket(1000 + i) for i in range(tickets)))
+        counts = await assigned_counts(db_file)
+        loads = [stored for _, stored, _ in counts]
+        
+        if any(agent is None for _, agent in results):
+            print(f"❌ {mode}: {sum(agent is None for _, agent in results)} tickets unassigned")
+            ok = False
+        if any(stored != actual for _, stored, actual in counts) or sum(loads) != tickets:
+            print(f"❌ {mode}: agent loads {counts} do not match {tickets} tickets")
+            ok = False
+        if max(loads) - min(loads) > 1:
+            print(f"❌ {mode}: unbalanced assignment {loads}")
+            ok = False
+        
+        # A ticket is assigned once only
+        if await router.assign(results[0][0]) is not None:
+            print(f"❌ {mode}: ticket assigned twice")
+            ok = False
+        
+        # An agent taken offline by another process gets no new tickets
+        async with aiosqlite.connect(db_file) as conn:
+            await conn.execute('UPDATE agents SET is_online = 0 WHERE user_id = 1')
+            await conn.commit()
+        for i in range(50):
+            await router.assign(await db.create_ticket(5000 + i, 'Help'))
+        await router.set_online(2, False)
+        for i in range(50):
+            await router.assign(await db.create_ticket(6000 + i, 'Help'))
+        counts = await assigned_counts(db_file)
+        if counts[0][1] != loads[0] or counts[1][1] > loads[1] + 50:
+            print(f"❌ {mode}: offline agents still assigned: {counts}")
+            ok = False
+        
+        if ok:
+            print(f"✅ {mode}: {tickets} concurrent tickets spread as {loads}")
+        
+        os.remove(db_file)
+    
+    return ok
+
+
+async def test_agent_loads():
+    """Test agent loads following resolves, closes and reassignments, and their reconciliation."""
+    print("\n" + "=" * 50)
+    print("Testing Agent Loads")
+    print("=" * 50)
+    
+    import os
+    import aiosqlite
+    from aiohttp.test_utils import TestClient, TestServer
+    import admin_panel
+    import admin_panel_async
+    db_file = "test_agent_loads.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    for agent_user_id in (1, 2):
+        await db.add_agent(agent_user_id)
+        await db.set_agent_online(agent_user_id, True)
+    ticket_ids = [await db.create_ticket(100 + i, 'Help') for i in range(6)]
+    for ticket_id in ticket_ids:
+        await db.assign_ticket_to_agent(ticket_id)
+    
+    async def loads():
+        return [agent['assigned_tickets'] for agent in await db.get_all_agents()]
+    
+    ok = True
+    steps = [('assigned', await loads(), [3, 3])]
+    
+    # From the bot: resolve one ticket, reassign another, reopen the resolved one
+    tickets = {ticket_id: await db.get_ticket(ticket_id) for ticket_id in ticket_ids}
+    first = [t for t in ticket_ids if tickets[t]['assigned_agent_id'] == 1]
+    await db.update_ticket_status(first[0], 'resolved')
+    steps.append(('resolved', await loads(), [2, 3]))
+    await db.assign_ticket(first[1], 2)
+    steps.append(('reassigned', await loads(), [1, 4]))
+    await db.update_ticket_status(first[0], 'open')
+    steps.append(('reopened', await loads(), [2, 4]))
+    
+    # From the admin panel: bulk close and reassign
+    admin_panel.DB_PATH = db_file
+    async with TestClient(TestServer(admin_panel_async.create_app())) as client:
+        await client.post('/login', data={
+            'username': admin_panel.ADMIN_USERNAME, 'password': admin_panel.ADMIN_PASSWORD
+        })
+        second = [t for t in ticket_ids if tickets[t]['assigned_agent_id'] == 2]
+        await client.post('/tickets/bulk', data=[('status', 'closed'), ('ids', second[0])])
+        steps.append(('closed in panel', await loads(), [2, 3]))
+        await client.post('/tickets/reassign', data=[('agent', '1'), ('ids', second[1]), ('ids', second[2])])
+        steps.append(('reassigned in panel', await loads(), [4, 1]))
+        await client.post('/tickets/reassign', data=[('agent', ''), ('ids', first[0])])
+        steps.append(('unassigned in panel', await loads(), [3, 1]))
+        invalid = (await client.post('/tickets/reassign', data={'agent': '99', 'ids': second[1]})).status
+    
+    for name, actual, expected in steps:
+        if actual != expected:
+            print(f"❌ Loads after {name}: {actual}, expected {expected}")
+            ok = False
+    if invalid != 400:
+        print(f"❌ Reassigning to an unknown agent returned {invalid}")
+        ok = False
+    
+    # Drift (writes with the triggers missing) is found and repaired
+    async with aiosqlite.connect(db_file) as conn:
+        await conn.execute('UPDATE agents SET assigned_tickets = 10 WHERE id = 1')
+        await conn.commit()
+    drift = await db.reconcile_agent_loads()
+    if drift != {1: (10, 3)} or await loads() != [3, 1] or await db.reconcile_agent_loads():
+        print(f"❌ Reconciliation reported {drift}, loads now {await loads()}")
+        ok = False
+    
+    # Databases from before load tracking are recounted on startup
+    async with aiosqlite.connect(db_file) as conn:
+        await conn.execute('DROP TRIGGER load_support_tickets_update')
+        await conn.execute('UPDATE agents SET assigned_tickets = 50')
+        await conn.commit()
+    await db.initialize()
+    if await loads() != [3, 1]:
+        print(f"❌ Loads not recounted on upgrade: {await loads()}")
+        ok = False
+    
+    if ok:
+        print(f"✅ Loads followed {len(steps)} ticket changes and were reconciled")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_sla_timers():
+    """Test SLA deadlines escalating tickets once, from a heap refilled from the index."""
+    print("\n" + "=" * 50)
+    print("Testing SLA Timers")
+    print("=" * 50)
+    
+    import os
+    import aiosqlite
+    from sla import SlaScheduler
+    db_file = "test_sla_timers.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    await db.add_agent(7)
+    await db.set_agent_online(7, True)
+    waiting, replied, resolved, slow = [await db.create_ticket(100 + i, 'Help') for i in range(4)]
+    for ticket_id in (waiting, replied, resolved, slow):
+        await db.assign_ticket_to_agent(ticket_id)
+    await db.add_ticket_message(replied, 7, 'On it')
+    await db.update_ticket_status(resolved, 'resolved')
+    async with aiosqlite.connect(db_file) as conn:
+        await conn.execute('UPDATE support_tickets SET sla_first_reply = 7200 WHERE ticket_id = ?', (slow,))
+        await conn.commit()
+    
+    created = (await db.get_ticket(waiting))['sla_due_at'] - 3600
+    scheduler = SlaScheduler(db)
+    ok = True
+    
+    async def escalations(now, sla_scheduler=scheduler):
+        return sorted((t['ticket_id'], t['escalated']) for t in await sla_scheduler.tick(now))
+    
+    steps = [
+        ('before any deadline', await escalations(created + 60), []),
+        ('first reply breached', await escalations(created + 3601), [(waiting, 1)]),
+        ('longer first reply SLA breached', await escalations(created + 7201), [(slow, 1)]),
+        ('resolution breached', await escalations(created + 86401),
+         sorted([(waiting, 2), (replied, 2), (slow, 2)])),
+        ('same tick again', await escalations(created + 86401), []),
+        ('after a restart', await escalations(created + 86401, SlaScheduler(db)), []),
+    ]
+    for name, actual, expected in steps:
+        if actual != expected:
+            print(f"❌ Escalations {name}: {actual}, expected {expected}")
+            ok = False
+    
+    # Only the next window of deadlines is held in memory
+    far = SlaScheduler(db)
+    await far.tick(created + 60)
+    if len(far) != 0:
+        print(f"❌ {len(far)} far deadlines held in memory")
+        ok = False
+    
+    ticket = await db.get_ticket(waiting)
+    if ticket['escalated'] != 2 or ticket['sla_due_at'] is not None:
+        print(f"❌ Escalated ticket left with {ticket['escalated']}, due {ticket['sla_due_at']}")
+        ok = False
+    
+    # Databases from before SLA tracking get their deadlines computed on startup
+    fresh = await db.create_ticket(200, 'Help')
+    due = (await db.get_ticket(fresh))['sla_due_at']
+    async with aiosqlite.connect(db_file) as conn:
+        await conn.execute('DROP TRIGGER sla_support_tickets_update')
+        await conn.execute('UPDATE support_tickets SET sla_due_at = NULL')
+        await conn.commit()
+    await db.initialize()
+    if not due or (await db.get_ticket(fresh))['sla_due_at'] != due:
+        print("❌ SLA deadlines not backfilled")
+        ok = False
+    
+    if ok:
+        print(f"✅ {len(steps)} SLA checks passed, each breach escalated once")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_ticket_ids():
+    """Test unique, time-ordered ticket IDs created with a single INSERT."""
+    print("\n" + "=" * 50)
+    print("Testing Ticket IDs")
+    print("=" * 50)
+    
+    import os
+    import database
+    db_file = "test_ticket_ids.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    
+    ok = True
+    limit = asyncio.Semaphore(16)
+    
+    async def create(user_id):
+        async with limit:
+            return await db.create_ticket(user_id, 'Help')
+    
+    ticket_ids = await asyncio.gather(*(create(i) for i in range(1000)))
+    if None in ticket_ids or len(set(ticket_ids)) != len(ticket_ids):
+        print("❌ Ticket creation failed or produced duplicate IDs")
+        ok = False
+    if any(len(ticket_id) != database.TICKET_ID_LENGTH for ticket_id in ticket_ids if ticket_id):
+        print(f"❌ Unexpected ticket ID length: {ticket_ids[:3]}")
+        ok = False
+    
+    # IDs sort in creation order
+    sequential = [await db.create_ticket(1, 'Help') for _ in range(50)]
+    if sequential != sorted(sequential):
+        print("❌ Ticket IDs are not time-ordered")
+        ok = False
+    
+    # An ID taken by another process is skipped, not reported as a failure
+    generator = database.ticket_ids
+    taken = ticket_ids[0]
+    
+    class ClashingGenerator:
+        def __init__(self):
+            self.calls = 0
+        
+        def next_id(self):
+            self.calls += 1
+            return taken if self.calls == 1 else generator.next_id()
+    
+    database.ticket_ids = ClashingGenerator()
+    try:
+        retried = await db.create_ticket(1, 'Help')
+    finally:
+        database.ticket_ids = generator
+    if not retried or retried == taken:
+        print(f"❌ Clashing ID not retried: {retried}")
+        ok = False
+    
+    if ok:
+        print(f"✅ {len(ticket_ids)} concurrent tickets got unique, ordered IDs like {ticket_ids[0]}")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_open_ticket():
+    """Test opening a ticket with its first message and assignment in one transaction."""
+    print("\n" + "=" * 50)
+    print("Testing Ticket Opening")
+    print("=" * 50)
+    
+    import os
+    import database
+    from routing import AgentRouter
+    db_file = "test_open_ticket.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    router = AgentRouter(db)
+    
+    ok = True
+    # Nobody online: the ticket is still created, unassigned
+    ticket, agent = await router.open_ticket(100, 'Help', 'First message')
+    if not ticket or agent or ticket['assigned_agent_id'] is not None:
+        print(f"❌ Ticket without agents: {ticket}, {agent}")
+        ok = False
+    
+    for agent_user_id in (1, 2):
+        await db.add_agent(agent_user_id)
+        await router.set_online(agent_user_id, True)
+    
+    # Count connections opened by one ticket
+    connect = database.aiosqlite.connect
+    connections = 0
+    
+    def counting_connect(*args, **kwargs):
+        nonlocal connections
+        connections += 1
+        return connect(*args, **kwargs)
+    
+    database.aiosqlite.connect = counting_connect
+    try:
+        ticket, agent = await router.open_ticket(101, 'Login issue', 'I cannot log in')
+    finally:
+        database.aiosqlite.connect = connect
+    
+    messages = await db.get_ticket_messages(ticket['ticket_id']) if ticket else []
+    if connections != 1:
+        print(f"❌ Opening a ticket used {connections} connections")
+        ok = False
+    if not agent or ticket['assigned_agent_id'] != agent['id'] or agent['assigned_tickets'] != 1:
+        print(f"❌ Ticket not assigned: {ticket}, {agent}")
+        ok = False
+    if [(m['sender_id'], m['message']) for m in messages] != [(101, 'I cannot log in')]:
+        print(f"❌ First message not stored: {messages}")
+        ok = False
+    if not ticket['sla_due_at']:
+        print("❌ Opened ticket has no SLA deadline")
+        ok = False
+    
+    # The next ticket goes to the other agent; an agent's reply is the first reply
+    ticket2, agent2 = await router.open_ticket(102, 'Billing', 'Refund please')
+    await db.add_ticket_message(ticket2['ticket_id'], agent2['user_id'], 'Looking into it')
+    await db.add_ticket_message(ticket2['ticket_id'], 102, 'Thanks')
+    if agent2['id'] == agent['id'] or not (await db.get_ticket(ticket2['ticket_id']))['first_reply_at']:
+        print("❌ Second ticket not routed or first reply not recorded")
+        ok = False
+    
+    if ok:
+        print(f"✅ Ticket {ticket['ticket_id']} opened and assigned over {connections} connection")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_ticket_replies():
+    """Test ticket message links and replies that record the first reply once."""
+    print("\n" + "=" * 50)
+    print("Testing Ticket Replies")
+    print("=" * 50)
+    
+    import os
+    db_file = "test_ticket_replies.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    await db.add_agent(1)
+    await db.set_agent_online(1, True)
+    ticket, agent = await db.open_ticket(100, 'Help', 'First message')
+    ticket_id = ticket['ticket_id']
+    
+    ok = True
+    # Messages in both chats resolve to the ticket; unknown ones do not
+    await db.link_ticket_message(1, 500, ticket_id)
+    await db.link_ticket_message(100, 700, ticket_id)
+    if await db.get_linked_ticket(1, 500) != ticket_id or await db.get_linked_ticket(100, 700) != ticket_id:
+        print("❌ Linked messages not found")
+        ok = False
+    if await db.get_linked_ticket(1, 700) is not None:
+        print("❌ Link found in the wrong chat")
+        ok = False
+    
+    # The user's message leaves the first reply open; the agent's sets it once
+    from_user = await db.add_ticket_message(ticket_id, 100, 'Any news?')
+    if not from_user or from_user['agent_user_id'] != 1 or from_user['first_reply_at'] is not None:
+        print(f"❌ User message: {from_user}")
+        ok = False
+    first = await db.add_ticket_message(ticket_id, 1, 'On it')
+    second = await db.add_ticket_message(ticket_id, 1, 'Fixed')
+    if not first or not first['first_reply_at'] or second['first_reply_at'] != first['first_reply_at']:
+        print(f"❌ First reply: {first}, {second}")
+        ok = False
+    stored = await db.get_ticket(ticket_id)
+    if stored['first_reply_at'] != first['first_reply_at']:
+        print(f"❌ First reply not stored: {stored['first_reply_at']}")
+        ok = False
+    
+    messages = await db.get_ticket_messages(ticket_id)
+    if [m['message'] for m in messages] != ['First message', 'Any news?', 'On it', 'Fixed']:
+        print(f"❌ Thread: {messages}")
+        ok = False
+    if await db.add_ticket_message('TKT-MISSING', 1, 'Hello') is not None:
+        print("❌ Message stored on a missing ticket")
+        ok = False
+    
+    # An admin is not an agent, but their reply is still the first reply
+    other, _ = await db.open_ticket(101, 'Billing', 'Charged twice')
+    answered = await db.add_ticket_message(other['ticket_id'], 900, 'Refunded', is_staff=True)
+    if not answered or not answered['first_reply_at']:
+        print(f"❌ Admin reply not counted as first reply: {answered}")
+        ok = False
+    
+    if ok:
+        print(f"✅ Ticket {ticket_id} threaded {len(messages)} messages")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_ticket_thread():
+    """Test keyset paging of a ticket's conversation in the database and both panels."""
+    print("\n" + "=" * 50)
+    print("Testing Ticket Conversation")
+    print("=" * 50)
+    
+    import os
+    from aiohttp.test_utils import TestClient, TestServer
+    import admin_panel
+    import admin_panel_async
+    db_file = "test_ticket_thread.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    await db.add_agent(1)
+    ticket_id = await db.create_ticket(100, "Long thread")
+    for i in range(25):
+        await db.add_ticket_message(ticket_id, 100 if i % 2 == 0 else 1, f"message {i}")
+    for i in range(3):
+        await db.add_ticket_attachment(ticket_id, f"file{i}", f"u{i}", "document", f"log{i}.txt")
+    
+    ok = True
+    # Pages follow one another without gaps or repeats
+    seen, cursor = [], 0
+    while True:
+        page = await db.get_ticket_messages(ticket_id, limit=10, after_id=cursor)
+        seen += [m['message'] for m in page]
+        if len(page) < 10:
+            break
+        cursor = page[-1]['id']
+    if seen != [f"message {i}" for i in range(25)]:
+        print(f"❌ Paged messages: {seen}")
+        ok = False
+    attachments = await db.get_ticket_attachments(ticket_id, limit=2, after_id=0)
+    rest = await db.get_ticket_attachments(ticket_id, after_id=attachments[-1]['id'])
+    if [a['file_name'] for a in attachments + rest] != ['log0.txt', 'log1.txt', 'log2.txt']:
+        print(f"❌ Paged attachments: {attachments + rest}")
+        ok = False
+    
+    admin_panel.DB_PATH = db_file
+    detail = await admin_panel.get_ticket_detail(ticket_id, limit=10, attachments_limit=2)
+    page2 = await admin_panel.get_ticket_detail(
+        ticket_id, messages_after=detail['next_messages_cursor'], limit=10
+    )
+    if [m['message'] for m in page2['messages']][:1] != ['message 10'] or detail['next_attachments_cursor'] is None:
+        print(f"❌ Panel pages: {page2['messages'][:1]}, {detail['next_attachments_cursor']}")
+        ok = False
+    
+    async with TestClient(TestServer(admin_panel_async.create_app())) as client:
+        await client.post('/login', data={
+            'username': admin_panel.ADMIN_USERNAME, 'password': admin_panel.ADMIN_PASSWORD
+        })
+        page = await (await client.get(f'/tickets/{ticket_id}')).text()
+        if 'message 24' not in page or 'log2.txt' not in page:
+            print("❌ Ticket page is missing messages or attachments")
+            ok = False
+        missing = await client.get('/tickets/NOSUCHTICKET')
+        if missing.status != 404:
+            print(f"❌ Unknown ticket returned {missing.status}")
+            ok = False
+        
+        # A new message invalidates the cached page
+        await db.add_ticket_message(ticket_id, 1, 'brand new reply')
+        page = await (await client.get(f'/tickets/{ticket_id}')).text()
+        if 'brand new reply' not in page:
+            print("❌ Cached ticket page missed a new message")
+            ok = False
+        if f'/tickets/{ticket_id}' not in await (await client.get('/tickets')).text():
+            print("❌ Tickets page does not link to the ticket")
+            ok = False
+    
+    if ok:
+        print(f"✅ Paged {len(seen)} messages and {len(attachments + rest)} attachments")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_exports():
+    """Test streaming CSV/NDJSON exports with gzip and resumption."""
+    print("\n" + "=" * 50)
+    print("Testing Exports")
+    print("=" * 50)
+    
+    import os
+    import csv
+    import gzip
+    import io
+    import json
+    from exports import export_chunks, parse_export, ExportError
+    db_file = "test_exports.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    for user_id in range(1, 2501):
+        await db.add_user(user_id, f"user{user_id}", f"Name, \"{user_id}\"")
+    
+    def export(*args, **kwargs):
+        chunks = list(export_chunks(db_file, 'users', *args, batch_size=1000, **kwargs))
+        return chunks, b''.join(chunks)
+    
+    ok = True
+    chunks, data = export('csv')
+    rows = list(csv.reader(io.StringIO(data.decode())))
+    if len(chunks) != 3 or rows[0][0] != 'user_id' or len(rows) != 2501 or rows[5][2] != 'Name, "5"':
+        print(f"❌ CSV export wrong: {len(chunks)} chunks, {len(rows)} rows")
+        ok = False
+    
+    _, resumed = export('csv', after='1200')
+    resumed_rows = list(csv.reader(io.StringIO(resumed.decode())))
+    if [row[0] for row in resumed_rows] != [str(user_id) for user_id in range(1201, 2501)]:
+        print("❌ Resumed export should continue after the key without a header")
+        ok = False
+    
+    _, ndjson = export('ndjson', after='2490')
+    users = [json.loads(line) for line in ndjson.decode().splitlines()]
+    if [user['user_id'] for user in users] != list(range(2491, 2501)):
+        print("❌ NDJSON export wrong")
+        ok = False
+    
+    _, compressed = export('csv', compress=True)
+    if gzip.decompress(compressed) != data:
+        print("❌ Gzip export does not match the plain export")
+        ok = False
+    
+    # URI metacharacters in the database path must not change the file opened
+    odd_file = "test_exports #1?.db"
+    os.replace(db_file, odd_file)
+    try:
+        odd_chunks = list(export_chunks(odd_file, 'users', 'csv', batch_size=1000))
+    finally:
+        os.replace(odd_file, db_file)
+    if b''.join(odd_chunks) != data:
+        print("❌ Export from a path with '#' and '?' read the wrong database")
+        ok = False
+    
+    for args in (('nope', 'csv'), ('users', 'xml'), ('users', 'csv', 'abc')):
+        try:
+            parse_export(*args)
+            print(f"❌ Invalid export accepted: {args}")
+            ok = False
+        except ExportError:
+            pass
+    
+    if ok:
+        print(f"✅ Exported {len(rows) - 1} users in {len(chunks)} chunks")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_admin_panel_async():
+    """Test the aiohttp admin panel."""
+    print("\n" + "=" * 50)
+    print("Testing Async Admin Panel")
+    print("=" * 50)
+    
+    import os
+    from aiohttp.test_utils import TestClient, TestServer
+    import admin_panel
+    import admin_panel_async
+    db_file = "test_admin_async.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    for user_id in range(1, 121):
+        await db.add_user(user_id, f"user{user_id}", f"User {user_id}")
+    admin_panel.DB_PATH = db_file
+    
+    ok = True
+    async with TestClient(TestServer(admin_panel_async.create_app())) as client:
+        response = await client.get('/users')
+        if response.url.path != '/login':
+            print("❌ Anonymous request was not redirected to login")
+            ok = False
+        
+        await client.post('/login', data={
+            'username': admin_panel.ADMIN_USERNAME, 'password': admin_panel.ADMIN_PASSWORD
+        })
+        
+        # Many concurrent page views on one loop
+        paths = ['/', '/users', '/tickets', '/agents', '/settings', '/api/chart_data'] * 5
+        responses = await asyncio.gather(*(client.get(path) for path in paths))
+        if any(response.status != 200 for response in responses):
+            print(f"❌ Unexpected status codes: {set(r.status for r in responses)}")
+            ok = False
+        
+        page = await (await client.get('/users')).text()
+        if '/users?cursor=' not in page:
+            print("❌ Users page has no next page link")
+            ok = False
+        
+        await client.post('/settings', data={'free_limit': '15'})
+        await client.get('/toggle_premium/7')
+        user = await db.get_user(7)
+        if await db.get_setting('free_limit') != '15' or not user['is_premium']:
+            print("❌ Settings or premium toggle were not saved")
+            ok = False
+    
+    if ok:
+        print(f"✅ Served {len(paths)} concurrent requests")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_attachments_zip():
+    """Test streaming ticket attachments from a fake Bot API into a ZIP."""
+    print("\n" + "=" * 50)
+    print("Testing Attachments ZIP")
+    print("=" * 50)
+    
+    import io
+    import os
+    import zipfile
+    from aiohttp import web
+    from aiohttp.test_utils import TestClient, TestServer
+    import admin_panel
+    import admin_panel_async
+    from attachments import DOWNLOAD_CONCURRENCY
+    db_file = "test_attachments.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    await db.add_user(1, "alice", "Alice")
+    ticket_id = await db.create_ticket(1, "Broken thumbnail")
+    for i in range(8):
+        await db.add_ticket_attachment(ticket_id, f"photo{i}", f"u{i}", "photo")
+    await db.add_ticket_attachment(ticket_id, "doc", "udoc", "document", "report.pdf")
+    await db.add_ticket_attachment(ticket_id, "huge", "uhuge", "document", "huge.zip")
+    await db.add_ticket_attachment(ticket_id, "proxy", "uproxy", "document", "proxied.pdf")
+    await db.add_ticket_attachment(ticket_id, "list", "ulist", "document", "listed.pdf")
+    admin_panel.DB_PATH = db_file
+    
+    # Fake Bot API serving getFile and file downloads
+    active = {'now': 0, 'max': 0}
+    
+    async def get_file(request):
+        file_id = request.query['file_id']
+        if file_id == 'huge':
+            return web.json_response({'ok': False, 'description': 'Bad Request: file is too big'})
+        if file_id == 'proxy':
+            return web.Response(status=502, text='<html>502</html>', content_type='text/html')
+        if file_id == 'list':
+            return web.json_response([])
+        extension = 'pdf' if file_id == 'doc' else 'jpg'
+        return web.json_response({'ok': True, 'result': {'file_path': f'files/{file_id}.{extension}'}})
+    
+    async def download(request):
+        active['now'] += 1
+        active['max'] = max(active['max'], active['now'])
+        await asyncio.sleep(0.01)
+        active['now'] -= 1
+        return web.Response(body=f"content of {request.match_info['path']}".encode())
+    
+    fake_api = web.Application()
+    fake_api.router.add_get('/bottest-token/getFile', get_file)
+    fake_api.router.add_get('/file/bottest-token/{path:.+}', download)
+    
+    ok = True
+    async with TestServer(fake_api) as api_server:
+        admin_panel.BOT_TOKEN = 'test-token'
+        admin_panel.TELEGRAM_API_URL = str(api_server.make_url(''))
+        
+        async with TestClient(TestServer(admin_panel_async.create_app())) as client:
+            await client.post('/login', data={
+                'username': admin_panel.ADMIN_USERNAME, 'password': admin_panel.ADMIN_PASSWORD
+            })
+            response = await client.get(f'/download_attachments/{ticket_id}')
+            async_zip = await asyncio.wait_for(response.read(), 10)
+        
+        def flask_download():
+            client = admin_panel.app.test_client()
+            with client.session_transaction() as flask_session:
+                flask_session['logged_in'] = True
+            return client.get(f'/download_attachments/{ticket_id}').data
+        
+        flask_zip = await asyncio.wait_for(asyncio.to_thread(flask_download), 10)
+        admin_panel.runtime.stop()
+    
+    for data in (async_zip, flask_zip):
+        with zipfile.ZipFile(io.BytesIO(data)) as zipf:
+            names = set(zipf.namelist())
+            readme = zipf.read('README.txt').decode()
+            if (len(names) != 10 or zipf.read('09_report.pdf') != b'content of files/doc.pdf'
+                    or '01_photo.jpg' not in names or 'file is too big' not in readme
+                    or '11_proxied.pdf' not in readme or '12_listed.pdf' not in readme):
+                print(f"❌ Unexpected ZIP contents: {sorted(names)}")
+                ok = False
+    if active['max'] > DOWNLOAD_CONCURRENCY:
+        print(f"❌ {active['max']} downloads ran at once")
+        ok = False
+    
+    if ok:
+        print(f"✅ Streamed 9 of 12 attachments, at most {active['max']} downloads at once")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_page_cache():
+    """Test ETag revalidation and invalidation of cached admin pages."""
+    print("\n" + "=" * 50)
+    print("Testing Page Cache")
+    print("=" * 50)
+    
+    import os
+    from aiohttp.test_utils import TestClient, TestServer
+    import admin_panel
+    import admin_panel_async
+    db_file = "test_page_cache.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    for user_id in range(1, 51):
+        await db.add_user(user_id, f"user{user_id}", f"User {user_id}")
+    admin_panel.DB_PATH = db_file
+    
+    ok = True
+    async with TestClient(TestServer(admin_panel_async.create_app())) as client:
+        await client.post('/login', data={
+            'username': admin_panel.ADMIN_USERNAME, 'password': admin_panel.ADMIN_PASSWORD
+        })
+        
+        response = await client.get('/users')
+        etag = response.headers['ETag']
+        if response.headers.get('Content-Encoding') != 'gzip':
+            print("❌ Cached page was not served gzip-compressed")
+            ok = False
+        
+        statuses = [(await client.get(path, headers={'If-None-Match': etag})).status
+                    for path in ('/users', '/users?sort=user_id')]
+        if statuses != [304, 200]:
+            print(f"❌ Revalidation returned {statuses}, expected [304, 200]")
+            ok = False
+        
+        # A write from the bot moves the users generation on
+        await db.set_premium(7, True)
+        response = await client.get('/users', headers={'If-None-Match': etag})
+        if response.status != 200 or response.headers['ETag'] == etag:
+            print("❌ Page was not invalidated by a users write")
+            ok = False
+        
+        settings_etag = (await client.get('/settings')).headers['ETag']
+        await client.post('/settings', data={'free_limit': '12'})
+        response = await client.get('/settings', headers={'If-None-Match': settings_etag})
+        if response.status != 200 or 'value="12"' not in await response.text():
+            print("❌ Settings page was not invalidated by a settings write")
+            ok = False
+    
+    if ok:
+        print("✅ Unchanged pages revalidate with 304, writes invalidate them")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_admin_assets():
+    """Test precompiled admin templates and fingerprinted static assets."""
+    print("\n" + "=" * 50)
+    print("Testing Admin Assets")
+    print("=" * 50)
+    
+    import json
+    import os
+    import re
+    import admin_panel
+    db_file = "test_admin_assets.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    admin_panel.DB_PATH = db_file
+    
+    def fetch_assets():
+        client = admin_panel.app.test_client()
+        with client.session_transaction() as flask_session:
+            flask_session['logged_in'] = True
+        html = client.get('/').get_data(as_text=True)
+        chart_data = json.loads(re.search(r'id="chart-data"[^>]*>(.*?)</script>', html).group(1))
+        assets = [client.get(url) for url in re.findall(r'/assets/[\w.]+', html)]
+        revalidated = client.get(re.findall(r'/assets/[\w.]+', html)[0],
+                                 headers={'If-None-Match': assets[0].headers['ETag']})
+        missing = client.get('/assets/admin.css')
+        return html, chart_data, assets, revalidated.status_code, missing.status_code
+    
+    ok = True
+    html, chart_data, assets, revalidated, missing = await asyncio.to_thread(fetch_assets)
+    admin_panel.runtime.stop()
+    
+    if '<style>' in html or len(assets) != 2 or len(chart_data['user_growth']) != 7:
+        print("❌ Dashboard should link its stylesheet and script and embed chart data")
+        ok = False
+    if any(response.status_code != 200 or 'immutable' not in response.headers['Cache-Control']
+           for response in assets):
+        print("❌ Assets should be served with a long-lived cache header")
+        ok = False
+    if (revalidated, missing) != (304, 404):
+        print(f"❌ Revalidation/unknown asset returned {revalidated}/{missing}")
+        ok = False
+    
+    if ok:
+        print(f"✅ Dashboard links {len(assets)} fingerprinted assets")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_bulk_actions():
+    """Test bulk premium, ban and ticket status changes from the admin panel."""
+    print("\n" + "=" * 50)
+    print("Testing Bulk Admin Actions")
+    print("=" * 50)
+    
+    import os
+    from aiohttp.test_utils import TestClient, TestServer
+    import admin_panel
+    import admin_panel_async
+    db_file = "test_bulk_actions.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    for user_id in range(1, 3001):
+        await db.add_user(user_id, f"user{user_id}", f"User {user_id}")
+    ticket_ids = [await db.create_ticket(1, f"Issue {i}") for i in range(5)]
+    admin_panel.DB_PATH = db_file
+    
+    ok = True
+    async with TestClient(TestServer(admin_panel_async.create_app())) as client:
+        await client.post('/login', data={
+            'username': admin_panel.ADMIN_USERNAME, 'password': admin_panel.ADMIN_PASSWORD
+        })
+        
+        # Pasted list with a duplicate, across several IN (...) chunks
+        pasted = ', '.join(str(user_id) for user_id in range(1, 3001)) + ' 5'
+        response = await client.post('/users/bulk', data={'action': 'premium', 'days': '30', 'ids': pasted})
+        premium_updated = response.url.query.get('updated')
+        
+        # Checkbox selection
+        selected = [('action', 'ban')] + [('ids', str(user_id)) for user_id in range(1, 11)]
+        response = await client.post('/users/bulk', data=selected)
+        banned_updated = response.url.query.get('updated')
+        
+        resolve = [('status', 'resolved')] + [('ids', ticket_id) for ticket_id in ticket_ids[:3]]
+        response = await client.post('/tickets/bulk', data=resolve)
+        tickets_updated = response.url.query.get('updated')
+        
+        invalid = [
+            (await client.post('/users/bulk', data={'action': 'delete', 'ids': '1'})).status,
+            (await client.post('/users/bulk', data={'action': 'premium', 'ids': '1'})).status,
+            (await client.post('/users/bulk', data={'action': 'ban', 'ids': 'abc'})).status,
+            (await client.post('/tickets/bulk', data={'status': 'resolved'})).status,
+        ]
+    
+    counters = await db.get_stats_counters()
+    user = await db.get_user(3000)
+    ticket = await db.get_ticket(ticket_ids[0])
+    if (premium_updated, banned_updated, tickets_updated) != ('3000', '10', '3'):
+        print(f"❌ Reported counts {premium_updated}/{banned_updated}/{tickets_updated}, expected 3000/10/3")
+        ok = False
+    if (counters['users_premium'], counters['users_banned'], counters['tickets_open']) != (3000, 10, 2):
+        print(f"❌ Counters out of step after bulk updates: {counters}")
+        ok = False
+    if not user['premium_expiry'] or not ticket['resolved_at']:
+        print("❌ Premium expiry or resolved time was not set")
+        ok = False
+    if invalid != [400] * 4:
+        print(f"❌ Invalid bulk requests returned {invalid}")
+        ok = False
+    
+    if ok:
+        print("✅ Updated 3000 users and 3 tickets in bulk")
+    
+    os.remove(db_file)
+    return ok
+
+
+async def test_stats_stream():
+    """Test that live stats are computed once and fanned out to all subscribers."""
+    print("\n" + "=" * 50)
+    print("Testing Live Stats Stream")
+    print("=" * 50)
+    
+    from admin_panel import StatsStream
+    
+    computations = 0
+    
+    async def compute():
+        nonlocal computations
+        computations += 1
+        return {'today_requests': computations * 10, 'open_tickets': 3}
+    
+    stream = StatsStream(compute=compute, interval=0.05)
+    queues = [asyncio.Queue() for _ in range(5)]
+    for events in queues:
+        stream.subscribe(events.put_nowait)
+    
+    received = [[await events.get() for _ in range(3)] for events in queues]
+    for events in queues:
+        stream.unsubscribe(events.put_nowait)
+    await asyncio.sleep(0.1)
+    
+    ok = True
+    first_event, second_event = received[0][0], received[0][1]
+    if first_event[0] != 'snapshot' or second_event[0] != 'delta' or 'open_tickets' in second_event[1]:
+        print(f"❌ Expected a snapshot then deltas of changed values: {received[0]}")
+        ok = False
+    if any(events != received[0] for events in received):
+        print("❌ Subscribers received different events")
+        ok = False
+    if computations > 4 or not stream._task.done():
+        print(f"❌ {computations} computations for 5 subscribers, stream stopped: {stream._task.done()}")
+        ok = False
+    
+    if ok:
+        print(f"✅ {len(queues)} subscribers served by {computations} computations")
+    return ok
+
+
+async def test_user_languages():
+    """Test stored language preferences behind a bounded cache."""
+    print("\n" + "=" * 50)
+    print("Testing User Languages")
+    print("=" * 50)
+    
+    import os
+    db_file = "test_user_languages.db"
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    
+    db = Database(db_file)
+    await db.initialize()
+    for user_id in range(1, 6):
+        await db.add_user(user_id, f"user{user_id}", f"User {user_id}", language_code='en')
+    
+    ok = True
+    i18n = I18n(db=db, cache_size=3)
+    if not await i18n.set_user_language(1, 'es') or await i18n.set_user_language(2, 'xx'):
+        print("❌ Supported language rejected or unsupported one accepted")
+        ok = False
+    if await i18n.set_user_language(99, 'es'):
+        print("❌ Language saved for an unknown user")
+        ok = False
+    if not await i18n.set_user_language(3, 'HI-IN') or await db.get_user_language(3) != 'hi':
+        print(f"❌ Regional code not normalized: {await db.get_user_language(3)}")
+        ok = False
+    
+    # The cache stays bounded; evicted users are read back from the database
+    for user_id in range(1, 6):
+        await i18n.load_user_language(user_id)
+    if len(i18n.user_languages) != 3 or 1 in i18n.user_languages:
+        print(f"❌ Cache not bounded: {list(i18n.user_languages)}")
+        ok = False
+    if await i18n.load_user_language(1) != 'es':
+        print("❌ Evicted preference not reloaded")
+        ok = False
+    
+    # A restart keeps the preference; Telegram's language applies when none is stored
+    restarted = I18n(db=db)
+    if await restarted.load_user_language(1, 'hi') != 'es':
+        print("❌ Preference lost on restart")
+        ok = False
+    if await restarted.load_user_language(100, 'es-ES') != 'es':
+        print("❌ Telegram language not used for a new user")
+        ok = False
+    
+    if ok:
+        print(f"✅ Preferences persisted with {len(i18n.user_languages)} users cached")
+    
+    os.remove(db_file)
+    return ok
+
+
 def test_i18n():
     """Test internationalization."""
     print("\n" + "=" * 50)
@@ -151,9 +1794,81 @@ async def main():
     # Test database
     results.append(await test_database())
     
+    # Test pagination
+    results.append(await test_pagination())
+    
+    # Test statistics counters
+    results.append(await test_stats_counters())
+    
+    # Test settings
+    results.append(await test_settings())
+    
+    # Test usage rollup
+    results.append(await test_usage_rollup())
+    
+    # Test broadcast engine
+    results.append(await test_broadcast())
+    
+    # Test admin panel runtime
+    results.append(await test_admin_runtime())
+    
+    # Test user search
+    results.append(await test_user_search())
+    
+    # Test FAQ search
+    results.append(await test_faq_search())
+    
+    # Test in-memory FAQ index
+    results.append(await test_faq_index())
+    
+    # Test agent routing
+    results.append(await test_agent_routing())
+    
+    # Test agent loads
+    results.append(await test_agent_loads())
+    
+    # Test SLA timers
+    results.append(await test_sla_timers())
+    
+    # Test ticket IDs
+    results.append(await test_ticket_ids())
+    
+    # Test ticket opening
+    results.append(await test_open_ticket())
+    
+    # Test ticket replies
+    results.append(await test_ticket_replies())
+    
+    # Test ticket conversation paging
+    results.append(await test_ticket_thread())
+    
+    # Test exports
+    results.append(await test_exports())
+    
+    # Test async admin panel
+    results.append(await test_admin_panel_async())
+    
+    # Test attachment downloads
+    results.append(await test_attachments_zip())
+    
+    # Test page cache
+    results.append(await test_page_cache())
+    
+    # Test static assets
+    results.append(await test_admin_assets())
+    
+    # Test bulk admin actions
+    results.append(await test_bulk_actions())
+    
+    # Test live stats stream
+    results.append(await test_stats_stream())
+    
     # Test i18n
     results.append(test_i18n())
     
+    # Test user languages
+    results.append(await test_user_languages())
+    
     print("\n" + "=" * 50)
     print("Test Summary")
     print("=" * 50)